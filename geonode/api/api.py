@@ -1,19 +1,22 @@
+import hashlib
+
 from django.conf.urls import url
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Count
 from django.core.urlresolvers import reverse
 from django.contrib.contenttypes.models import ContentType
 from django.conf import settings
 
-from avatar.templatetags.avatar_tags import avatar_url
-from guardian.shortcuts import get_objects_for_user
-
-from geonode.base.models import TopicCategory
+from geonode.base.models import ResourceBase, TopicCategory
 from geonode.layers.models import Layer
 from geonode.maps.models import Map
 from geonode.documents.models import Document
-from geonode.groups.models import GroupProfile
+from geonode.groups.models import GroupProfile, GroupMember
+from geonode.people.models import cached_avatar_url
+from geonode.security.models import acl_version, filter_principals, user_principals
 
-from taggit.models import Tag
+from taggit.models import Tag, TaggedItem
 
 from tastypie import fields
 from tastypie.resources import ModelResource
@@ -36,8 +39,40 @@ class TypeFilteredResource(ModelResource):
 
     type_filter = None
 
+    def get_counts(self, resources, principals):
+        """Return the number of ``resources`` by object id, in a single
+           grouped query. ``principals`` is None if they are not filtered.
+        """
+        raise Exception('get_counts not implemented in the child class')
+
+    def counts(self, request):
+        """
+        Return the counts of the objects of the response, computed once per
+        request for the resources the user can view and cached
+        ``API_COUNTS_CACHE_TTL`` seconds for the same principals and type.
+        """
+        type_name = self.type_filter.__name__ if self.type_filter else 'all'
+        counts = getattr(request, '_type_counts', {})
+        key = (self._meta.resource_name, type_name)
+        if key not in counts:
+            principals = None
+            if not settings.SKIP_PERMS_FILTER:
+                principals = user_principals(request.user)
+            digest = hashlib.sha1(','.join(sorted(principals)) if principals is not None else '*')
+            cache_key = 'api_counts:%s:%s:%s:%s' % (
+                self._meta.resource_name, type_name, acl_version(), digest.hexdigest())
+            counts[key] = cache.get(cache_key)
+            if counts[key] is None:
+                resources = ResourceBase.objects.all()
+                if self.type_filter:
+                    resources = resources.instance_of(self.type_filter)
+                counts[key] = self.get_counts(filter_principals(resources, principals), principals)
+                cache.set(cache_key, counts[key], getattr(settings, 'API_COUNTS_CACHE_TTL', 60))
+            request._type_counts = counts
+        return counts[key]
+
     def dehydrate_count(self, bundle):
-        raise Exception('dehydrate_count not implemented in the child class')
+        return self.counts(bundle.request).get(bundle.obj.pk, 0)
 
     def build_filters(self, filters={}):
 
@@ -54,30 +89,13 @@ class TagResource(TypeFilteredResource):
 
     """Tags api"""
 
-    def dehydrate_count(self, bundle):
-        count = 0
-        if settings.SKIP_PERMS_FILTER:
-            if self.type_filter:
-                ctype = ContentType.objects.get_for_model(self.type_filter)
-                count = bundle.obj.taggit_taggeditem_items.filter(
-                    content_type=ctype).count()
-            else:
-                count = bundle.obj.taggit_taggeditem_items.count()
-        else:
-            resources = get_objects_for_user(
-                bundle.request.user,
-                'base.view_resourcebase').values_list(
-                'id',
-                flat=True)
-            if self.type_filter:
-                ctype = ContentType.objects.get_for_model(self.type_filter)
-                count = bundle.obj.taggit_taggeditem_items.filter(content_type=ctype).filter(object_id__in=resources)\
-                    .count()
-            else:
-                count = bundle.obj.taggit_taggeditem_items.filter(
-                    object_id__in=resources).count()
-
-        return count
+    def get_counts(self, resources, principals):
+        items = TaggedItem.objects.all()
+        if self.type_filter:
+            items = items.filter(content_type=ContentType.objects.get_for_model(self.type_filter))
+        if principals is not None:
+            items = items.filter(object_id__in=resources.values('id'))
+        return dict(items.values_list('tag').annotate(count=Count('id')))
 
     class Meta:
         queryset = Tag.objects.all()
@@ -92,19 +110,9 @@ class TopicCategoryResource(TypeFilteredResource):
 
     """Category api"""
 
-    def dehydrate_count(self, bundle):
-        if settings.SKIP_PERMS_FILTER:
-            return bundle.obj.resourcebase_set.instance_of(self.type_filter).count() if \
-                self.type_filter else bundle.obj.resourcebase_set.all().count()
-        else:
-            resources = bundle.obj.resourcebase_set.instance_of(self.type_filter) if \
-                self.type_filter else bundle.obj.resourcebase_set.all()
-            permitted = get_objects_for_user(
-                bundle.request.user,
-                'base.view_resourcebase').values_list(
-                'id',
-                flat=True)
-            return resources.filter(id__in=permitted).count()
+    def get_counts(self, resources, principals):
+        return dict(resources.filter(category__isnull=False).values_list('category').annotate(
+            count=Count('id')))
 
     class Meta:
         queryset = TopicCategory.objects.all()
@@ -123,10 +131,24 @@ class GroupResource(ModelResource):
     member_count = fields.IntegerField()
     manager_count = fields.IntegerField()
 
+    def get_object_list(self, request):
+        # the members of every group are counted by subqueries of the list
+        members = GroupMember._meta.db_table
+        groups = GroupProfile._meta.db_table
+        count = 'SELECT COUNT(%s) FROM %s WHERE %s.group_id = %s.id' % ('%s', members, members, groups)
+        return super(GroupResource, self).get_object_list(request).extra(select={
+            'member_total': count % '*',
+            'manager_total': count % ('DISTINCT %s.user_id' % members) + " AND %s.role = 'manager'" % members,
+        })
+
     def dehydrate_member_count(self, bundle):
+        if hasattr(bundle.obj, 'member_total'):
+            return bundle.obj.member_total
         return bundle.obj.member_queryset().count()
 
     def dehydrate_manager_count(self, bundle):
+        if hasattr(bundle.obj, 'manager_total'):
+            return bundle.obj.manager_total
         return bundle.obj.get_managers().count()
 
     def dehydrate_detail_url(self, bundle):
@@ -154,6 +176,46 @@ class ProfileResource(ModelResource):
     current_user = fields.BooleanField(default=False)
     activity_stream_url = fields.CharField(null=True)
 
+    # the resources counted for every profile
+    RESOURCE_COUNTS = (
+        ('layer_total', Layer),
+        ('map_total', Map),
+        ('document_total', Document),
+    )
+
+    def content_types(self, request):
+        """Return the content types of the profiles and of the counted
+           resources by model, looked up once per request.
+        """
+        if not hasattr(request, '_profile_content_types'):
+            request._profile_content_types = ContentType.objects.get_for_models(
+                get_user_model(), *[model for name, model in self.RESOURCE_COUNTS])
+        return request._profile_content_types
+
+    def get_object_list(self, request):
+        # the resources of every profile are counted by subqueries of the list
+        ctypes = self.content_types(request)
+        resources = ResourceBase._meta.db_table
+        profiles = get_user_model()._meta.db_table
+        return super(ProfileResource, self).get_object_list(request).extra(select=dict(
+            (name, 'SELECT COUNT(*) FROM %s WHERE %s.owner_id = %s.id AND %s.polymorphic_ctype_id = %d' % (
+                resources, resources, profiles, resources, ctypes[model].pk))
+            for name, model in self.RESOURCE_COUNTS))
+
+    def resource_count(self, bundle, name):
+        if not hasattr(bundle.obj, name):
+            # the profiles nested in other resources are not annotated, their
+            # resources are counted by a single query per owner and request
+            counts = getattr(bundle.request, '_profile_counts', {})
+            if bundle.obj.pk not in counts:
+                counts[bundle.obj.pk] = dict(ResourceBase.objects.filter(owner=bundle.obj).values_list(
+                    'polymorphic_ctype').annotate(count=Count('id')))
+                bundle.request._profile_counts = counts
+            ctypes = self.content_types(bundle.request)
+            for attribute, model in self.RESOURCE_COUNTS:
+                setattr(bundle.obj, attribute, counts[bundle.obj.pk].get(ctypes[model].pk, 0))
+        return getattr(bundle.obj, name)
+
     def build_filters(self, filters={}):
         """adds filtering by group functionality"""
 
@@ -188,16 +250,16 @@ class ProfileResource(ModelResource):
         return email
 
     def dehydrate_layers_count(self, bundle):
-        return bundle.obj.resourcebase_set.instance_of(Layer).distinct().count()
+        return self.resource_count(bundle, 'layer_total')
 
     def dehydrate_maps_count(self, bundle):
-        return bundle.obj.resourcebase_set.instance_of(Map).distinct().count()
+        return self.resource_count(bundle, 'map_total')
 
     def dehydrate_documents_count(self, bundle):
-        return bundle.obj.resourcebase_set.instance_of(Document).distinct().count()
+        return self.resource_count(bundle, 'document_total')
 
     def dehydrate_avatar_100(self, bundle):
-        return avatar_url(bundle.obj, 100)
+        return cached_avatar_url(bundle.obj, 100)
 
     def dehydrate_profile_detail_url(self, bundle):
         return bundle.obj.get_absolute_url()
@@ -209,8 +271,7 @@ class ProfileResource(ModelResource):
         return reverse(
             'actstream_actor',
             kwargs={
-                'content_type_id': ContentType.objects.get_for_model(
-                    bundle.obj).pk,
+                'content_type_id': self.content_types(bundle.request)[get_user_model()].pk,
                 'object_id': bundle.obj.pk})
 
     def prepend_urls(self):
@@ -1,7 +1,7 @@
 from tastypie.authorization import DjangoAuthorization
 from tastypie.exceptions import Unauthorized
 
-from guardian.shortcuts import get_objects_for_user
+from geonode.security.models import visible_resources
 
 
 class GeoNodeAuthorization(DjangoAuthorization):
@@ -10,13 +10,7 @@ class GeoNodeAuthorization(DjangoAuthorization):
     permission system"""
 
     def read_list(self, object_list, bundle):
-        permitted_ids = get_objects_for_user(
-            bundle.request.user,
-            'base.view_resourcebase').values_list(
-            'id',
-            flat=True)
-
-        return object_list.filter(id__in=permitted_ids)
+        return visible_resources(bundle.request.user, object_list)
 
     def read_detail(self, object_list, bundle):
         return bundle.request.user.has_perm(
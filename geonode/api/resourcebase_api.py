@@ -1,4 +1,7 @@
 import re
+import json
+import hashlib
+from django.core.cache import cache
 from django.db.models import Q
 from django.http import HttpResponse
 from django.conf import settings
@@ -8,10 +11,9 @@ from tastypie.resources import ModelResource
 from tastypie import fields
 from tastypie.utils import trailing_slash
 
-from guardian.shortcuts import get_objects_for_user
+from geonode.security.models import acl_version, user_principals
 
 from django.conf.urls import url
-from django.core.paginator import Paginator, InvalidPage
 from django.http import Http404
 
 from tastypie.utils.mime import build_content_type
@@ -35,6 +37,9 @@ LAYER_SUBTYPES = {
 }
 FILTER_TYPES.update(LAYER_SUBTYPES)
 
+# the fields faceted by the search
+SEARCH_FACETS = ('type', 'subtype', 'owner', 'keywords', 'category')
+
 
 class CommonMetaApi:
     authorization = GeoNodeAuthorization()
@@ -278,6 +283,12 @@ class CommonModelApi(ModelResource):
 
         return sqs
 
+    def _facets_cache_key(self, request):
+        params = sorted((name, sorted(request.GET.getlist(name))) for name in request.GET
+                        if name not in ('limit', 'offset', 'order_by'))
+        digest = hashlib.sha1(json.dumps(params)).hexdigest()
+        return 'search_facets:%s:%s:%s' % (self._meta.resource_name, acl_version(), digest)
+
     def get_search(self, request, **kwargs):
         self.method_check(request, allowed=['get'])
         self.is_authenticated(request)
@@ -287,68 +298,57 @@ class CommonModelApi(ModelResource):
         sqs = self.build_haystack_filters(request.GET)
 
         if not settings.SKIP_PERMS_FILTER:
-            # Get the list of objects the user has access to
-            filter_set = set(
-                get_objects_for_user(
-                    request.user,
-                    'base.view_resourcebase').values_list(
-                    'id',
-                    flat=True))
-
-            # Do the query using the filterset and the query term. Facet the
-            # results
-            if len(filter_set) > 0:
-                sqs = sqs.filter(oid__in=filter_set).facet('type').facet('subtype').facet('owner').facet('keywords')\
-                    .facet('category')
-            else:
-                sqs = None
-        else:
-            sqs = sqs.facet('type').facet('subtype').facet(
-                'owner').facet('keywords').facet('category')
-
-        if sqs:
-            # Build the Facet dict
-            facets = {}
-            for facet in sqs.facet_counts()['fields']:
-                facets[facet] = {}
-                for item in sqs.facet_counts()['fields'][facet]:
-                    facets[facet][item[0]] = item[1]
-
-            # Paginate the results
-            paginator = Paginator(sqs, request.GET.get('limit'))
-
-            try:
-                page = paginator.page(
-                    int(request.GET.get('offset')) /
-                    int(request.GET.get('limit'), 0) + 1)
-            except InvalidPage:
-                raise Http404("Sorry, no results on that page.")
-
-            if page.has_previous():
-                previous_page = page.previous_page_number()
-            else:
-                previous_page = 1
-            if page.has_next():
-                next_page = page.next_page_number()
-            else:
-                next_page = 1
-            total_count = sqs.count()
-            objects = page.object_list
-        else:
-            next_page = 0
-            previous_page = 0
-            total_count = 0
-            facets = {}
-            objects = []
+            # Filter on the principals of the user, indexed with the
+            # resources they can view
+            principals = user_principals(request.user)
+            if principals is not None:
+                sqs = sqs.filter(visibility__in=principals)
+
+        try:
+            limit = int(request.GET.get('limit') or settings.CLIENT_RESULTS_LIMIT)
+            offset = int(request.GET.get('offset') or 0)
+        except ValueError:
+            raise Http404("Sorry, no results on that page.")
+        if self._meta.max_limit:
+            limit = min(limit, self._meta.max_limit)
+        limit = max(limit, 1)
+        offset = max(offset, 0)
+
+        # The facets of the anonymous users only depend on the query
+        facets = None
+        cache_key = None
+        facets_ttl = getattr(settings, 'SEARCH_FACETS_CACHE_TTL', 60)
+        if facets_ttl and not request.user.is_authenticated():
+            cache_key = self._facets_cache_key(request)
+            facets = cache.get(cache_key)
+        if facets is None:
+            for field in SEARCH_FACETS:
+                sqs = sqs.facet(field)
+
+        # A single backend query returns the page of results, the number of
+        # hits and the facets
+        objects = list(sqs[offset:offset + limit])
+        total_count = sqs.count()
+        if facets is None:
+            facets = dict((field, dict(items))
+                          for field, items in sqs.facet_counts().get('fields', {}).items())
+            if cache_key:
+                cache.set(cache_key, facets, facets_ttl)
+
+        if offset and offset >= total_count:
+            raise Http404("Sorry, no results on that page.")
+        page = offset // limit + 1
+        previous_page = page - 1 if page > 1 else 1
+        next_page = page + 1 if offset + limit < total_count else 1
 
         object_list = {
-           "meta": {"limit": 100,  # noqa
-                    "next": next_page,
-                    "offset": int(getattr(request.GET, 'offset', 0)),
-                    "previous": previous_page,
-                    "total_count": total_count,
-                    "facets": facets,
-                    },
+            "meta": {"limit": limit,
+                     "next": next_page,
+                     "offset": offset,
+                     "previous": previous_page,
+                     "total_count": total_count,
+                     "facets": facets,
+                     },
             'objects': map(lambda x: x.get_stored_fields(), objects),
         }
         self.log_throttled_access(request)
@@ -196,3 +196,29 @@ class SearchApiTests(ResourceTestCase):
         resp = self.api_client.get(filter_url)
         self.assertValidJSONResponse(resp)
         self.assertEquals(len(self.deserialize(resp)['objects']), 4)
+
+    def test_keyword_and_category_counts(self):
+        """Test the counts of resources by keyword and category"""
+
+        def counts(resource_name, key):
+            url = reverse('api_dispatch_list', kwargs={'api_name': 'api', 'resource_name': resource_name})
+            resp = self.api_client.get(url + '?type=layer')
+            self.assertValidJSONResponse(resp)
+            return dict((o[key], o['count']) for o in self.deserialize(resp)['objects'])
+
+        self.assertEquals(counts('keywords', 'slug')['populartag'], 8)
+        self.assertEquals(counts('keywords', 'slug')['layertagunique'], 1)
+        self.assertEquals(counts('categories', 'identifier')['location'], 3)
+
+        # the counts only include the resources the user can view
+        Layer.objects.all()[0].set_permissions({"users": {}, "groups": {}})
+        self.assertEquals(counts('keywords', 'slug')['populartag'], 7)
+
+    def test_profile_counts(self):
+        """Test the counts of resources listed with the profiles"""
+
+        url = reverse('api_dispatch_list', kwargs={'api_name': 'api', 'resource_name': 'profiles'})
+        resp = self.api_client.get(url + '?username=user1')
+        self.assertValidJSONResponse(resp)
+        profile = self.deserialize(resp)['objects'][0]
+        self.assertEquals(profile['layers_count'], 2)
@@ -1,16 +1,23 @@
 import datetime
+import hashlib
 import math
 import os
 import logging
 
-from django.db import models
+from urlparse import urlparse, urljoin
+
+from django.db import models, transaction
 from django.db.models import Q
+from django.utils.encoding import force_text
+from django.utils import translation
 from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import ValidationError
 from django.conf import settings
 from django.contrib.staticfiles.templatetags import staticfiles
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.db.models import signals
 
 from mptt.models import MPTTModel, TreeForeignKey
@@ -157,6 +164,10 @@ class Thumbnail(models.Model):
     version = models.PositiveSmallIntegerField(null=True, default=0)
 
     def _delete_thumb(self):
+        # the files are named after their content, identical images
+        # are shared by several thumbnails.
+        if Thumbnail.objects.filter(thumb_file=self.thumb_file.name).exclude(pk=self.pk).exists():
+            return
         try:
             self.thumb_file.delete()
         except OSError:
@@ -545,6 +556,41 @@ class ResourceBase(PolymorphicModel, PermissionLevelMixin):
 
         return os.path.exists(self.thumbnail_set.get().thumb_file.path)
 
+    def save_thumbnail(self, image, spec=None):
+        """Store the thumbnail image of the resource and return its url.
+
+           The file is named after the digest of the image: an identical
+           image is not written again and the url changes with the image.
+           ``spec`` is kept in ``Thumbnail.thumb_spec``.
+        """
+        name = 'thumbs/%s.png' % hashlib.sha1(image).hexdigest()
+        if not default_storage.exists(name):
+            name = default_storage.save(name, ContentFile(image))
+
+        resource = self.get_self_resource()
+        thumbnails = list(Thumbnail.objects.filter(resourcebase=resource))
+        thumbnail = thumbnails[0] if thumbnails else Thumbnail(resourcebase=resource)
+        previous = thumbnail.thumb_file.name if thumbnail.pk else None
+        thumbnail.thumb_file = name
+        thumbnail.thumb_spec = spec
+        thumbnail.save()
+        for extra in thumbnails[1:]:
+            extra.delete()
+        if previous and previous != name and \
+                not Thumbnail.objects.filter(thumb_file=previous).exists():
+            try:
+                default_storage.delete(previous)
+            except OSError:
+                pass
+
+        url = urljoin(settings.SITEURL, default_storage.url(name))
+        if not Link.objects.filter(resource=resource, name='Thumbnail').update(url=url):
+            Link.objects.create(resource=resource, url=url, name='Thumbnail',
+                                extension='png', mime='image/png', link_type='image')
+        ResourceBase.objects.filter(id=resource.id).update(thumbnail_url=url)
+        self.thumbnail_url = url
+        return url
+
     def set_missing_info(self):
         """Set default permissions and point of contacts.
 
@@ -672,9 +718,105 @@ class Link(models.Model):
         return '%s link' % self.link_type
 
 
+class LinkSet(object):
+    """The links a batch of resources should have, applied with a few
+       bulk queries.
+
+       The links of a resource are identified by their type and untranslated
+       name, the name is stored in the active language. When the set is
+       applied the existing links of the resources are read in one query
+       and matched by name, in any language as long as their url did not
+       change. The ones whose url, extension or mime changed are replaced:
+       they are deleted and inserted again with the missing ones, with a
+       single delete and a single insert. Links that are not in the set are
+       kept, unless ``keep_hosts`` is given and their url points to another
+       host.
+    """
+
+    fields = ('url', 'extension', 'mime')
+
+    def __init__(self, keep_hosts=None):
+        self.keep_hosts = keep_hosts
+        self.links = {}
+
+    def add(self, resource, link_type, name, url, extension, mime):
+        # the lazy translations give their message id without a language
+        with translation.override(None):
+            key = (force_text(link_type), force_text(name))
+        self.links.setdefault(resource.id, {})[key] = dict(
+            name=force_text(name),
+            url=force_text(url),
+            extension=force_text(extension),
+            mime=force_text(mime))
+
+    def _match(self, link):
+        """Return the key of the link of the set an existing link is, None
+           if it is not in the set.
+        """
+        wanted = self.links[link.resource_id]
+        key = (link.link_type, link.name)
+        if key in wanted:
+            return key
+        for key, fields in wanted.items():
+            # stored in the active language, or in another one at the same url
+            if key[0] == link.link_type and (link.name == fields['name'] or link.url == fields['url']):
+                return key
+        return None
+
+    def apply(self, batch_size=500):
+        """Write the links of the set, returns the number of links created,
+           updated and deleted.
+        """
+        stats = dict(created=0, updated=0, deleted=0)
+        resource_ids = sorted(self.links)
+        for i in range(0, len(resource_ids), batch_size):
+            with transaction.atomic():
+                self._apply(resource_ids[i:i + batch_size], stats)
+        return stats
+
+    def _apply(self, resource_ids, stats):
+        found = set()
+        deleted = []
+        replaced = []
+        for link in Link.objects.filter(resource__in=resource_ids).order_by('id'):
+            key = self._match(link)
+            wanted = self.links[link.resource_id].get(key)
+            if wanted is None:
+                if self.keep_hosts is not None and \
+                        urlparse(link.url).hostname not in self.keep_hosts:
+                    deleted.append(link.id)
+            elif (link.resource_id, key) in found:
+                deleted.append(link.id)
+            else:
+                found.add((link.resource_id, key))
+                changes = dict((f, wanted[f]) for f in self.fields if getattr(link, f) != wanted[f])
+                if changes:
+                    # no foreign key points to the links, they are replaced
+                    # instead of updated one by one.
+                    deleted.append(link.id)
+                    for f, value in changes.items():
+                        setattr(link, f, value)
+                    link.id = None
+                    replaced.append(link)
+
+        if deleted:
+            Link.objects.filter(id__in=deleted).delete()
+            stats['deleted'] += len(deleted) - len(replaced)
+        stats['updated'] += len(replaced)
+
+        created = [Link(resource_id=resource_id, link_type=link_type, name=fields['name'],
+                        **dict((f, fields[f]) for f in self.fields))
+                   for resource_id in resource_ids
+                   for (link_type, name), fields in self.links[resource_id].items()
+                   if (resource_id, (link_type, name)) not in found]
+        Link.objects.bulk_create(replaced + created)
+        stats['created'] += len(created)
+
+
 def resourcebase_pre_delete(instance):
-    if instance.thumbnail_set.exists():
-        instance.thumbnail_set.get().thumb_file.delete()
+    # the image may be shared with the thumbnails of other resources
+    for thumbnail in instance.thumbnail_set.all():
+        thumbnail._delete_thumb()
 
 
 def resourcebase_post_save(instance, *args, **kwargs):
@@ -1,5 +1,6 @@
 from django.test import TestCase
-from geonode.base.models import ResourceBase
+from django.core.files.storage import default_storage
+from geonode.base.models import ResourceBase, Link, LinkSet, Thumbnail
 
 
 class ThumbnailTests(TestCase):
@@ -18,3 +19,78 @@ class ThumbnailTests(TestCase):
         self.assertFalse(self.rb.has_thumbnail())
         missing = self.rb.get_thumbnail_url()
         self.assertEquals('/static/geonode/img/missing_thumb.png', missing)
+
+    def test_save_thumbnail(self):
+        other = ResourceBase.objects.create()
+        url = self.rb.save_thumbnail('image', spec='spec')
+        self.assertEquals(other.save_thumbnail('image'), url)
+        self.assertTrue(self.rb.has_thumbnail())
+        name = self.rb.thumbnail_set.get().thumb_file.name
+        self.assertEquals(self.rb.thumbnail_set.get().thumb_spec, 'spec')
+        self.assertEquals(ResourceBase.objects.get(pk=self.rb.pk).get_thumbnail_url(), url)
+
+        # the file shared by identical images is kept until none uses it
+        other.thumbnail_set.get().delete()
+        self.assertTrue(default_storage.exists(name))
+        new_url = self.rb.save_thumbnail('other image')
+        self.assertNotEquals(new_url, url)
+        self.assertFalse(default_storage.exists(name))
+        self.assertEquals(Thumbnail.objects.filter(resourcebase=self.rb).count(), 1)
+        self.assertEquals(self.rb.link_set.filter(name='Thumbnail').count(), 1)
+
+    def test_delete_shared_thumbnail(self):
+        other = ResourceBase.objects.create()
+        self.rb.save_thumbnail('image')
+        other.save_thumbnail('image')
+        name = other.thumbnail_set.get().thumb_file.name
+
+        # deleting one of the resources keeps the image of the other one
+        self.rb.delete()
+        self.assertTrue(default_storage.exists(name))
+        other.delete()
+        self.assertFalse(default_storage.exists(name))
+
+
+class LinkSetTests(TestCase):
+
+    def setUp(self):
+        self.rb = ResourceBase.objects.create()
+
+    def test_apply(self):
+        Link.objects.create(resource=self.rb, link_type='image', name='PNG', extension='png',
+                            mime='image/png', url='http://localhost/wms?bbox=0,0,1,1')
+        Link.objects.create(resource=self.rb, link_type='data', name='KML', extension='kml',
+                            mime='text/xml', url='http://old.example.com/wms/kml')
+        Link.objects.create(resource=self.rb, link_type='metadata', name='ISO', extension='xml',
+                            mime='text/xml', url='http://localhost/csw')
+
+        links = LinkSet(keep_hosts=set(['localhost']))
+        links.add(self.rb, 'image', 'PNG', 'http://localhost/wms?bbox=0,0,2,2', 'png', 'image/png')
+        links.add(self.rb, 'data', 'KML', 'http://localhost/wms/kml', 'kml', 'text/xml')
+        links.add(self.rb, 'html', 'Page', 'http://localhost/layers/1', 'html', 'text/html')
+        self.assertEquals(links.apply(), dict(created=1, updated=2, deleted=0))
+
+        urls = dict(self.rb.link_set.values_list('name', 'url'))
+        self.assertEquals(urls, {
+            'PNG': 'http://localhost/wms?bbox=0,0,2,2',
+            'KML': 'http://localhost/wms/kml',
+            'ISO': 'http://localhost/csw',
+            'Page': 'http://localhost/layers/1',
+        })
+
+        # links of other hosts that are not in the set are removed
+        Link.objects.create(resource=self.rb, link_type='image', name='Tiles', extension='tiles',
+                            mime='image/png', url='http://old.example.com/gwc')
+        self.assertEquals(links.apply(), dict(created=0, updated=0, deleted=1))
+        self.assertEquals(self.rb.link_set.count(), 4)
+
+    def test_apply_translated_names(self):
+        from django.utils.translation import ugettext_lazy as _
+        Link.objects.create(resource=self.rb, link_type='image', name='Legende', extension='png',
+                            mime='image/png', url='http://localhost/legend')
+
+        # the link stored in another language is found by its url
+        links = LinkSet(keep_hosts=set(['localhost']))
+        links.add(self.rb, 'image', _('Legend'), 'http://localhost/legend', 'png', 'image/png')
+        self.assertEquals(links.apply(), dict(created=0, updated=0, deleted=0))
+        self.assertEquals(self.rb.link_set.count(), 1)
@@ -1,4 +1,5 @@
 from haystack import indexes
+from geonode.security.models import resource_principals
 from geonode.documents.models import Document
 
 
@@ -20,6 +21,8 @@ class DocumentIndex(indexes.SearchIndex, indexes.Indexable):
     popular_count = indexes.IntegerField(model_attr="popular_count", default=0)
     keywords = indexes.MultiValueField(model_attr="keyword_list", indexed=False, null=True, faceted=True)
     thumbnail_url = indexes.CharField(model_attr="thumbnail_url", null=True)
+    # the principals allowed to view the resource
+    visibility = indexes.MultiValueField(null=True)
 
     def get_model(self):
         return Document
@@ -29,3 +32,6 @@ class DocumentIndex(indexes.SearchIndex, indexes.Indexable):
 
     def prepare_title_sortable(self, obj):
         return obj.title.lower().lstrip()
+
+    def prepare_visibility(self, obj):
+        return resource_principals(obj.pk)
@@ -0,0 +1,250 @@
+#########################################################################
+#
+# Copyright (C) 2012 OpenPlans
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+"""Engine building the archives of the layer and map batch downloads.
+
+The data of every layer is fetched from GeoServer, as a zipped shapefile
+through WFS or as a GeoTIFF through WCS, by a bounded pool of threads. The
+files are appended to a zip64 archive as soon as they are received, in a
+background job reporting its progress in a ``BatchDownload`` row. The
+archives are kept for ``BATCH_DOWNLOAD_CACHE_TTL`` seconds and shared by
+the downloads of the same layers while none of them changed.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import zipfile
+import datetime
+import tempfile
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.db import IntegrityError
+
+from geonode import GeoNodeException
+from geonode.workers import WorkerPool
+from geonode.geoserver.models import BatchDownload, LayerFingerprint
+from geonode.geoserver.helpers import ogc_server_settings, http_client
+from geonode.geoserver.helpers import describe_coverage, _coverage_grid_extent
+from geonode.geoserver.ows import _wcs_link, _wfs_link
+from geonode.layers.models import Layer
+
+logger = logging.getLogger(__name__)
+
+# jobs queued or running without any progress for this long are
+# considered lost, e.g. with the process that was running them.
+STALE_AFTER = datetime.timedelta(hours=1)
+
+README = """This data is provided by GeoNode.
+
+Contents:
+"""
+
+
+class DownloadCancelled(Exception):
+    pass
+
+
+def download_root():
+    root = getattr(settings, 'BATCH_DOWNLOAD_ROOT',
+                   os.path.join(tempfile.gettempdir(), 'geonode_downloads'))
+    try:
+        os.makedirs(root)
+    except OSError:
+        if not os.path.isdir(root):
+            raise
+    return root
+
+
+def archive_path(job):
+    return os.path.join(download_root(), '%s.zip' % job.key)
+
+
+def archive_key(layers):
+    """Return a digest of the typenames of ``layers`` and of the versions
+       of their data: the upload session, replaced when the data is
+       uploaded or replaced, and the GeoServer fingerprint.
+    """
+    fingerprints = dict(LayerFingerprint.objects.filter(
+        layer__in=[layer.pk for layer in layers]).values_list('layer', 'last_updated'))
+    digest = hashlib.sha1()
+    for layer in sorted(layers, key=lambda l: l.typename):
+        digest.update('%s|%s|%s|%s\n' % (layer.typename.encode('utf-8'),
+                                         layer.date.isoformat(),
+                                         layer.upload_session_id,
+                                         fingerprints.get(layer.pk, '')))
+    return digest.hexdigest()
+
+
+def layer_download_url(layer):
+    """Return the url of the data of a layer on GeoServer and the extension
+       of the file.
+    """
+    typename = layer.typename.encode('utf-8')
+    if layer.storeType == 'coverageStore':
+        width, height = _coverage_grid_extent(describe_coverage(layer.typename))[:2]
+        bbox = [layer.bbox_x0, layer.bbox_y0, layer.bbox_x1, layer.bbox_y1]
+        url = _wcs_link(ogc_server_settings.LOCATION + 'wcs?', typename, 'GeoTIFF',
+                        bbox, layer.srid, height, width, '1.0.0')
+        return url, 'tif'
+    url = _wfs_link(ogc_server_settings.LOCATION + 'wfs?', typename, 'SHAPE-ZIP',
+                    {'format_options': 'charset:UTF-8'})
+    return url, 'zip'
+
+
+def layer_filename(layer):
+    """Return the name of the files of a layer in an archive, from its
+       typename so the layers of different workspaces do not collide.
+    """
+    return layer.typename.replace(':', '_')
+
+
+def _fetch_layer(args):
+    """Write the data of a layer to a file of ``directory``, in chunks.
+       Returns ``(layer, filename, error)``.
+    """
+    layer, directory = args
+    try:
+        url, extension = layer_download_url(layer)
+        filename = os.path.join(directory, '%s.%s' % (layer_filename(layer), extension))
+        response, body = http_client.stream(url)
+        with open(filename, 'wb') as f:
+            for chunk in body:
+                f.write(chunk)
+        # GeoServer reports the errors in XML documents
+        if response.status != 200 or 'xml' in response.get('content-type', ''):
+            raise GeoNodeException('GeoServer returned %s (%s)' % (
+                response.status, response.get('content-type')))
+        return layer, filename, None
+    except Exception as e:
+        return layer, None, '%s: %s' % (layer.typename, e)
+
+
+def run_batch_download(job_id):
+    """Build the archive of a download job.
+    """
+    try:
+        job = BatchDownload.objects.get(pk=job_id)
+    except BatchDownload.DoesNotExist:
+        return
+    if job.status != 'queued':
+        return
+    jobs = BatchDownload.objects.filter(pk=job.pk)
+    jobs.update(status='running', last_updated=datetime.datetime.now())
+
+    layers = list(Layer.objects.filter(typename__in=json.loads(job.layers)))
+    directory = tempfile.mkdtemp(dir=download_root())
+    partial = os.path.join(directory, 'archive.zip')
+    workers = getattr(settings, 'BATCH_DOWNLOAD_WORKERS', 4)
+    pool = ThreadPool(max(1, min(workers, len(layers))))
+    try:
+        with zipfile.ZipFile(partial, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+            archive.writestr('README.txt', README + ''.join(
+                '%s - %s.*\n' % (layer.title.encode('utf-8'), layer_filename(layer).encode('utf-8'))
+                for layer in layers))
+            fetched = pool.imap_unordered(_fetch_layer, [(layer, directory) for layer in layers])
+            for done, (layer, filename, error) in enumerate(fetched, 1):
+                if error is not None:
+                    raise GeoNodeException(error)
+                # the shapefiles and GeoTIFFs are compressed already
+                archive.write(filename, os.path.basename(filename), zipfile.ZIP_STORED)
+                os.remove(filename)
+                # the job is cancelled by changing its status
+                if not jobs.filter(status='running').update(
+                        progress=100 * done // len(layers),
+                        last_updated=datetime.datetime.now()):
+                    raise DownloadCancelled()
+        path = archive_path(job)
+        os.rename(partial, path)
+        jobs.update(status='finished', progress=100, size=os.path.getsize(path),
+                    last_updated=datetime.datetime.now())
+    except DownloadCancelled:
+        logger.info('Batch download %s was cancelled', job.pk)
+    except Exception as e:
+        logger.exception('Batch download %s failed', job.pk)
+        jobs.update(status='failed', error=str(e), last_updated=datetime.datetime.now())
+    finally:
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def start_batch_download(layers, owner=None):
+    """
+    Return the download job of the data of ``layers``: the one building or
+    having built the same archive if it is still valid, else a new job
+    queued in the background.
+    """
+    layers = list(layers)
+    key = archive_key(layers)
+    now = datetime.datetime.now()
+    ttl = datetime.timedelta(seconds=getattr(settings, 'BATCH_DOWNLOAD_CACHE_TTL', 24 * 60 * 60))
+
+    for job in BatchDownload.objects.filter(key=key):
+        if job.status in ('queued', 'running') and job.last_updated > now - STALE_AFTER:
+            return job
+        if job.status == 'finished' and job.last_updated > now - ttl and \
+                os.path.exists(archive_path(job)):
+            return job
+        delete_batch_download(job)
+
+    try:
+        job = BatchDownload.objects.create(
+            key=key,
+            layers=json.dumps(sorted(layer.typename for layer in layers)),
+            owner=owner if owner is not None and owner.is_authenticated() else None)
+    except IntegrityError:
+        # another request queued the same download meanwhile
+        return BatchDownload.objects.get(key=key)
+    download_workers.submit(job.pk, run_batch_download, job.pk)
+    return job
+
+
+def cancel_batch_download(job):
+    BatchDownload.objects.filter(pk=job.pk, status__in=('queued', 'running')).update(
+        status='cancelled', last_updated=datetime.datetime.now())
+
+
+def delete_batch_download(job):
+    try:
+        os.remove(archive_path(job))
+    except OSError:
+        pass
+    job.delete()
+
+
+def batch_download_status(job):
+    """The status of a job, as reported by the GeoServer batchDownload
+       plugin this engine replaces.
+    """
+    return {
+        'id': job.pk,
+        'process': {
+            'id': job.pk,
+            'status': job.status.upper(),
+            'progress': job.progress,
+            'error': job.error,
+        }
+    }
+
+
+download_workers = WorkerPool('batch_download')
@@ -0,0 +1,267 @@
+#########################################################################
+#
+# Copyright (C) 2012 OpenPlans
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+"""Seeding and truncation of the GeoWebCache tiles of the layers.
+
+The jobs are recorded in ``TileJob`` rows and sent to the GeoWebCache REST
+API by a dispatcher running in the background: the truncations at once,
+the seeding tasks by order of priority while GeoWebCache runs fewer than
+``GWC_SEED_MAX_TASKS`` of them. The progress of the running tasks is polled
+from GeoWebCache, which reports it by layer.
+"""
+
+import json
+import time
+import urllib
+import logging
+import datetime
+import threading
+
+from geonode import GeoNodeException
+from geonode.geoserver.helpers import ogc_server_settings, http_client
+from geonode.geoserver.models import TileJob
+from geonode.utils import forward_mercator
+from geonode.workers import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+# seconds between two polls of the progress of the running tasks
+POLL_INTERVAL = 10
+# status of the GeoWebCache tasks still to complete
+GWC_ACTIVE = (0, 1)
+MERCATOR_GRIDSETS = ('EPSG:900913', 'EPSG:3857')
+MAX_LATITUDE = 85.0511
+
+_dispatch_lock = threading.Lock()
+
+
+def _rest_url(path):
+    return ogc_server_settings.LOCATION + 'gwc/rest/' + path
+
+
+def _request(path, body, content_type):
+    response, content = http_client.request(
+        _rest_url(path), 'POST', body=body, headers={'Content-Type': content_type})
+    if response.status not in (200, 201, 204):
+        raise GeoNodeException('GeoWebCache returned %s: %s' % (response.status, content[:500]))
+    return content
+
+
+def gridset_bbox(bbox, gridset):
+    """Return a lon/lat bounding box in the CRS of a gridset, None if the
+       CRS is not known.
+    """
+    x0, y0, x1, y1 = [float(c) for c in bbox]
+    if gridset == 'EPSG:4326':
+        return [x0, y0, x1, y1]
+    if gridset in MERCATOR_GRIDSETS:
+        def clamp(lat):
+            return max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+        x0, y0 = forward_mercator((x0, clamp(y0)))
+        x1, y1 = forward_mercator((x1, clamp(y1)))
+        return [x0, y0, x1, y1]
+    return None
+
+
+def layer_bbox(layer):
+    bbox = [layer.bbox_x0, layer.bbox_y0, layer.bbox_x1, layer.bbox_y1]
+    return None if None in bbox else bbox
+
+
+def seed_layer(layer, type='seed', bbox=None, zoom_start=None, zoom_stop=None,
+               priority=None, gridsets=None, tile_format=None):
+    """
+    Queue the seeding of the tiles of a layer, one job per gridset, the
+    ``GWC_SEED_*`` settings being the defaults. ``bbox`` is in lon/lat and
+    defaults to the extent of the layer. The queued jobs replace the ones of
+    the same gridsets still waiting, they are sent by ``schedule_tile_jobs``.
+    """
+    bbox = bbox or layer_bbox(layer)
+    jobs = []
+    for gridset in gridsets or ogc_server_settings.GWC_SEED_GRIDSETS:
+        extent = gridset_bbox(bbox, gridset) if bbox else None
+        TileJob.objects.filter(layer=layer, gridset=gridset, status='queued').exclude(
+            type='truncate').delete()
+        jobs.append(TileJob.objects.create(
+            layer=layer,
+            type=type,
+            priority=ogc_server_settings.GWC_SEED_PRIORITY if priority is None else priority,
+            gridset=gridset,
+            tile_format=tile_format or ogc_server_settings.GWC_SEED_FORMAT,
+            bbox=','.join(repr(c) for c in extent) if extent else '',
+            zoom_start=ogc_server_settings.GWC_SEED_ZOOM_START if zoom_start is None else zoom_start,
+            zoom_stop=ogc_server_settings.GWC_SEED_ZOOM_STOP if zoom_stop is None else zoom_stop))
+    return jobs
+
+
+def truncate_layer(layer, priority=None):
+    """Queue the truncation of all the tiles of a layer, in every gridset
+       and format.
+    """
+    job = TileJob.objects.filter(layer=layer, type='truncate', status='queued').first()
+    if job is None:
+        job = TileJob.objects.create(
+            layer=layer,
+            type='truncate',
+            priority=ogc_server_settings.GWC_SEED_PRIORITY if priority is None else priority)
+    return job
+
+
+def refresh_layer_tiles(layer, created=False):
+    """
+    Refresh the tiles of a layer whose data or style changed: the cached
+    tiles are truncated and, if ``GWC_SEED_ENABLED``, seeded again.
+    """
+    if not created and ogc_server_settings.GWC_TRUNCATE_ENABLED:
+        truncate_layer(layer)
+    if ogc_server_settings.GWC_SEED_ENABLED:
+        seed_layer(layer, type='seed' if created else 'reseed')
+    schedule_tile_jobs()
+
+
+def layer_tasks(typename):
+    """Return the ``[tiles done, tiles total, seconds remaining, task id,
+       status]`` of the GeoWebCache tasks of a layer.
+    """
+    response, content = http_client.request(_rest_url('seed/%s.json' % typename))
+    if response.status != 200:
+        raise GeoNodeException('GeoWebCache returned %s: %s' % (response.status, content[:500]))
+    return json.loads(content).get('long-array-array', [])
+
+
+def _seed(job):
+    typename = job.layer.typename.encode('utf-8')
+    request = {
+        'name': typename,
+        'type': job.type,
+        'gridSetId': job.gridset,
+        'format': job.tile_format,
+        'zoomStart': job.zoom_start,
+        'zoomStop': job.zoom_stop,
+        'threadCount': ogc_server_settings.GWC_SEED_THREADS,
+    }
+    if job.bbox:
+        request['bounds'] = {'coords': {'double': [float(c) for c in job.bbox.split(',')]}}
+        request['srs'] = {'number': int(job.gridset.split(':')[1])}
+    _request('seed/%s.json' % typename, json.dumps({'seedRequest': request}), 'application/json')
+
+
+def _truncate(job):
+    typename = job.layer.typename.encode('utf-8')
+    # the tasks still seeding would write stale tiles after the truncation
+    _request('seed/%s' % typename, urllib.urlencode({'kill_all': 'all'}),
+             'application/x-www-form-urlencoded')
+    TileJob.objects.filter(layer=job.layer, status='running').exclude(pk=job.pk).update(
+        status='failed', error='Killed by a truncation of the tiles',
+        last_updated=datetime.datetime.now())
+    _request('masstruncate',
+             '<truncateLayer><layerName>%s</layerName></truncateLayer>' % typename, 'text/xml')
+
+
+def _update_running():
+    running = TileJob.objects.filter(status='running')
+    for typename in set(running.values_list('layer__typename', flat=True)):
+        jobs = running.filter(layer__typename=typename)
+        try:
+            tasks = [t for t in layer_tasks(typename) if len(t) < 5 or t[4] in GWC_ACTIVE]
+        except Exception:
+            logger.exception('Could not get the status of the tiles of %s', typename)
+            continue
+        now = datetime.datetime.now()
+        if tasks:
+            jobs.update(tiles_done=sum(t[0] for t in tasks), tiles_total=sum(t[1] for t in tasks),
+                        last_updated=now)
+        else:
+            jobs.update(status='finished', last_updated=now)
+
+
+def _dispatch_queued():
+    running = TileJob.objects.filter(status='running').count()
+    queued = list(TileJob.objects.filter(status='queued').select_related('layer').order_by('-priority', 'id'))
+    for job in queued:
+        if job.type != 'truncate' and running >= ogc_server_settings.GWC_SEED_MAX_TASKS:
+            continue
+        status, error = 'running', ''
+        try:
+            if job.type == 'truncate':
+                _truncate(job)
+                status = 'finished'
+            else:
+                _seed(job)
+                running += 1
+        except Exception as e:
+            logger.exception('Tile job %s of %s failed', job.pk, job.layer.typename)
+            status, error = 'failed', str(e)
+        TileJob.objects.filter(pk=job.pk).update(
+            status=status, error=error, last_updated=datetime.datetime.now())
+
+
+def process_tile_jobs(poll=True, block=True):
+    """
+    Send the queued jobs to GeoWebCache and update the status of the running
+    ones. With ``poll`` it only returns once all the jobs are done, checking
+    their progress every ``POLL_INTERVAL`` seconds. Without ``block`` it
+    returns at once if the jobs are being processed already.
+    """
+    if not _dispatch_lock.acquire(block):
+        return
+    try:
+        idle = False
+        while True:
+            _update_running()
+            _dispatch_queued()
+            if not poll:
+                return
+            if TileJob.objects.filter(status__in=('queued', 'running')).exists():
+                idle = False
+            elif idle:
+                return
+            else:
+                # wait for the jobs of the transactions not committed yet
+                idle = True
+            time.sleep(POLL_INTERVAL)
+    finally:
+        _dispatch_lock.release()
+
+
+def schedule_tile_jobs():
+    background = tile_workers.get_size() > 0
+    tile_workers.submit('tile_jobs', process_tile_jobs, poll=background)
+
+
+def tile_job_status(job):
+    return {
+        'id': job.pk,
+        'type': job.type,
+        'status': job.status,
+        'priority': job.priority,
+        'gridset': job.gridset,
+        'format': job.tile_format,
+        'bbox': [float(c) for c in job.bbox.split(',')] if job.bbox else None,
+        'zoom_start': job.zoom_start,
+        'zoom_stop': job.zoom_stop,
+        'tiles_done': job.tiles_done,
+        'tiles_total': job.tiles_total,
+        'error': job.error,
+        'created': job.created.isoformat(),
+        'last_updated': job.last_updated.isoformat(),
+    }
+
+
+tile_workers = WorkerPool('geowebcache', retries=0)
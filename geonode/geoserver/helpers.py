@@ -18,6 +18,8 @@
 #
 #########################################################################
 import json
+import copy
+import hashlib
 import sys
 import os
 import urllib
@@ -29,30 +31,37 @@ import uuid
 import datetime
 from bs4 import BeautifulSoup
 import geoserver
-import httplib2
 
 
 from urlparse import urlparse
 from urlparse import urlsplit
-from threading import local
-from collections import namedtuple
+from urlparse import urljoin
+from threading import current_thread, local, Lock
+from functools import partial
+from multiprocessing.pool import ThreadPool
+from collections import namedtuple, OrderedDict
 from itertools import cycle, izip
 from lxml import etree
 import xml.etree.ElementTree as ET
 from decimal import Decimal
 
 from owslib.wcs import WebCoverageService
-from owslib.util import http_post
 
 from django.core.exceptions import ImproperlyConfigured
 from django.contrib.contenttypes.models import ContentType
-from django.db.models.signals import pre_delete
+from django.db import connections, transaction
 from django.template.loader import render_to_string
 from django.conf import settings
+from django.db.models import Q
+from django.core.cache import cache
+from django.utils.translation import ugettext_lazy as _
 
 from dialogos.models import Comment
 from agon_ratings.models import OverallRating
+from taggit.models import TaggedItem
 
+from guardian.models import GroupObjectPermission, UserObjectPermission
+from guardian.shortcuts import get_anonymous_user
 from gsimporter import Client
 from owslib.wms import WebMapService
 from geoserver.store import CoverageStore, DataStore
@@ -63,7 +72,12 @@ from geoserver.catalog import ConflictingDataError
 from geoserver.resource import FeatureType, Coverage
 
 from geonode import GeoNodeException
+from geonode.security.models import acl_version
+from geonode.workers import WorkerPool
+from geonode.utils import HttpTransport
+from geonode.geoserver.ows import wcs_links, wfs_links, wms_links
 from geonode.layers.utils import layer_type, get_files
+from geonode.base.models import ResourceBase
 from geonode.layers.models import Layer, Attribute, Style
 from geonode.layers.enumerations import LAYER_ATTRIBUTE_NUMERIC_DATA_TYPES
 
@@ -221,64 +235,87 @@ def fixup_style(cat, resource, style):
 
 
 def cascading_delete(cat, layer_name):
-    resource = None
+    cascading_delete_many(cat, [layer_name])
+
+
+def _delete_lookup(cat, layer_name, workspaces):
+    """Return the GeoServer resource of a layer, or None."""
+    if layer_name.find(':') != -1:
+        workspace, name = layer_name.split(':')
+        if workspace not in workspaces:
+            workspaces[workspace] = cat.get_workspace(workspace)
+        if workspaces[workspace] is None:
+            logger.debug(
+                'cascading delete was called on a layer where the workspace was not found')
+            return None
+        return cat.get_resource(name, workspace=workspace)
+    return cat.get_resource(layer_name)
+
+
+def cascading_delete_many(cat, layer_names):
+    """
+    Delete layers from GeoServer with their resources, their styles once
+    no other layer uses them, and their stores once they are empty.
+
+    The work is grouped by store: the PostGIS tables of a store are dropped
+    in a single transaction and every other store is only checked once for
+    remaining resources. The catalog is reloaded at most once, if deleting
+    a resource failed.
+    """
+    workspaces = {}
+    deleted = []
     try:
-        if layer_name.find(':') != -1:
-            workspace, name = layer_name.split(':')
-            ws = cat.get_workspace(workspace)
-            if ws is None:
+        for layer_name in layer_names:
+            resource = _delete_lookup(cat, layer_name, workspaces)
+            if resource is None:
+                # If there is no associated resource,
+                # this method can not delete anything.
+                # Let's return and make a note in the log.
                 logger.debug(
-                    'cascading delete was called on a layer where the workspace was not found')
-                return
-            resource = cat.get_resource(name, workspace=workspace)
-        else:
-            resource = cat.get_resource(layer_name)
+                    'cascading_delete was called with a non existent resource')
+                continue
+            lyr = cat.get_layer(resource.name)
+            if lyr is not None:  # Already deleted
+                deleted.append((resource, lyr.styles + [lyr.default_style]))
+                cat.delete(lyr)
     except EnvironmentError as e:
         if e.errno == errno.ECONNREFUSED:
             msg = ('Could not connect to geoserver at "%s"'
-                   'to save information for layer "%s"' % (
-                       ogc_server_settings.LOCATION, layer_name)
+                   'to save information for layers "%s"' % (
+                       ogc_server_settings.LOCATION, ', '.join(layer_names))
                    )
             logger.warn(msg, e)
             return None
         else:
             raise e
 
-    if resource is None:
-            # If there is no associated resource,
-            # this method can not delete anything.
-            # Let's return and make a note in the log.
-        logger.debug(
-            'cascading_delete was called with a non existent resource')
-        return
-    resource_name = resource.name
-    lyr = cat.get_layer(resource_name)
-    if(lyr is not None):  # Already deleted
-        store = resource.store
-        styles = lyr.styles + [lyr.default_style]
-        cat.delete(lyr)
-        for s in styles:
-            if s is not None and s.name not in _default_style_names:
-                try:
-                    cat.delete(s, purge=True)
-                except FailedRequestError as e:
-                    # Trying to delete a shared style will fail
-                    # We'll catch the exception and log it.
-                    logger.debug(e)
-
+    reload_needed = False
+    stores = OrderedDict()
+    for resource, styles in deleted:
         # Due to a possible bug of geoserver, we need this trick for now
         try:
             cat.delete(resource)  # This will fail
         except:
-            cat.reload()  # this preservers the integrity of geoserver
+            reload_needed = True
+        store = resource.store
+        stores.setdefault((store.workspace.name, store.name), (store, []))[1].append(resource.name)
+
+    if reload_needed:
+        cat.reload()  # this preservers the integrity of geoserver
 
+    _delete_unused_styles(cat, [s for resource, styles in deleted for s in styles],
+                          ['%s:%s' % (resource.store.workspace.name, resource.name)
+                           for resource, styles in deleted])
+
+    tables = []
+    for store, names in stores.values():
         if store.resource_type == 'dataStore' and 'dbtype' in store.connection_parameters and \
                 store.connection_parameters['dbtype'] == 'postgis':
-            delete_from_postgis(resource_name)
+            tables.extend(names)
         elif store.type and store.type.lower() == 'geogit':
             # Prevent the entire store from being removed when the store is a
             # GeoGIT repository.
-            return
+            continue
         else:
             try:
                 if not store.get_resources():
@@ -286,6 +323,27 @@ def cascading_delete(cat, layer_name):
             except FailedRequestError as e:
                 # Catch the exception and log it.
                 logger.debug(e)
+    if tables:
+        drop_postgis_tables(tables)
+
+
+def _delete_unused_styles(cat, styles, deleted_typenames):
+    names = set(s.name for s in styles if s is not None and s.name not in _default_style_names)
+    if not names:
+        return
+    # the styles still used by other GeoNode layers are kept
+    remaining = Layer.objects.exclude(typename__in=deleted_typenames)
+    used = set(remaining.filter(default_style__name__in=names).values_list('default_style__name', flat=True))
+    used.update(remaining.filter(styles__name__in=names).values_list('styles__name', flat=True))
+    for s in styles:
+        if s is not None and s.name in names and s.name not in used:
+            names.discard(s.name)
+            try:
+                cat.delete(s, purge=True)
+            except FailedRequestError as e:
+                # Trying to delete a style shared with a layer unknown to
+                # GeoNode will fail. We'll catch the exception and log it.
+                logger.debug(e)
 
 
 def delete_from_postgis(resource_name):
@@ -293,31 +351,158 @@ def delete_from_postgis(resource_name):
     Delete a table from PostGIS (because Geoserver won't do it yet);
     to be used after deleting a layer from the system.
     """
-    import psycopg2
-    db = ogc_server_settings.datastore_db
-    conn = psycopg2.connect(
-        "dbname='" +
-        db['NAME'] +
-        "' user='" +
-        db['USER'] +
-        "'  password='" +
-        db['PASSWORD'] +
-        "' port=" +
-        db['PORT'] +
-        " host='" +
-        db['HOST'] +
-        "'")
+    drop_postgis_tables([resource_name])
+
+
+def drop_postgis_tables(table_names):
+    """
+    Drop tables of the PostGIS datastore in one transaction, on the Django
+    connection of the datastore. A table failing to drop is logged and does
+    not prevent the others from being dropped.
+    """
+    alias = ogc_server_settings.DATASTORE
+    if not alias:
+        logger.error("Can not delete the PostGIS tables %s, no DATASTORE is configured",
+                     ', '.join(table_names))
+        return
     try:
-        cur = conn.cursor()
-        cur.execute("SELECT DropGeometryTable ('%s')" % resource_name)
-        conn.commit()
+        with transaction.atomic(using=alias):
+            cursor = connections[alias].cursor()
+            for name in table_names:
+                try:
+                    with transaction.atomic(using=alias):
+                        cursor.execute("SELECT DropGeometryTable(%s)", [name])
+                except Exception as e:
+                    logger.error(
+                        "Error deleting PostGIS table %s:%s",
+                        name,
+                        str(e))
     except Exception as e:
         logger.error(
-            "Error deleting PostGIS table %s:%s",
-            resource_name,
+            "Error deleting PostGIS tables %s:%s",
+            ', '.join(table_names),
             str(e))
-    finally:
-        conn.close()
+
+
+def delete_layers(layers):
+    """
+    Delete GeoNode layers, removing their GeoServer counterparts with a
+    single ``cascading_delete_many`` batch instead of one cascading delete
+    per layer.
+
+    A layer that can not be deleted from GeoNode does not stop the others,
+    the list of dictionaries returned gives the name of every layer, the
+    result of the operation and the error if it failed.
+    """
+    layers = list(layers)
+    if getattr(ogc_server_settings, "BACKEND_WRITE_ENABLED", True):
+        cascading_delete_many(gs_catalog, [layer.typename for layer in layers
+                                           if layer.storeType != "remoteStore"])
+    output = []
+    for layer in layers:
+        info = {'name': layer.name}
+        # geoserver_pre_delete skips the layers already deleted
+        layer.gs_deleted = True
+        try:
+            with transaction.atomic():
+                layer.delete()
+        except Exception:
+            logger.exception('Could not delete layer %s', layer.name)
+            info['status'] = 'delete_failed'
+            info['exception_type'], info['error'], info['traceback'] = sys.exc_info()
+        else:
+            info['status'] = 'delete_succeeded'
+        output.append(info)
+    return output
+
+
+def _parallel_map(func, items, workers=1):
+    """Apply ``func`` to every item, using a pool of threads when
+       ``workers`` is greater than one. Results keep the input order.
+    """
+    items = list(items)
+    if workers > 1 and len(items) > 1:
+        pool = ThreadPool(min(workers, len(items)))
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+    return map(func, items)
+
+
+def _thread_catalog():
+    """Return a gsconfig Catalog owned by the calling thread.
+
+       The cache of the Catalog is not thread safe, so worker threads never
+       share the module level one. All the catalogs send their requests
+       through the shared ``http_client`` transport, and their writes empty
+       the cache of ``gs_catalog``.
+    """
+    cat = getattr(_thread_clients, 'catalog', None)
+    if cat is None:
+        cat = Catalog(ogc_server_settings.internal_rest, _user, _password)
+        cat.http = http_client
+        cat = InvalidatingCatalog(cat, gs_catalog)
+        _thread_clients.catalog = cat
+    return cat
+
+
+def _fetch_resource(resource):
+    """Load the REST description of a gsconfig resource.
+
+       Returns None on success or the ``sys.exc_info()`` of the failure.
+    """
+    try:
+        if resource.dom is None:
+            resource.dom = _thread_catalog().get_xml(resource.href)
+    except Exception:
+        return sys.exc_info()
+    return None
+
+
+def delete_compare_index(resources, fetch_errors, skip_unadvertised=False):
+    """
+    Return the ``(workspace, store, name)`` of the GeoServer resources the
+    GeoNode layers are compared with to find the deleted ones: the enabled
+    resources, only the advertised ones with ``skip_unadvertised``.
+
+    The resources whose description could not be fetched are kept, their
+    names come from the catalog listing, so that a transient GeoServer error
+    does not get their layers deleted.
+    """
+    index = set()
+    for k in resources:
+        if fetch_errors.get(id(k)) is None:
+            if k.enabled != "true":
+                continue
+            if skip_unadvertised and not (k.advertised == "true" or k.advertised or k.advertised is None):
+                continue
+        index.add((k.workspace.name, k.store.name, k.name))
+    return index
+
+
+def resource_fingerprint(resource):
+    """Return a digest of the GeoServer description of a resource.
+
+       The REST representation includes the title, abstract, keywords,
+       bounding boxes and attribute list, the store and workspace are added
+       so moving a resource is detected as well.
+    """
+    digest = hashlib.sha1()
+    digest.update(resource.store.workspace.name.encode('utf-8'))
+    digest.update(':')
+    digest.update(resource.store.name.encode('utf-8'))
+    digest.update(':')
+    digest.update(ET.tostring(resource.dom, encoding='utf-8'))
+    return digest.hexdigest()
+
+
+def _fetch_attribute_map(layer):
+    try:
+        return get_attribute_map(layer), None
+    except Exception:
+        return None, sys.exc_info()
 
 
 def gs_slurp(
@@ -330,17 +515,61 @@ def gs_slurp(
         filter=None,
         skip_unadvertised=False,
         skip_geonode_registered=False,
-        remove_deleted=False):
+        remove_deleted=False,
+        workers=1,
+        batch_size=100,
+        incremental=False,
+        dry_run=False):
     """Configure the layers available in GeoServer in GeoNode.
 
        It returns a list of dictionaries with the name of the layer,
        the result of the operation and the errors and traceback if it failed.
+
+       ``workers`` sets how many threads are used to fetch the resource
+       descriptions and attributes from GeoServer, the database writes are
+       committed in transactions of ``batch_size`` layers. The layers are
+       saved without the GeoServer signals, their links, styles and
+       thumbnails are synchronised once every batch is committed.
+
+       With ``incremental`` the layers whose GeoServer resource has the same
+       fingerprint as in the previous run are reported as unchanged and are
+       neither saved nor have their attributes recalculated.
+
+       With ``remove_deleted`` and ``dry_run`` the layers that would be
+       deleted are reported with the 'delete_pending' status but kept.
     """
+    from geonode.geoserver.models import LayerFingerprint
+    from geonode.geoserver.signals import sync_layer, POST_SAVE_STAGES
+
     if console is None:
         console = open(os.devnull, 'w')
 
+    workers = max(int(workers or 1), 1)
+    batch_size = max(int(batch_size or 1), 1)
+    timings = dict.fromkeys(
+        ['list', 'fetch', 'save', 'attributes_fetch', 'attributes_save', 'sync'], 0.0)
+
+    # the stages of the GeoServer synchronisation run by the post_save
+    # signal, the attributes are set by gs_slurp itself.
+    stages = [(stage, func) for stage, func in POST_SAVE_STAGES if stage != 'attributes']
+    caller = current_thread()
+
+    def sync(item):
+        layer, resource = item
+        try:
+            sync_layer(layer, catalog=_thread_catalog(), gs_resource=resource, stages=stages)
+        except Exception:
+            return sys.exc_info()
+        finally:
+            if current_thread() is not caller:
+                # the threads of _parallel_map own their database connections
+                for conn in connections.all():
+                    conn.close()
+        return None
+
     if verbosity > 1:
         print >> console, "Inspecting the available layers in GeoServer ..."
+    tic = time.time()
     cat = Catalog(ogc_server_settings.internal_rest, _user, _password)
     if workspace is not None:
         workspace = cat.get_workspace(workspace)
@@ -363,32 +592,45 @@ def gs_slurp(
         resources = cat.get_resources(store=store)
     else:
         resources = cat.get_resources()
-    if remove_deleted:
-        resources_for_delete_compare = resources[:]
-        workspace_for_delete_compare = workspace
-        # filter out layers for delete comparison with GeoNode layers by following criteria:
-        # enabled = true, if --skip-unadvertised: advertised = true, but
-        # disregard the filter parameter in the case of deleting layers
-        resources_for_delete_compare = [
-            k for k in resources_for_delete_compare if k.enabled == "true"]
-        if skip_unadvertised:
-            resources_for_delete_compare = [
-                k for k in resources_for_delete_compare if k.advertised == "true" or
-                k.advertised or k.advertised is None]
-    if filter:
-        resources = [k for k in resources if filter in k.name]
+    timings['list'] += time.time() - tic
 
-    # filter out layers depending on enabled, advertised status:
-    resources = [k for k in resources if k.enabled == "true"]
-    if skip_unadvertised:
-        resources = [k for k in resources if k.advertised ==
-                     "true" or k.advertised or k.advertised is None]
+    # the name based filters do not need the resource details, apply them
+    # before fetching anything else from GeoServer.
+    if filter:
+        candidates = [k for k in resources if filter in k.name]
+    else:
+        candidates = resources[:]
 
     # filter out layers already registered in geonode
-    layer_names = Layer.objects.all().values_list('typename', flat=True)
     if skip_geonode_registered:
-        resources = [k for k in resources
-                     if not '%s:%s' % (k.workspace.name, k.name) in layer_names]
+        layer_names = set(Layer.objects.all().values_list('typename', flat=True))
+        candidates = [k for k in candidates
+                      if not '%s:%s' % (k.workspace.name, k.name) in layer_names]
+
+    # fetch the details of the resources concurrently, the enabled and
+    # advertised filters below would otherwise fetch them one by one.
+    tic = time.time()
+    to_fetch = resources if remove_deleted else candidates
+    fetch_errors = dict(izip((id(k) for k in to_fetch),
+                             _parallel_map(_fetch_resource, to_fetch, workers)))
+    timings['fetch'] += time.time() - tic
+
+    def is_enabled(resource):
+        return fetch_errors.get(id(resource)) is not None or resource.enabled == "true"
+
+    def is_advertised(resource):
+        return fetch_errors.get(id(resource)) is not None or resource.advertised == "true" or \
+            resource.advertised or resource.advertised is None
+
+    if remove_deleted:
+        workspace_for_delete_compare = workspace
+        geoserver_index = delete_compare_index(resources, fetch_errors, skip_unadvertised)
+
+    # filter out layers depending on enabled, advertised status. Resources
+    # that could not be fetched are kept so they are reported as failures.
+    resources = [k for k in candidates if is_enabled(k)]
+    if skip_unadvertised:
+        resources = [k for k in resources if is_advertised(k)]
 
     # TODO: Should we do something with these?
     # i.e. look for matching layers in GeoNode and also disable?
@@ -403,65 +645,139 @@ def gs_slurp(
             'failed': 0,
             'updated': 0,
             'created': 0,
+            'unchanged': 0,
             'deleted': 0,
         },
         'layers': [],
         'deleted_layers': []
     }
     start = datetime.datetime.now()
-    for i, resource in enumerate(resources):
-        name = resource.name
-        the_store = resource.store
-        workspace = the_store.workspace
-        try:
-            layer, created = Layer.objects.get_or_create(name=name, defaults={
-                "workspace": workspace.name,
-                "store": the_store.name,
-                "storeType": the_store.resource_type,
-                "typename": "%s:%s" % (workspace.name.encode('utf-8'), resource.name.encode('utf-8')),
-                "title": resource.title or 'No title provided',
-                "abstract": resource.abstract or 'No abstract provided',
-                "owner": owner,
-                "uuid": str(uuid.uuid4())
-            })
-            layer.bbox_x0 = Decimal(resource.latlon_bbox[0])
-            layer.bbox_x1 = Decimal(resource.latlon_bbox[1])
-            layer.bbox_y0 = Decimal(resource.latlon_bbox[2])
-            layer.bbox_y1 = Decimal(resource.latlon_bbox[3])
-            layer.save()
-            # recalculate the layer statistics
-            set_attributes(layer, overwrite=True)
-
-        except Exception as e:
-            if ignore_errors:
-                status = 'failed'
-                exception_type, error, traceback = sys.exc_info()
-            else:
-                if verbosity > 0:
-                    msg = "Stopping process because --ignore-errors was not set and an error was found."
-                    print >> sys.stderr, msg
-                raise Exception(
-                    'Failed to process %s' %
-                    resource.name.encode('utf-8'), e), None, sys.exc_info()[2]
-        else:
-            if created:
-                layer.set_default_permissions()
-                status = 'created'
-                output['stats']['created'] += 1
-            else:
-                status = 'updated'
-                output['stats']['updated'] += 1
-
-        msg = "[%s] Layer %s (%d/%d)" % (status, name, i + 1, number)
-        info = {'name': name, 'status': status}
-        if status == 'failed':
-            output['stats']['failed'] += 1
-            info['traceback'] = traceback
-            info['exception_type'] = exception_type
-            info['error'] = error
-        output['layers'].append(info)
-        if verbosity > 0:
-            print >> console, msg
+
+    def fail(resource, exc_info):
+        if not ignore_errors:
+            if verbosity > 0:
+                msg = "Stopping process because --ignore-errors was not set and an error was found."
+                print >> sys.stderr, msg
+            raise Exception(
+                'Failed to process %s' %
+                resource.name.encode('utf-8'), exc_info[1]), None, exc_info[2]
+        return {'name': resource.name,
+                'status': 'failed',
+                'exception_type': exc_info[0],
+                'error': exc_info[1],
+                'traceback': exc_info[2]}
+
+    for offset in range(0, number, batch_size):
+        chunk = resources[offset:offset + batch_size]
+        results = [None] * len(chunk)
+        fingerprints = [None] * len(chunk)
+        saved = []
+
+        previous_fingerprints = {}
+        if incremental:
+            previous_fingerprints = dict(LayerFingerprint.objects.filter(
+                layer__name__in=[k.name for k in chunk]).values_list('layer__name', 'fingerprint'))
+
+        # Create or update the layers of this chunk in a single transaction,
+        # each layer gets its own savepoint so a failure does not roll back
+        # the rest of the chunk.
+        tic = time.time()
+        with transaction.atomic():
+            for j, resource in enumerate(chunk):
+                if fetch_errors.get(id(resource)) is not None:
+                    results[j] = fail(resource, fetch_errors[id(resource)])
+                    continue
+                name = resource.name
+                the_store = resource.store
+                workspace = the_store.workspace
+                try:
+                    fingerprints[j] = resource_fingerprint(resource)
+                    if fingerprints[j] == previous_fingerprints.get(name):
+                        results[j] = {'name': name, 'status': 'unchanged'}
+                        continue
+                    with transaction.atomic():
+                        try:
+                            layer, created = Layer.objects.get(name=name), False
+                        except Layer.DoesNotExist:
+                            layer, created = Layer(
+                                name=name,
+                                workspace=workspace.name,
+                                store=the_store.name,
+                                storeType=the_store.resource_type,
+                                typename="%s:%s" % (workspace.name.encode('utf-8'), resource.name.encode('utf-8')),
+                                title=resource.title or 'No title provided',
+                                abstract=resource.abstract or 'No abstract provided',
+                                owner=owner,
+                                uuid=str(uuid.uuid4())), True
+                        # GeoServer is synchronised once the chunk is committed
+                        layer.gs_sync_deferred = True
+                        layer.bbox_x0 = Decimal(resource.latlon_bbox[0])
+                        layer.bbox_x1 = Decimal(resource.latlon_bbox[1])
+                        layer.bbox_y0 = Decimal(resource.latlon_bbox[2])
+                        layer.bbox_y1 = Decimal(resource.latlon_bbox[3])
+                        layer.save()
+                        if created:
+                            layer.set_default_permissions()
+                except Exception:
+                    results[j] = fail(resource, sys.exc_info())
+                else:
+                    results[j] = {'name': name, 'status': 'created' if created else 'updated'}
+                    saved.append((j, layer))
+        timings['save'] += time.time() - tic
+
+        # recalculate the layer attributes, the GeoServer requests are done
+        # concurrently and the results are stored in one transaction.
+        tic = time.time()
+        attribute_maps = _parallel_map(_fetch_attribute_map, [l for j, l in saved], workers)
+        timings['attributes_fetch'] += time.time() - tic
+
+        tic = time.time()
+        statistics = []
+        with transaction.atomic():
+            for (j, layer), (attribute_map, exc_info) in izip(saved, attribute_maps):
+                if exc_info is None:
+                    try:
+                        with transaction.atomic():
+                            if set_attributes(layer, overwrite=True, attribute_map=attribute_map,
+                                              queue_statistics=False):
+                                statistics.append(layer)
+                    except Exception:
+                        exc_info = sys.exc_info()
+                if exc_info is not None:
+                    results[j] = fail(chunk[j], exc_info)
+
+            # remember what was synchronised for the next incremental run
+            synced = [(j, layer) for j, layer in saved if results[j]['status'] != 'failed']
+            LayerFingerprint.objects.filter(layer__in=[layer for j, layer in synced]).delete()
+            LayerFingerprint.objects.bulk_create([
+                LayerFingerprint(layer=layer, fingerprint=fingerprints[j]) for j, layer in synced])
+        timings['attributes_save'] += time.time() - tic
+
+        # the jobs are queued once the attributes are committed
+        for layer in statistics:
+            queue_attribute_statistics(layer)
+
+        # the GeoServer side of the committed layers is synchronised
+        # concurrently, outside of any transaction.
+        tic = time.time()
+        sync_errors = _parallel_map(sync, [(layer, chunk[j]) for j, layer in synced], workers)
+        unsynced = []
+        for (j, layer), exc_info in izip(synced, sync_errors):
+            if exc_info is not None:
+                results[j] = fail(chunk[j], exc_info)
+                unsynced.append(layer)
+        if unsynced:
+            # the next incremental run has to synchronise them again
+            LayerFingerprint.objects.filter(layer__in=unsynced).delete()
+        timings['sync'] += time.time() - tic
+
+        for j, info in enumerate(results):
+            status = info['status']
+            output['stats'][status] += 1
+            output['layers'].append(info)
+            if verbosity > 0:
+                msg = "[%s] Layer %s (%d/%d)" % (status, info['name'], offset + j + 1, number)
+                print >> console, msg
 
     if remove_deleted:
         q = Layer.objects.filter()
@@ -481,109 +797,141 @@ def gs_slurp(
             else:
                 q = q.filter(store__exact=store)
         logger.debug("Executing 'remove_deleted' logic")
-        logger.debug("GeoNode Layers Found:")
 
         # compare the list of GeoNode layers obtained via query/filter with valid resources found in GeoServer
         # filtered per options passed to updatelayers: --workspace, --store, --skip-unadvertised
         # add any layers not found in GeoServer to deleted_layers (must match
         # workspace and store as well):
-        deleted_layers = []
-        for layer in q:
-            logger.debug(
-                "GeoNode Layer info: name: %s, workspace: %s, store: %s",
-                layer.name,
-                layer.workspace,
-                layer.store)
-            layer_found_in_geoserver = False
-            for resource in resources_for_delete_compare:
-                # if layer.name matches a GeoServer resource, check also that
-                # workspace and store match, mark valid:
-                if layer.name == resource.name:
-                    if layer.workspace == resource.workspace.name and layer.store == resource.store.name:
-                        logger.debug(
-                            "Matches GeoServer layer: name: %s, workspace: %s, store: %s",
-                            resource.name,
-                            resource.workspace.name,
-                            resource.store.name)
-                        layer_found_in_geoserver = True
-            if not layer_found_in_geoserver:
-                logger.debug(
-                    "----- Layer %s not matched, marked for deletion ---------------",
-                    layer.name)
-                deleted_layers.append(layer)
+        tic = time.time()
+        orphans = [(pk, layer_name) for pk, layer_name, layer_workspace, layer_store
+                   in q.values_list('id', 'name', 'workspace', 'store')
+                   if (layer_workspace, layer_store, layer_name) not in geoserver_index]
+        timings['reconcile'] = time.time() - tic
 
-        number_deleted = len(deleted_layers)
+        number_deleted = len(orphans)
         if verbosity > 1:
             msg = "\nFound %d layers to delete, starting processing" % number_deleted if number_deleted > 0 else \
                 "\nFound %d layers to delete" % number_deleted
             print >> console, msg
 
-        for i, layer in enumerate(deleted_layers):
-            logger.debug(
-                "GeoNode Layer to delete: name: %s, workspace: %s, store: %s",
-                layer.name,
-                layer.workspace,
-                layer.store)
-            try:
-                # delete ratings, comments, and taggit tags:
-                ct = ContentType.objects.get_for_model(layer)
-                OverallRating.objects.filter(
-                    content_type=ct,
-                    object_id=layer.id).delete()
-                Comment.objects.filter(
-                    content_type=ct,
-                    object_id=layer.id).delete()
-                layer.keywords.clear()
-
-                layer.delete()
-                output['stats']['deleted'] += 1
-                status = "delete_succeeded"
-            except Exception as e:
-                status = "delete_failed"
-            finally:
-                from .signals import geoserver_pre_delete
-                pre_delete.connect(geoserver_pre_delete, sender=Layer)
-
-            msg = "[%s] Layer %s (%d/%d)" % (status,
-                                             layer.name,
-                                             i + 1,
-                                             number_deleted)
-            info = {'name': layer.name, 'status': status}
-            if status == "delete_failed":
-                exception_type, error, traceback = sys.exc_info()
-                info['traceback'] = traceback
-                info['exception_type'] = exception_type
-                info['error'] = error
-            output['deleted_layers'].append(info)
-            if verbosity > 0:
-                print >> console, msg
+        if dry_run:
+            for i, (pk, layer_name) in enumerate(orphans):
+                output['deleted_layers'].append({'name': layer_name, 'status': 'delete_pending'})
+                if verbosity > 0:
+                    print >> console, "[delete_pending] Layer %s (%d/%d)" % (layer_name, i + 1, number_deleted)
+        else:
+            # the resources are already gone from GeoServer, there is no
+            # need to go through cascading_delete for each of them.
+            tic = time.time()
+            ct = ContentType.objects.get_for_model(Layer)
+            for offset in range(0, number_deleted, batch_size):
+                chunk = orphans[offset:offset + batch_size]
+                ids = [pk for pk, layer_name in chunk]
+                with transaction.atomic():
+                    # delete ratings, comments, and taggit tags:
+                    OverallRating.objects.filter(content_type=ct, object_id__in=ids).delete()
+                    Comment.objects.filter(content_type=ct, object_id__in=ids).delete()
+                    TaggedItem.objects.filter(content_type=ct, object_id__in=ids).delete()
+
+                    for j, layer in enumerate(Layer.objects.filter(id__in=ids).order_by('id')):
+                        logger.debug(
+                            "GeoNode Layer to delete: name: %s, workspace: %s, store: %s",
+                            layer.name,
+                            layer.workspace,
+                            layer.store)
+                        info = {'name': layer.name}
+                        # geoserver_pre_delete skips the layers already deleted
+                        layer.gs_deleted = True
+                        try:
+                            with transaction.atomic():
+                                layer.delete()
+                        except Exception:
+                            info['status'] = "delete_failed"
+                            info['exception_type'], info['error'], info['traceback'] = sys.exc_info()
+                        else:
+                            info['status'] = "delete_succeeded"
+                            output['stats']['deleted'] += 1
+                        output['deleted_layers'].append(info)
+                        if verbosity > 0:
+                            print >> console, "[%s] Layer %s (%d/%d)" % (
+                                info['status'], layer.name, offset + j + 1, number_deleted)
+            timings['delete'] = time.time() - tic
 
     finish = datetime.datetime.now()
     td = finish - start
     output['stats']['duration_sec'] = td.microseconds / \
         1000000 + td.seconds + td.days * 24 * 3600
+    elapsed = td.microseconds / 1000000.0 + td.seconds + td.days * 24 * 3600
+    output['stats']['workers'] = workers
+    output['stats']['batch_size'] = batch_size
+    output['stats']['layers_per_sec'] = number / elapsed if elapsed > 0 else 0.0
+    output['stats']['timings'] = timings
     return output
 
 
-def get_stores(store_type=None):
-    cat = Catalog(ogc_server_settings.internal_rest, _user, _password)
-    stores = cat.get_stores()
+def get_stores(store_type=None, workspace=None, offset=0, limit=None, workers=4):
+    """
+    List the GeoServer stores as ``{'name': ..., 'type': ...}`` dictionaries,
+    optionally only the ones of a workspace or of a type.
+
+    The type of a store is only given by its own description, the stores
+    of a workspace are described by ``workers`` concurrent requests and
+    the result is cached per workspace. Workspaces are only listed until
+    the requested page is complete.
+    """
+    if workspace is not None:
+        workspaces = [workspace]
+    else:
+        workspaces = [ws.name for ws in gs_catalog.get_workspaces()]
+
     store_list = []
-    for store in stores:
-        store.fetch()
-        stype = store.dom.find('type').text.lower()
-        if store_type and store_type.lower() == stype:
-            store_list.append({'name': store.name, 'type': stype})
-        elif store_type is None:
-            store_list.append({'name': store.name, 'type': stype})
-    return store_list
+    for name in workspaces:
+        for store in get_workspace_stores(name, workers=workers):
+            if store_type is None or store_type.lower() == store['type']:
+                store_list.append({'name': store['name'], 'type': store['type']})
+        if limit is not None and len(store_list) >= offset + limit:
+            break
+
+    if limit is None:
+        return store_list[offset:]
+    return store_list[offset:offset + limit]
+
+
+def get_workspace_stores(workspace, workers=4):
+    """
+    Return the name and type of the stores of a workspace, cached for
+    CATALOG_CACHE_TTL seconds.
+    """
+    key = 'geoserver_stores:%s' % workspace
+    stores = cache.get(key)
+    if stores is not None:
+        return stores
+
+    gs_stores = gs_catalog.get_stores(workspace)
+    errors = _parallel_map(_fetch_resource, gs_stores, workers)
+
+    stores = []
+    for store, error in zip(gs_stores, errors):
+        stype = None
+        if error is None:
+            stype = store.dom.findtext('type')
+        else:
+            logger.warn('Could not describe store %s: %s', store.name, error[1])
+        stores.append({
+            'name': store.name,
+            'type': stype.lower() if stype else store.resource_type.lower(),
+        })
+    cache.set(key, stores, ogc_server_settings.CATALOG_CACHE_TTL)
+    return stores
 
 
-def set_attributes(layer, overwrite=False):
+def get_attribute_map(layer, http=None):
     """
     Retrieve layer attribute names & types from Geoserver,
-    then store in GeoNode database using Attribute model
+    as a list of [name, type] pairs
     """
+    if http is None:
+        http = http_client
     attribute_map = []
     server_url = ogc_server_settings.LOCATION if layer.storeType != "remoteStore" else layer.service.base_url
 
@@ -591,7 +939,7 @@ def set_attributes(layer, overwrite=False):
         dft_url = server_url + ("%s?f=json" % layer.typename)
         try:
             # The code below will fail if http_client cannot be imported
-            body = json.loads(http_client.request(dft_url)[1])
+            body = json.loads(http.request(dft_url)[1])
             attribute_map = [[n["name"], _esri_types[n["type"]]]
                              for n in body["fields"] if n.get("name") and n.get("type")]
         except Exception:
@@ -608,7 +956,7 @@ def set_attributes(layer, overwrite=False):
         try:
             # The code below will fail if http_client cannot be imported  or
             # WFS not supported
-            body = http_client.request(dft_url)[1]
+            body = http.request(dft_url)[1]
             doc = etree.fromstring(body)
             path = ".//{xsd}extension/{xsd}sequence/{xsd}element".format(
                 xsd="{http://www.w3.org/2001/XMLSchema}")
@@ -634,7 +982,7 @@ def set_attributes(layer, overwrite=False):
                 "y": 1
             })
             try:
-                body = http_client.request(dft_url)[1]
+                body = http.request(dft_url)[1]
                 soup = BeautifulSoup(body)
                 for field in soup.findAll('th'):
                     if(field.string is None):
@@ -653,7 +1001,7 @@ def set_attributes(layer, overwrite=False):
             "identifiers": layer.typename.encode('utf-8')
         })
         try:
-            response, body = http_client.request(dc_url)
+            response, body = http.request(dc_url)
             doc = etree.fromstring(body)
             path = ".//{wcs}Axis/{wcs}AvailableKeys/{wcs}Key".format(
                 wcs="{http://www.opengis.net/wcs/1.1.1}")
@@ -661,55 +1009,112 @@ def set_attributes(layer, overwrite=False):
         except Exception:
             attribute_map = []
 
-    attributes = layer.attribute_set.all()
-    # Delete existing attributes if they no longer exist in an updated layer
-    for la in attributes:
-        lafound = False
-        for field, ftype in attribute_map:
-            if field == la.attribute:
-                lafound = True
-        if overwrite or not lafound:
+    return attribute_map
+
+
+def set_attributes(layer, overwrite=False, attribute_map=None, queue_statistics=True):
+    """
+    Retrieve layer attribute names & types from Geoserver,
+    then store in GeoNode database using Attribute model
+
+    An ``attribute_map`` already obtained with ``get_attribute_map``
+    can be passed to avoid requesting it again.
+
+    The stored attributes are compared with the ones in GeoServer and only
+    the differences are written: removed attributes are deleted, new ones
+    are created and the ones whose type changed are updated. Labels,
+    display order and visibility of the other attributes are kept, with
+    ``overwrite`` their statistics are recalculated.
+
+    The statistics are computed by a background job, see
+    ``queue_attribute_statistics``. Without ``queue_statistics`` the job is
+    left to the caller, it returns whether the statistics are needed.
+    """
+    if attribute_map is None:
+        attribute_map = get_attribute_map(layer)
+
+    if attribute_map is None:
+        logger.debug("No attributes found")
+        return False
+
+    fields = OrderedDict()
+    for field, ftype in attribute_map:
+        if field is not None and field not in fields:
+            fields[field] = ftype
+
+    existing = {}
+    removed = []
+    for la in layer.attribute_set.all().order_by('display_order', 'id'):
+        if la.attribute not in fields or la.attribute in existing:
+            # Delete existing attributes if they no longer exist in an
+            # updated layer, as well as duplicated ones
             logger.debug(
                 "Going to delete [%s] for [%s]",
                 la.attribute,
                 layer.name.encode('utf-8'))
-            la.delete()
-
-    # Add new layer attributes if they don't already exist
-    if attribute_map is not None:
-        iter = len(Attribute.objects.filter(layer=layer)) + 1
-        for field, ftype in attribute_map:
-            if field is not None:
-                la, created = Attribute.objects.get_or_create(
-                    layer=layer, attribute=field, attribute_type=ftype)
-                if created:
-                    if is_layer_attribute_aggregable(
-                            layer.storeType,
-                            field,
-                            ftype):
-                        logger.debug("Generating layer attribute statistics")
-                        result = get_attribute_statistics(layer.name, field)
-                        if result is not None:
-                            la.count = result['Count']
-                            la.min = result['Min']
-                            la.max = result['Max']
-                            la.average = result['Average']
-                            la.median = result['Median']
-                            la.stddev = result['StandardDeviation']
-                            la.sum = result['Sum']
-                            la.unique_values = result['unique_values']
-                            la.last_stats_updated = datetime.datetime.now()
-                    la.attribute_label = field.title()
-                    la.visible = ftype.find("gml:") != 0
-                    la.display_order = iter
-                    la.save()
-                    iter += 1
-                    logger.debug(
-                        "Created [%s] attribute for [%s]",
-                        field,
-                        layer.name.encode('utf-8'))
-    else:
-        logger.debug("No attributes found")
+            removed.append(la.id)
+        else:
+            existing[la.attribute] = la
+
+    changed = {}
+    refreshed = []
+    added = []
+    display_order = max([la.display_order for la in existing.values()] or [0]) + 1
+    for field, ftype in fields.items():
+        la = existing.get(field)
+        if la is None:
+            la = Attribute(
+                layer=layer,
+                attribute=field,
+                attribute_type=ftype,
+                attribute_label=field.title(),
+                visible=ftype.find("gml:") != 0,
+                display_order=display_order)
+            display_order += 1
+            added.append(la)
+        elif la.attribute_type != ftype:
+            changed.setdefault(ftype, []).append(la.id)
+            la.attribute_type = ftype
+            refreshed.append(la)
+        elif overwrite:
+            refreshed.append(la)
+
+    with transaction.atomic():
+        if removed:
+            Attribute.objects.filter(id__in=removed).delete()
+
+        # the type of an attribute changed, its statistics are no longer valid
+        for ftype, ids in changed.items():
+            Attribute.objects.filter(id__in=ids).update(
+                attribute_type=ftype,
+                visible=ftype.find("gml:") != 0,
+                **_empty_attribute_statistics())
+
+        Attribute.objects.bulk_create(added)
+
+    for la in added:
+        logger.debug(
+            "Created [%s] attribute for [%s]",
+            la.attribute,
+            layer.name.encode('utf-8'))
+
+    statistics = any(is_layer_attribute_aggregable(layer.storeType, la.attribute, la.attribute_type)
+                     for la in added + refreshed)
+    if statistics and queue_statistics:
+        queue_attribute_statistics(layer)
+    return statistics
+
+
+def _empty_attribute_statistics():
+    return dict(
+        count=1,
+        min='NA',
+        max='NA',
+        average='NA',
+        median='NA',
+        stddev='NA',
+        sum='NA',
+        unique_values='NA')
 
 
 def set_styles(layer, gs_catalog):
@@ -755,6 +1160,89 @@ def is_layer_attribute_aggregable(store_type, field_name, field_type):
     return True
 
 
+def queue_attribute_statistics(layer):
+    """
+    Schedule the computation of the statistics of all the aggregable
+    attributes of a layer, repeated requests for the same layer are
+    coalesced while the job is waiting.
+
+    Within a transaction the job may run before the layer and its
+    attributes are committed, it is then given the attributes to expect
+    and is retried until it finds them.
+    """
+    fields = None
+    if connections['default'].in_atomic_block:
+        fields = [la.attribute for la in layer.attribute_set.all()
+                  if is_layer_attribute_aggregable(layer.storeType, la.attribute, la.attribute_type)]
+    logger.debug("Queueing attribute statistics for [%s]", layer.name.encode('utf-8'))
+    statistics_workers.submit(('attribute_statistics', layer.id), update_attribute_statistics, layer.id, fields)
+
+
+def update_attribute_statistics(layer_id, fields=None):
+    """
+    Compute and store the statistics of all the aggregable attributes
+    of a layer.
+
+    When the names of the attributes to expect are given in ``fields`` and
+    the layer or any of them is not found, an exception is raised so the
+    job is retried once they are committed.
+    """
+    try:
+        layer = Layer.objects.get(id=layer_id)
+    except Layer.DoesNotExist:
+        if fields is not None:
+            raise GeoNodeException("Layer %s is not committed yet" % layer_id)
+        logger.warn("Layer %s was not found, its attribute statistics are not computed", layer_id)
+        return
+
+    attributes = [la for la in layer.attribute_set.all()
+                  if is_layer_attribute_aggregable(layer.storeType, la.attribute, la.attribute_type)]
+    if fields is not None and not set(fields) <= set(la.attribute for la in attributes):
+        raise GeoNodeException("The attributes of layer %s are not committed yet" % layer_id)
+    if not attributes:
+        logger.warn("Layer %s has no aggregable attributes, no statistics are computed",
+                    layer.name.encode('utf-8'))
+        return
+
+    results = get_layer_statistics(layer, [la.attribute for la in attributes])
+    now = datetime.datetime.now()
+    with transaction.atomic():
+        for la in attributes:
+            result = results.get(la.attribute)
+            if result is None:
+                continue
+            Attribute.objects.filter(id=la.id).update(
+                count=result['Count'],
+                min=result['Min'],
+                max=result['Max'],
+                average=result['Average'],
+                median=result['Median'],
+                stddev=result['StandardDeviation'],
+                sum=result['Sum'],
+                unique_values=result['unique_values'],
+                last_stats_updated=now)
+
+
+def get_layer_statistics(layer, fields):
+    """
+    Generate the statistics of several fields of a layer with the engine
+    configured in ATTRIBUTE_STATISTICS_ENGINE, the 'local' engine reads the
+    features once for all the fields, the 'wps' one makes two WPS requests
+    per field.
+    """
+    engine = getattr(settings, 'ATTRIBUTE_STATISTICS_ENGINE', 'wps')
+    if engine == 'local':
+        try:
+            from geonode.geoserver.statistics import compute_layer_statistics
+        except ImportError:
+            logger.warn('NumPy is required by the local attribute statistics engine, using WPS instead')
+        else:
+            logger.debug('Deriving aggregate statistics for layer %s', layer.name)
+            return compute_layer_statistics(layer, fields)
+
+    return dict((field, get_attribute_statistics(layer.name, field)) for field in fields)
+
+
 def get_attribute_statistics(layer_name, field):
     """
     Generate statistics (range, mean, median, standard deviation, unique values)
@@ -771,23 +1259,328 @@ def get_attribute_statistics(layer_name, field):
         logger.exception('Error generating layer aggregate statistics')
 
 
+def _principal_acls(model, **filters):
+    """Return the sets of ``(id, typename)`` of the layers readable and
+       writable through the object permissions of ``model`` (the user or
+       group object permissions) matching ``filters``.
+    """
+    rows = model.objects.filter(
+        content_type=ContentType.objects.get_for_model(ResourceBase),
+        permission__codename__in=('view_resourcebase', 'change_resourcebase'),
+        **filters).values_list('object_pk', 'permission__codename')
+    read, write = set(), set()
+    for object_pk, codename in rows:
+        (read if codename == 'view_resourcebase' else write).add(int(object_pk))
+    typenames = dict(Layer.objects.filter(
+        id__in=read | write).values_list('id', 'typename'))
+    return (set((i, typenames[i]) for i in read if i in typenames),
+            set((i, typenames[i]) for i in write if i in typenames))
+
+
+def _cached_acls(principal, compute):
+    key = 'layer_acls:%s:%s' % (acl_version(), principal)
+    acls = cache.get(key)
+    if acls is None:
+        acls = compute()
+        cache.set(key, acls, ogc_server_settings.ACL_CACHE_TTL)
+    return acls
+
+
+def group_acls(group_id):
+    """The readable and writable ``(id, typename)`` sets of a group.
+    """
+    return _cached_acls('group:%s' % group_id, partial(
+        _principal_acls, GroupObjectPermission, group_id=group_id))
+
+
+def user_acls(user):
+    """
+    The readable and writable ``(id, typename)`` sets of a user: the union
+    of its own permissions and of the ones of its groups, including the
+    anonymous group. Superusers can write every layer.
+    """
+    if user.is_anonymous():
+        user = get_anonymous_user()
+
+    def compute():
+        if user.is_superuser:
+            layers = set(Layer.objects.values_list('id', 'typename'))
+            return layers, layers
+        read, write = _principal_acls(UserObjectPermission, user_id=user.id)
+        for group_id in user.groups.values_list('id', flat=True):
+            group_read, group_write = group_acls(group_id)
+            read |= group_read
+            write |= group_write
+        return read, write
+
+    # a promotion or demotion of the user changes the key
+    return _cached_acls('%s:%s' % ('superuser' if user.is_superuser else 'user', user.id), compute)
+
+
+def get_layer_acls(user):
+    """
+    Return the lists of the typenames of the layers ``user`` can only read and
+    of the ones it can read and write, in the order the layers were created.
+
+    The ACL sets of every user and group are cached until the permissions of
+    a resource or the members of a group change.
+    """
+    read, write = user_acls(user)
+    read_only = [typename for i, typename in sorted(read - write)]
+    read_write = [typename for i, typename in sorted(read & write)]
+    return read_only, read_write
+
+
+def get_capabilities(url, parse, http=None, refresh=False):
+    """
+    Return the capabilities document at ``url`` parsed by ``parse``.
+
+    The documents are cached for CAPABILITIES_CACHE_TTL seconds, then
+    revalidated with a conditional request: they are only downloaded and
+    parsed again when GeoServer reports they changed. ``refresh`` forces
+    the revalidation.
+    """
+    if http is None:
+        http = http_client
+
+    now = time.time()
+    with _capabilities_lock:
+        entry = _capabilities.get(url)
+    if entry is not None and not refresh and \
+            now - entry['checked'] < ogc_server_settings.CAPABILITIES_CACHE_TTL:
+        return entry['parsed']
+
+    headers = {}
+    if entry is not None:
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+    response, body = http.request(url, headers=headers)
+
+    if response.status == 304 and entry is not None:
+        entry = dict(entry, checked=now)
+    elif response.status == 200:
+        entry = dict(parsed=parse(body),
+                     etag=response.get('etag'),
+                     last_modified=response.get('last-modified'),
+                     checked=now)
+    else:
+        raise GeoNodeException('Could not get the capabilities at %s: %s' % (url, response.status))
+
+    with _capabilities_lock:
+        _capabilities[url] = entry
+    return entry['parsed']
+
+
 def get_wcs_record(instance, retry=True):
-    wcs = WebCoverageService(ogc_server_settings.public_url + 'wcs', '1.0.0')
+    from geonode.utils import http_client as public_http_client
+
+    wcs_url = ogc_server_settings.public_url + 'wcs'
+    capabilities_url = wcs_url + '?service=WCS&request=GetCapabilities&version=1.0.0'
+
+    def parse(body):
+        return WebCoverageService(wcs_url, '1.0.0', xml=body)
+
     key = instance.workspace + ':' + instance.name
+    wcs = get_capabilities(capabilities_url, parse, http=public_http_client)
+    if key not in wcs.contents and retry:
+        # the cached capabilities can predate the coverage
+        wcs = get_capabilities(capabilities_url, parse, http=public_http_client, refresh=True)
     if key in wcs.contents:
         return wcs.contents[key]
     else:
         msg = ("Layer '%s' was not found in WCS service at %s." %
                (key, ogc_server_settings.public_url)
                )
-        if retry:
-            logger.debug(
-                msg +
-                ' Waiting a couple of seconds before trying again.')
-            time.sleep(2)
-            return get_wcs_record(instance, retry=False)
+        raise GeoNodeException(msg)
+
+
+def describe_coverage(typename):
+    """
+    Return the WCS 1.0.0 ``CoverageOffering`` element of a single coverage,
+    requested from GeoServer with a DescribeCoverage request.
+    """
+    url = ogc_server_settings.LOCATION + 'wcs?' + urllib.urlencode({
+        'service': 'WCS',
+        'version': '1.0.0',
+        'request': 'DescribeCoverage',
+        'coverage': typename.encode('utf-8'),
+    })
+    response, body = http_client.request(url)
+    offering = None
+    if response.status == 200:
+        try:
+            offering = etree.fromstring(body).find('{%s}CoverageOffering' % WCS_NAMESPACE)
+        except etree.XMLSyntaxError:
+            pass
+    if offering is None:
+        raise GeoNodeException("Coverage '%s' was not found in WCS service at %s." % (
+            typename, ogc_server_settings.LOCATION))
+    return offering
+
+
+def link_hosts():
+    """Hosts of the links GeoNode generates, links pointing elsewhere
+       are left over from a previous SITEURL or GeoServer public url.
+    """
+    return set([urlparse(settings.SITEURL).hostname,
+                urlparse(ogc_server_settings.public_url).hostname])
+
+
+def layer_links(links, instance, gs_resource):
+    """
+    Add the download (WMS, WFS or WCS and KML), tiles, legend, html and
+    OGC service links of a layer to a ``LinkSet``.
+    """
+    resource = instance.resourcebase_ptr
+    typename = instance.typename.encode('utf-8')
+
+    bbox = gs_resource.latlon_bbox
+    dx = float(bbox[1]) - float(bbox[0])
+    dy = float(bbox[3]) - float(bbox[2])
+
+    dataAspect = 1 if dy == 0 else dx / dy
+
+    height = 550
+    width = int(height * dataAspect)
+
+    # Set download links for WMS, WCS or WFS and KML
+
+    for ext, name, mime, wms_url in wms_links(ogc_server_settings.public_url + 'wms?',
+                                              typename, instance.bbox_string,
+                                              instance.srid, height, width):
+        links.add(resource, 'image', name, wms_url, ext, mime)
+
+    if instance.storeType == "dataStore":
+        for ext, name, mime, wfs_url in wfs_links(ogc_server_settings.public_url + 'wfs?', typename):
+            if mime == 'SHAPE-ZIP':
+                name = 'Zipped Shapefile'
+            links.add(resource, 'data', name, wfs_url, ext, mime)
+
+        if gs_resource.store.type.lower() == 'geogit':
+            repo_url = '{url}geogit/{workspace}:{store}'.format(
+                url=ogc_server_settings.public_url,
+                workspace=instance.workspace,
+                store=instance.store)
+
+            path = gs_resource.dom.findall('nativeName')
+
+            if path:
+                path = 'path={path}'.format(path=path[0].text)
+
+            command_url = lambda command: "{repo_url}/{command}.json?{path}".format(
+                repo_url=repo_url,
+                path=path,
+                command=command)
+
+            links.add(resource, 'html', 'Clone in GeoGit', repo_url, 'html', 'text/xml')
+            links.add(resource, 'html', 'GeoGit log', command_url('log'), 'json', 'application/json')
+            links.add(resource, 'html', 'GeoGit statistics', command_url('statistics'),
+                      'json', 'application/json')
+
+    elif instance.storeType == 'coverageStore':
+        # the grid and the formats of the coverage are read with a single
+        # authenticated DescribeCoverage request, so the layer does not need
+        # to be made public while the links are built.
+        try:
+            offering = describe_coverage(instance.typename)
+        except GeoNodeException as e:
+            msg = 'Could not create a download link for layer.'
+            logger.warn(msg, e)
         else:
-            raise GeoNodeException(msg)
+            # Potentially 3 dimensions can be returned by the grid if there is a z
+            # axis.  Since we only want width/height, slice to the second
+            # dimension
+            covWidth, covHeight = _coverage_grid_extent(offering)[:2]
+            formats = [f.text for f in offering.iter('{%s}formats' % WCS_NAMESPACE)]
+            for ext, name, mime, wcs_url in wcs_links(ogc_server_settings.public_url + 'wcs?',
+                                                      typename,
+                                                      bbox=gs_resource.native_bbox[:-1],
+                                                      crs=gs_resource.native_bbox[-1],
+                                                      height=str(covHeight),
+                                                      width=str(covWidth),
+                                                      formats=formats):
+                links.add(resource, 'data', name, wcs_url, ext, mime)
+
+    kml_reflector_link_download = ogc_server_settings.public_url + "wms/kml?" + \
+        urllib.urlencode({'layers': typename, 'mode': "download"})
+    links.add(resource, 'data', _("KML"), kml_reflector_link_download, 'kml', 'text/xml')
+
+    kml_reflector_link_view = ogc_server_settings.public_url + "wms/kml?" + \
+        urllib.urlencode({'layers': typename, 'mode': "refresh"})
+    links.add(resource, 'data', "View in Google Earth", kml_reflector_link_view, 'kml', 'text/xml')
+
+    tile_url = ('%sgwc/service/gmaps?' % ogc_server_settings.public_url +
+                'layers=%s' % typename +
+                '&zoom={z}&x={x}&y={y}' +
+                '&format=image/png8'
+                )
+    links.add(resource, 'image', _("Tiles"), tile_url, 'tiles', 'image/png')
+
+    html_link_url = '%s%s' % (
+        settings.SITEURL[:-1], instance.get_absolute_url())
+    links.add(resource, 'html', instance.typename, html_link_url, 'html', 'text/html')
+
+    legend_url = ogc_server_settings.PUBLIC_LOCATION + \
+        'wms?request=GetLegendGraphic&format=image/png&WIDTH=20&HEIGHT=20&LAYER=' + \
+        instance.typename + '&legend_options=fontAntiAliasing:true;fontSize:12;forceLabels:on'
+    links.add(resource, 'image', _('Legend'), legend_url, 'png', 'image/png')
+
+    services = [('OGC:WMS', 'wms', 'WMS')]
+    if instance.storeType == "dataStore":
+        services.append(('OGC:WFS', 'wfs', 'WFS'))
+    if instance.storeType == "coverageStore":
+        services.append(('OGC:WCS', 'wcs', 'WCS'))
+    for link_type, service, service_name in services:
+        ogc_url = urljoin(ogc_server_settings.public_url, '%s/%s' % (instance.workspace, service))
+        ogc_name = 'OGC %s: %s Service' % (service_name, instance.workspace)
+        links.add(resource, link_type, ogc_name, ogc_url, 'html', 'text/html')
+
+
+def relink_layers(layers=None, workers=1, batch_size=100, console=None):
+    """
+    Regenerate the links of the layers hosted in GeoServer, for instance
+    after a change of SITEURL or of the GeoServer public url.
+
+    The GeoServer resources of every batch of layers are fetched by
+    ``workers`` threads and the links of the whole batch are written
+    with a ``LinkSet``.
+    """
+    from geonode.base.models import LinkSet
+
+    if layers is None:
+        layers = Layer.objects.exclude(storeType='remoteStore')
+    layers = list(layers)
+
+    def fetch(layer):
+        try:
+            return _thread_catalog().get_resource(
+                layer.name, store=layer.store, workspace=layer.workspace)
+        except Exception:
+            logger.exception('Could not fetch the resource of layer %s', layer.typename)
+
+    stats = dict(layers=0, failed=0, created=0, updated=0, deleted=0)
+    hosts = link_hosts()
+    for i in range(0, len(layers), batch_size):
+        chunk = layers[i:i + batch_size]
+        links = LinkSet(keep_hosts=hosts)
+        for layer, gs_resource in zip(chunk, _parallel_map(fetch, chunk, workers)):
+            if gs_resource is None:
+                stats['failed'] += 1
+                continue
+            try:
+                layer_links(links, layer, gs_resource)
+            except Exception:
+                stats['failed'] += 1
+                logger.exception('Could not build the links of layer %s', layer.typename)
+                continue
+            stats['layers'] += 1
+        for key, value in links.apply().items():
+            stats[key] += value
+        if console is not None:
+            print >> console, 'Relinked %d of %d layers' % (min(i + batch_size, len(layers)), len(layers))
+    return stats
 
 
 def get_coverage_grid_extent(instance):
@@ -795,10 +1588,16 @@ def get_coverage_grid_extent(instance):
         Returns a list of integers with the size of the coverage
         extent in pixels
     """
-    instance_wcs = get_wcs_record(instance)
-    grid = instance_wcs.grid
-    return [(int(h) - int(l) + 1) for
-            h, l in zip(grid.highlimits, grid.lowlimits)]
+    return _coverage_grid_extent(describe_coverage(instance.typename))
+
+
+def _coverage_grid_extent(offering):
+    envelope = offering.find('.//{%s}GridEnvelope' % GML_NAMESPACE)
+    if envelope is None:
+        raise GeoNodeException('The coverage description has no grid envelope.')
+    low = envelope.findtext('{%s}low' % GML_NAMESPACE).split()
+    high = envelope.findtext('{%s}high' % GML_NAMESPACE).split()
+    return [(int(h) - int(l) + 1) for h, l in zip(high, low)]
 
 
 GEOSERVER_LAYER_TYPES = {
@@ -1122,6 +1921,125 @@ class ServerDoesNotExist(Exception):
     pass
 
 
+class CachingCatalog(object):
+
+    """
+    Read-through cache in front of a gsconfig Catalog.
+
+    The resources, layers, stores, styles and workspaces looked up by name
+    are kept for ``ttl`` seconds, keyed by the method and its workspace,
+    store and name arguments. Every write made through the catalog (save,
+    delete, create_*, ...) empties the cache, so a process always sees its
+    own changes, while the changes made by other processes are seen after
+    ``ttl`` seconds at most.
+
+    The other attributes are the ones of the wrapped catalog.
+    """
+
+    CACHED_METHODS = ('get_resource', 'get_layer', 'get_store', 'get_style',
+                      'get_workspace', 'get_layergroup')
+    WRITE_METHODS = ('save', 'delete', 'reload', 'add_data_to_store', 'create_featurestore',
+                     'create_coveragestore', 'create_coveragestore2', 'create_imagemosaic',
+                     'create_style', 'create_workspace', 'create_layergroup')
+
+    def __init__(self, catalog, ttl=10):
+        self.catalog = catalog
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = Lock()
+        self.counters = dict.fromkeys(['hits', 'misses', 'invalidations'], 0)
+
+    def __getattr__(self, name):
+        attr = getattr(self.catalog, name)
+        if name in self.CACHED_METHODS:
+            return partial(self._cached, name, attr)
+        if name in self.WRITE_METHODS:
+            return partial(self._write, attr)
+        return attr
+
+    def _key(self, name, args, kwargs):
+        def value(v):
+            # gsconfig objects are identified by their workspace and name
+            workspace = getattr(v, 'workspace', None)
+            if workspace is not None:
+                return (getattr(workspace, 'name', workspace), v.name)
+            return getattr(v, 'name', v)
+        return (name, tuple(value(v) for v in args),
+                tuple(sorted((k, value(v)) for k, v in kwargs.items())))
+
+    def _cached(self, name, method, *args, **kwargs):
+        key = self._key(name, args, kwargs)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self.counters['hits'] += 1
+                return _copy_catalog_object(entry[1])
+            self.counters['misses'] += 1
+
+        result = method(*args, **kwargs)
+        with self._lock:
+            self._entries[key] = (now, _copy_catalog_object(result))
+        return result
+
+    def _write(self, method, *args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        finally:
+            self.clear_cache()
+
+    def clear_cache(self):
+        """Forget the cached objects, also the responses cached by gsconfig.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.counters['invalidations'] += 1
+        self.catalog._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['size'] = len(self._entries)
+        return stats
+
+
+class InvalidatingCatalog(object):
+
+    """
+    Proxy of a gsconfig Catalog whose writes empty the cache of a
+    ``CachingCatalog``, so the objects cached by ``gs_catalog`` are not
+    left stale by the writes of the per-thread catalogs.
+    """
+
+    def __init__(self, catalog, cache):
+        self.catalog = catalog
+        self.cache = cache
+
+    def __getattr__(self, name):
+        attr = getattr(self.catalog, name)
+        if name in CachingCatalog.WRITE_METHODS:
+            return partial(self._write, attr)
+        return attr
+
+    def _write(self, method, *args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        finally:
+            self.cache.clear_cache()
+
+
+def _copy_catalog_object(obj):
+    """Copy a gsconfig object without its unsaved changes, so callers
+       modifying the objects they get do not alter the cached ones.
+    """
+    if isinstance(obj, list):
+        return [_copy_catalog_object(o) for o in obj]
+    if hasattr(obj, 'dirty'):
+        obj = copy.copy(obj)
+        obj.dirty = dict()
+    return obj
+
+
 class OGC_Server(object):
 
     """
@@ -1260,12 +2178,25 @@ class OGC_Servers_Handler(object):
         server.setdefault('PASSWORD', 'geoserver')
         server.setdefault('DATASTORE', str())
         server.setdefault('GEOGIT_DATASTORE_DIR', str())
+        server.setdefault('TIMEOUT', 10)
+        server.setdefault('MAX_RETRIES', 2)
+        server.setdefault('POOL_MAXSIZE', 10)
+        server.setdefault('CATALOG_CACHE_TTL', 10)
+        server.setdefault('CAPABILITIES_CACHE_TTL', 300)
+        server.setdefault('ACL_CACHE_TTL', 300)
+        server.setdefault('GWC_SEED_GRIDSETS', ('EPSG:900913',))
+        server.setdefault('GWC_SEED_FORMAT', 'image/png')
+        server.setdefault('GWC_SEED_ZOOM_START', 0)
+        server.setdefault('GWC_SEED_ZOOM_STOP', 10)
+        server.setdefault('GWC_SEED_THREADS', 1)
+        server.setdefault('GWC_SEED_PRIORITY', 0)
+        server.setdefault('GWC_SEED_MAX_TASKS', 2)
 
         for option in ['MAPFISH_PRINT_ENABLED', 'PRINT_NG_ENABLED', 'GEONODE_SECURITY_ENABLED',
-                       'BACKEND_WRITE_ENABLED']:
+                       'BACKEND_WRITE_ENABLED', 'GWC_TRUNCATE_ENABLED']:
             server.setdefault(option, True)
 
-        for option in ['GEOGIT_ENABLED', 'WMST_ENABLED', 'WPS_ENABLED']:
+        for option in ['GEOGIT_ENABLED', 'WMST_ENABLED', 'WPS_ENABLED', 'GWC_SEED_ENABLED']:
             server.setdefault(option, False)
 
     def __getitem__(self, alias):
@@ -1292,23 +2223,7 @@ class OGC_Servers_Handler(object):
 def get_wms():
     wms_url = ogc_server_settings.internal_ows + \
         "?service=WMS&request=GetCapabilities&version=1.1.0"
-    netloc = urlparse(wms_url).netloc
-    http = httplib2.Http()
-    http.add_credentials(_user, _password)
-    http.authorizations.append(
-        httplib2.BasicAuthentication(
-            (_user, _password),
-            netloc,
-            wms_url,
-            {},
-            None,
-            None,
-            http
-        )
-    )
-    body = http.request(wms_url)[1]
-    _wms = WebMapService(wms_url, xml=body)
-    return _wms
+    return get_capabilities(wms_url, lambda body: WebMapService(wms_url, xml=body))
 
 
 def wps_execute_layer_attribute_statistics(layer_name, field):
@@ -1326,7 +2241,8 @@ def wps_execute_layer_attribute_statistics(layer_name, field):
                                'field': field
                                })
 
-    response = http_post(url, request, timeout=ogc_server_settings.TIMEOUT)
+    response = http_client.request(url, 'POST', body=request,
+                                   headers={'Content-Type': 'application/xml'})[1]
 
     exml = etree.fromstring(response)
 
@@ -1354,10 +2270,36 @@ def wps_execute_layer_attribute_statistics(layer_name, field):
                                    'field': field
                                    })
 
-        response = http_post(url, request, timeout=ogc_server_settings.TIMEOUT)
+        response = http_client.request(url, 'POST', body=request,
+                                       headers={'Content-Type': 'application/xml'})[1]
 
         exml = etree.fromstring(response)
 
+        result['unique_values'] = ','.join(
+            [v.text for v in exml.xpath("//*[local-name()='value']") if v.text is not None])
+
+    return result
+
+
+def invalidate_style_layers(style):
+    """
+    Refresh what depends on the rendering of the layers using ``style``:
+    their cached legends are dropped, and their thumbnails and tiles are
+    regenerated in the background.
+    """
+    from geonode.geoserver.gwc import refresh_layer_tiles
+    from geonode.geoserver.thumbnails import queue_thumbnail
+    layers = Layer.objects.filter(
+        Q(styles=style) | Q(default_style=style)).distinct()
+    typenames = set()
+    for layer in layers:
+        typenames.add(layer.typename)
+        queue_thumbnail(layer)
+        refresh_layer_tiles(layer)
+    if typenames:
+        from geonode.proxy.cache import proxy_cache
+        proxy_cache.invalidate(typenames, operations=['GetLegendGraphic'])
+
 
 def style_update(request, url):
     """
@@ -1397,8 +2339,9 @@ def style_update(request, url):
             if len(elm_user_style_title.text) > 0:
                 style.sld_title = elm_user_style_title.text
             style.save()
-            for layer in style.layer_styles.all():
-                layer.save()
+            # only the thumbnails and legends of the layers changed, there is
+            # no need to go through their whole save and sync chain.
+            invalidate_style_layers(style)
     if request.method == 'DELETE':  # delete style from GN
         style_name = os.path.basename(request.path)
         style = Style.objects.all().filter(name=style_name)[0]
@@ -1410,25 +2353,28 @@ _wms = None
 _csw = None
 _user, _password = ogc_server_settings.credentials
 
-http_client = httplib2.Http()
-http_client.add_credentials(_user, _password)
-http_client.add_credentials(_user, _password)
-_netloc = urlparse(ogc_server_settings.LOCATION).netloc
-http_client.authorizations.append(
-    httplib2.BasicAuthentication(
-        (_user, _password),
-        _netloc,
-        ogc_server_settings.LOCATION,
-        {},
-        None,
-        None,
-        http_client
-    )
-)
+
+# transport shared by all the requests sent to GeoServer, it authenticates
+# the requests to the GeoServer host only.
+http_client = HttpTransport(
+    timeout=ogc_server_settings.TIMEOUT,
+    retries=ogc_server_settings.MAX_RETRIES,
+    pool_size=ogc_server_settings.POOL_MAXSIZE,
+    credentials=(_user, _password),
+    auth_hosts=[urlparse(ogc_server_settings.LOCATION).netloc])
+_thread_clients = local()
+_capabilities = {}
+_capabilities_lock = Lock()
+
+WCS_NAMESPACE = 'http://www.opengis.net/wcs'
+GML_NAMESPACE = 'http://www.opengis.net/gml'
+statistics_workers = WorkerPool('attribute_statistics', retries=5)
 
 
 url = ogc_server_settings.rest
-gs_catalog = Catalog(url, _user, _password)
+_catalog = Catalog(url, _user, _password)
+_catalog.http = http_client
+gs_catalog = CachingCatalog(_catalog, ttl=ogc_server_settings.CATALOG_CACHE_TTL)
 gs_uploader = Client(url, _user, _password)
 
 _punc = re.compile(r"[\.:]")  # regex for punctuation that confuses restconfig
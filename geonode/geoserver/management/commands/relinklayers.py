@@ -0,0 +1,81 @@
+#########################################################################
+#
+# Copyright (C) 2012 OpenPlans
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from geonode.layers.models import Layer
+from geonode.geoserver.helpers import relink_layers
+import sys
+
+
+class Command(BaseCommand):
+    help = 'Regenerate the OGC, download and service links of the GeoServer layers'
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '-f',
+            '--filter',
+            dest="filter",
+            default=None,
+            help="Only relink the layers whose name starts with the given filter"),
+        make_option(
+            '-w',
+            '--workspace',
+            dest="workspace",
+            default=None,
+            help="Only relink the layers of the specified workspace"),
+        make_option(
+            '-j',
+            '--workers',
+            dest="workers",
+            type="int",
+            default=1,
+            help="Number of concurrent requests made to GeoServer"),
+        make_option(
+            '--batch-size',
+            dest="batch_size",
+            type="int",
+            default=100,
+            help="Number of layers whose links are written at once"))
+
+    def handle(self, **options):
+        verbosity = int(options.get('verbosity'))
+        filter = options.get('filter')
+        workspace = options.get('workspace')
+
+        if verbosity > 0:
+            console = sys.stdout
+        else:
+            console = None
+
+        layers = Layer.objects.exclude(storeType='remoteStore')
+        if filter:
+            layers = layers.filter(name__startswith=filter)
+        if workspace:
+            layers = layers.filter(workspace=workspace)
+
+        stats = relink_layers(layers,
+                              workers=options.get('workers'),
+                              batch_size=options.get('batch_size'),
+                              console=console)
+
+        if verbosity > 0:
+            print "\n%d Relinked layers" % stats['layers']
+            print "%d Failed layers" % stats['failed']
+            print "%d Created, %d updated and %d deleted links" % (
+                stats['created'], stats['updated'], stats['deleted'])
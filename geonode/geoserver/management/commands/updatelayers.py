@@ -53,6 +53,18 @@ class Command(BaseCommand):
             dest='remove_deleted',
             default=False,
             help='Remove GeoNode layers that have been deleted from GeoSever.'),
+        make_option(
+            '--dry-run',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help='With --remove-deleted, only report the layers that would be deleted.'),
+        make_option(
+            '--incremental',
+            action='store_true',
+            dest='incremental',
+            default=False,
+            help='Skip the layers whose GeoServer resource did not change since the last update.'),
         make_option(
             '-u',
             '--user',
@@ -76,19 +88,36 @@ class Command(BaseCommand):
             '--workspace',
             dest="workspace",
             default=None,
-            help="Only update data on specified workspace"))
+            help="Only update data on specified workspace"),
+        make_option(
+            '-j',
+            '--workers',
+            dest="workers",
+            type="int",
+            default=1,
+            help="Number of concurrent requests made to GeoServer"),
+        make_option(
+            '--batch-size',
+            dest="batch_size",
+            type="int",
+            default=100,
+            help="Number of layers saved in each database transaction"))
 
     def handle(self, **options):
         ignore_errors = options.get('ignore_errors')
         skip_unadvertised = options.get('skip_unadvertised')
         skip_geonode_registered = options.get('skip_geonode_registered')
         remove_deleted = options.get('remove_deleted')
+        incremental = options.get('incremental')
+        dry_run = options.get('dry_run')
         verbosity = int(options.get('verbosity'))
         user = options.get('user')
         owner = get_valid_user(user)
         workspace = options.get('workspace')
         filter = options.get('filter')
         store = options.get('store')
+        workers = options.get('workers')
+        batch_size = options.get('batch_size')
 
         if verbosity > 0:
             console = sys.stdout
@@ -105,7 +134,11 @@ class Command(BaseCommand):
             filter=filter,
             skip_unadvertised=skip_unadvertised,
             skip_geonode_registered=skip_geonode_registered,
-            remove_deleted=remove_deleted)
+            remove_deleted=remove_deleted,
+            workers=workers,
+            batch_size=batch_size,
+            incremental=incremental,
+            dry_run=dry_run)
 
         if verbosity > 1:
             print "\nDetailed report of failures:"
@@ -129,6 +162,7 @@ class Command(BaseCommand):
                 len(output['layers']), round(output['stats']['duration_sec'], 2))
             print "%d Created layers" % output['stats']['created']
             print "%d Updated layers" % output['stats']['updated']
+            print "%d Unchanged layers" % output['stats']['unchanged']
             print "%d Failed layers" % output['stats']['failed']
             try:
                 duration_layer = round(
@@ -137,5 +171,14 @@ class Command(BaseCommand):
                 duration_layer = 0
             if len(output) > 0:
                 print "%f seconds per layer" % duration_layer
-            if remove_deleted:
+            print "%.2f layers per second using %d workers" % (
+                output['stats']['layers_per_sec'], output['stats']['workers'])
+            if verbosity > 1:
+                for stage, seconds in sorted(output['stats']['timings'].items()):
+                    print "  %s: %.2f seconds" % (stage, seconds)
+            if remove_deleted and dry_run:
+                print "\n%d Layers would be deleted:" % len(output['deleted_layers'])
+                for dict_ in output['deleted_layers']:
+                    print "  %s" % dict_['name']
+            elif remove_deleted:
                 print "\n%d Deleted layers" % output['stats']['deleted']
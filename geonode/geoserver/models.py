@@ -1,16 +1,131 @@
+from django.conf import settings
+from django.db import models
 from django.db.models import signals
+from django.utils.translation import ugettext_lazy as _
 
 from geonode.layers.models import Layer
 from geonode.maps.models import Map, MapLayer
+from geonode.security.models import invalidate_acls
 
-from geonode.geoserver.signals import geoserver_pre_save
-from geonode.geoserver.signals import geoserver_pre_delete
-from geonode.geoserver.signals import geoserver_post_save
-from geonode.geoserver.signals import geoserver_post_save_map
-from geonode.geoserver.signals import geoserver_pre_save_maplayer
+
+class LayerFingerprint(models.Model):
+
+    """
+    Digest of the GeoServer resource a layer was last synchronised from.
+
+    It is used by ``updatelayers --incremental`` to skip the resources
+    that did not change since the previous run.
+    """
+    layer = models.OneToOneField(Layer, related_name='gs_fingerprint')
+    fingerprint = models.CharField(_('fingerprint'), max_length=40)
+    last_updated = models.DateTimeField(_('last updated'), auto_now=True)
+
+    def __str__(self):
+        return "%s" % self.fingerprint
+
+
+class LayerSync(models.Model):
+
+    """
+    Status of the synchronisation of a layer with GeoServer when it is
+    deferred to a background job (GEOSERVER_DEFERRED_POST_SAVE).
+    """
+    STATUS_CHOICES = (
+        ('queued', _('Queued')),
+        ('running', _('Running')),
+        ('done', _('Done')),
+        ('failed', _('Failed')),
+    )
+
+    layer = models.OneToOneField(Layer, related_name='gs_sync')
+    status = models.CharField(_('status'), max_length=10, choices=STATUS_CHOICES, default='queued')
+    stage = models.CharField(_('stage'), max_length=20, blank=True)
+    attempts = models.PositiveIntegerField(_('attempts'), default=0)
+    error = models.TextField(_('error'), blank=True)
+    requested = models.DateTimeField(_('requested'))
+    last_updated = models.DateTimeField(_('last updated'), auto_now=True)
+
+    def __str__(self):
+        return "%s" % self.status
+
+
+class BatchDownload(models.Model):
+
+    """
+    Archive of the data of a set of layers built by a background job of the
+    download engine. The archives are shared by the jobs requesting the same
+    layers while none of them changed.
+    """
+    STATUS_CHOICES = (
+        ('queued', _('Queued')),
+        ('running', _('Running')),
+        ('finished', _('Finished')),
+        ('failed', _('Failed')),
+        ('cancelled', _('Cancelled')),
+    )
+
+    key = models.CharField(_('key'), max_length=40, unique=True)
+    layers = models.TextField(_('layers'))
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, blank=True, null=True)
+    status = models.CharField(_('status'), max_length=10, choices=STATUS_CHOICES, default='queued')
+    progress = models.PositiveSmallIntegerField(_('progress'), default=0)
+    error = models.TextField(_('error'), blank=True)
+    size = models.BigIntegerField(_('size'), default=0)
+    created = models.DateTimeField(_('created'), auto_now_add=True)
+    last_updated = models.DateTimeField(_('last updated'), auto_now=True)
+
+    def __str__(self):
+        return "%s" % self.status
+
+
+class TileJob(models.Model):
+
+    """
+    Seeding or truncation of the GeoWebCache tiles of a layer. The jobs are
+    sent to the GeoWebCache REST API by a background dispatcher, the ones
+    with the highest priority first.
+    """
+    TYPE_CHOICES = (
+        ('seed', _('Seed')),
+        ('reseed', _('Reseed')),
+        ('truncate', _('Truncate')),
+    )
+    STATUS_CHOICES = (
+        ('queued', _('Queued')),
+        ('running', _('Running')),
+        ('finished', _('Finished')),
+        ('failed', _('Failed')),
+    )
+
+    layer = models.ForeignKey(Layer, related_name='tile_jobs')
+    type = models.CharField(_('type'), max_length=10, choices=TYPE_CHOICES)
+    status = models.CharField(_('status'), max_length=10, choices=STATUS_CHOICES, default='queued')
+    priority = models.IntegerField(_('priority'), default=0)
+    gridset = models.CharField(_('gridset'), max_length=100, blank=True)
+    tile_format = models.CharField(_('format'), max_length=50, blank=True)
+    # the extent seeded, in the CRS of the gridset, the whole layer if empty
+    bbox = models.CharField(_('bounding box'), max_length=255, blank=True)
+    zoom_start = models.PositiveSmallIntegerField(_('first zoom level'), null=True, blank=True)
+    zoom_stop = models.PositiveSmallIntegerField(_('last zoom level'), null=True, blank=True)
+    tiles_done = models.BigIntegerField(_('tiles done'), default=0)
+    tiles_total = models.BigIntegerField(_('tiles total'), default=0)
+    error = models.TextField(_('error'), blank=True)
+    created = models.DateTimeField(_('created'), auto_now_add=True)
+    last_updated = models.DateTimeField(_('last updated'), auto_now=True)
+
+    def __str__(self):
+        return "%s %s" % (self.type, self.status)
+
+from geonode.geoserver.signals import geoserver_pre_save  # noqa
+from geonode.geoserver.signals import geoserver_pre_delete  # noqa
+from geonode.geoserver.signals import geoserver_post_save  # noqa
+from geonode.geoserver.signals import geoserver_post_save_map  # noqa
+from geonode.geoserver.signals import geoserver_pre_save_maplayer  # noqa
 
 signals.pre_save.connect(geoserver_pre_save, sender=Layer)
 signals.pre_delete.connect(geoserver_pre_delete, sender=Layer)
 signals.post_save.connect(geoserver_post_save, sender=Layer)
 signals.pre_save.connect(geoserver_pre_save_maplayer, sender=MapLayer)
 signals.post_save.connect(geoserver_post_save_map, sender=Map)
+# the layer ACLs list the typenames of the layers
+signals.post_delete.connect(invalidate_acls, sender=Layer)
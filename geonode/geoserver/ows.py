@@ -24,6 +24,7 @@ from owslib.wcs import WebCoverageService
 from owslib.coverage.wcsBase import ServiceException
 import urllib
 from geonode import GeoNodeException
+from geonode.utils import http_client
 from re import sub
 
 logger = logging.getLogger(__name__)
@@ -40,12 +41,22 @@ def wcs_links(
         width=None,
         exclude_formats=True,
         quiet=True,
-        version='1.0.0'):
+        version='1.0.0',
+        formats=None):
+    # When the supported formats of the coverage are known, the GetCoverage
+    # urls are built without querying the WCS service.
+    if formats is not None:
+        return [(f, f, f, _wcs_link(wcs_url, identifier, f, bbox, crs, height, width, version))
+                for f in formats
+                if not (exclude_formats and f in DEFAULT_EXCLUDE_FORMATS)]
+
     # FIXME(Ariel): This would only work for layers marked for public view,
     # what about the ones with permissions enabled?
 
     try:
-        wcs = WebCoverageService(wcs_url, version=version)
+        capabilities = http_client.request(
+            '%sservice=WCS&request=GetCapabilities&version=%s' % (wcs_url, version))[1]
+        wcs = WebCoverageService(wcs_url, version=version, xml=capabilities)
     except ServiceException as err:
         err_msg = 'WCS server returned exception: %s' % err
         if not quiet:
@@ -86,6 +97,20 @@ def wcs_links(
     return output
 
 
+def _wcs_link(wcs_url, identifier, mime, bbox, crs, height, width, version):
+    return wcs_url + urllib.urlencode([
+        ('service', 'WCS'),
+        ('request', 'GetCoverage'),
+        ('version', version),
+        ('coverage', identifier),
+        ('format', mime),
+        ('bbox', ','.join(str(b) for b in bbox)),
+        ('crs', crs),
+        ('height', height),
+        ('width', width),
+    ])
+
+
 def _wfs_link(wfs_url, identifier, mime, extra_params):
     params = {
         'service': 'WFS',
@@ -1,26 +1,26 @@
 import errno
 import logging
-import urllib
-import json
+import datetime
+import traceback
 
-from urlparse import urlparse, urljoin
 from socket import error as socket_error
 
-from django.utils.translation import ugettext, ugettext_lazy as _
-from django.core.files.base import ContentFile
 from django.conf import settings
+from django.db import connection
+from django.db.models import F
 
-from geonode import GeoNodeException
-from geonode.geoserver.ows import wcs_links, wfs_links, wms_links
 from geonode.geoserver.helpers import cascading_delete, set_attributes
-from geonode.geoserver.helpers import set_styles, gs_catalog, get_coverage_grid_extent
+from geonode.geoserver.helpers import set_styles, gs_catalog
 from geonode.geoserver.helpers import ogc_server_settings
+from geonode.geoserver.helpers import layer_links, link_hosts
+from geonode.geoserver.helpers import _thread_catalog
 from geonode.geoserver.helpers import geoserver_upload
-from geonode.utils import http_client
-from geonode.base.models import Link
-from geonode.base.models import Thumbnail
-from geonode.layers.utils import create_thumbnail
+from geonode.geoserver.gwc import refresh_layer_tiles
+from geonode.geoserver.thumbnails import queue_thumbnail, queue_map_thumbnail
+from geonode.base.models import LinkSet
+from geonode.layers.models import Layer
 from geonode.people.models import Profile
+from geonode.workers import WorkerPool
 
 from geoserver.layer import Layer as GsLayer
 
@@ -33,7 +33,7 @@ def geoserver_pre_delete(instance, sender, **kwargs):
     # cascading_delete should only be called if
     # ogc_server_settings.BACKEND_WRITE_ENABLED == True
     if getattr(ogc_server_settings, "BACKEND_WRITE_ENABLED", True):
-        if instance.storeType != "remoteStore":
+        if instance.storeType != "remoteStore" and not getattr(instance, 'gs_deleted', False):
             cascading_delete(gs_catalog, instance.typename)
 
 
@@ -49,6 +49,10 @@ def geoserver_pre_save(instance, sender, **kwargs):
         * Metadata Links,
         * Point of Contact name and url
     """
+    # the caller synchronises the layer with GeoServer itself, see gs_slurp
+    if getattr(instance, 'gs_sync_deferred', False):
+        return
+
     base_file = instance.get_base_file()
 
     # There is no need to process it if there is not file.
@@ -64,6 +68,8 @@ def geoserver_pre_save(instance, sender, **kwargs):
                                                   abstract=instance.abstract,
                                                   #               keywords=instance.keywords,
                                                   charset=instance.charset)
+    # the tiles of the layer are refreshed once it is saved
+    instance.gs_uploaded = True
 
     # Set fields obtained via the geoserver upload.
     instance.name = gs_name
@@ -136,319 +142,149 @@ def geoserver_post_save(instance, sender, **kwargs):
 
        The way keywords are implemented requires the layer
        to be saved to the database before accessing them.
-    """
 
-    if instance.storeType == "remoteStore":
-        # Save layer attributes
-        set_attributes(instance)
+       With GEOSERVER_DEFERRED_POST_SAVE the synchronisation with GeoServer
+       is recorded and run by a background job, see ``queue_layer_sync``.
+    """
+    if getattr(instance, 'gs_sync_deferred', False):
         return
 
+    if getattr(instance, 'gs_uploaded', False):
+        instance.gs_uploaded = False
+        refresh_layer_tiles(instance, created=kwargs.get('created', False))
+
+    if getattr(settings, 'GEOSERVER_DEFERRED_POST_SAVE', False):
+        if not connection.in_atomic_block:
+            queue_layer_sync(instance)
+            return
+        # the background job would not see the uncommitted layer.
+        logger.debug('Synchronising layer %s within the transaction', instance.name)
+
+    sync_layer(instance)
+
+
+def queue_layer_sync(instance):
+    """Record that a layer needs to be synchronised with GeoServer and
+       schedule the job, repeated saves of a layer whose job is still
+       waiting are coalesced.
+    """
+    from geonode.geoserver.models import LayerSync
+
+    now = datetime.datetime.now()
+    if not LayerSync.objects.filter(layer=instance).update(
+            status='queued', requested=now):
+        LayerSync.objects.create(layer=instance, status='queued', requested=now)
+    sync_workers.submit(('layer_sync', instance.id), run_layer_sync, instance.id)
+
+
+def run_layer_sync(layer_id):
+    """Background job synchronising a layer with GeoServer.
+
+       The status of the job is kept in the ``LayerSync`` of the layer, the
+       stages are idempotent so a failed job is simply run again.
+    """
+    from geonode.geoserver.models import LayerSync
+
     try:
-        gs_resource = gs_catalog.get_resource(
-            instance.name,
-            store=instance.store,
-            workspace=instance.workspace)
-    except socket_error as serr:
-        if serr.errno != errno.ECONNREFUSED:
-            # Not the error we are looking for, re-raise
-            raise serr
-        # If the connection is refused, take it easy.
+        instance = Layer.objects.get(id=layer_id)
+    except Layer.DoesNotExist:
         return
 
-    if gs_resource is None:
+    sync = LayerSync.objects.filter(layer=instance)
+    sync.update(status='running', stage='', error='', attempts=F('attempts') + 1)
+
+    def on_stage(stage):
+        sync.update(stage=stage)
+
+    try:
+        sync_layer(instance, catalog=_thread_catalog(), on_stage=on_stage)
+    except Exception:
+        sync.update(status='failed', error=traceback.format_exc())
+        raise
+    sync.update(status='done', stage='')
+
+
+def sync_layer(instance, catalog=None, on_stage=None, gs_resource=None, stages=None):
+    """Run the stages synchronising a layer with its GeoServer resource.
+
+       ``gs_resource`` saves fetching the resource again when the caller
+       already has it, ``stages`` restricts the stages that are run.
+    """
+    if catalog is None:
+        catalog = gs_catalog
+    if stages is None:
+        stages = POST_SAVE_STAGES
+
+    if instance.storeType == "remoteStore":
+        # Save layer attributes
+        set_attributes(instance)
         return
 
+    if gs_resource is None:
+        try:
+            gs_resource = catalog.get_resource(
+                instance.name,
+                store=instance.store,
+                workspace=instance.workspace)
+        except socket_error as serr:
+            if serr.errno != errno.ECONNREFUSED:
+                # Not the error we are looking for, re-raise
+                raise serr
+            # If the connection is refused, take it easy.
+            return
+
+        if gs_resource is None:
+            return
+
+    for stage, func in stages:
+        if on_stage is not None:
+            on_stage(stage)
+        func(instance, gs_resource, catalog)
+
+
+def _sync_keywords(instance, gs_resource, catalog):
     if any(instance.keyword_list()):
         gs_resource.keywords = instance.keyword_list()
 
         # gs_resource should only be called if
         # ogc_server_settings.BACKEND_WRITE_ENABLED == True
         if getattr(ogc_server_settings, "BACKEND_WRITE_ENABLED", True):
-            gs_catalog.save(gs_resource)
+            catalog.save(gs_resource)
 
-    bbox = gs_resource.latlon_bbox
-    dx = float(bbox[1]) - float(bbox[0])
-    dy = float(bbox[3]) - float(bbox[2])
-
-    dataAspect = 1 if dy == 0 else dx / dy
-
-    height = 550
-    width = int(height * dataAspect)
-
-    # Set download links for WMS, WCS or WFS and KML
-
-    links = wms_links(ogc_server_settings.public_url + 'wms?',
-                      instance.typename.encode('utf-8'), instance.bbox_string,
-                      instance.srid, height, width)
-
-    for ext, name, mime, wms_url in links:
-        Link.objects.get_or_create(resource=instance.resourcebase_ptr,
-                                   name=ugettext(name),
-                                   defaults=dict(
-                                       extension=ext,
-                                       url=wms_url,
-                                       mime=mime,
-                                       link_type='image',
-                                   )
-                                   )
-
-    if instance.storeType == "dataStore":
-        links = wfs_links(
-            ogc_server_settings.public_url +
-            'wfs?',
-            instance.typename.encode('utf-8'))
-        for ext, name, mime, wfs_url in links:
-            if mime == 'SHAPE-ZIP':
-                name = 'Zipped Shapefile'
-            Link.objects.get_or_create(resource=instance.resourcebase_ptr,
-                                       url=wfs_url,
-                                       defaults=dict(
-                                           extension=ext,
-                                           name=name,
-                                           mime=mime,
-                                           url=wfs_url,
-                                           link_type='data',
-                                       )
-                                       )
-
-        if gs_resource.store.type.lower() == 'geogit':
-            repo_url = '{url}geogit/{workspace}:{store}'.format(
-                url=ogc_server_settings.public_url,
-                workspace=instance.workspace,
-                store=instance.store)
-
-            path = gs_resource.dom.findall('nativeName')
-
-            if path:
-                path = 'path={path}'.format(path=path[0].text)
-
-            Link.objects.get_or_create(resource=instance.resourcebase_ptr,
-                                       url=repo_url,
-                                       defaults=dict(extension='html',
-                                                     name='Clone in GeoGit',
-                                                     mime='text/xml',
-                                                     link_type='html'
-                                                     )
-                                       )
-
-            command_url = lambda command: "{repo_url}/{command}.json?{path}".format(
-                repo_url=repo_url,
-                path=path,
-                command=command)
-
-            Link.objects.get_or_create(resource=instance.resourcebase_ptr,
-                                       url=command_url('log'),
-                                       defaults=dict(extension='json',
-                                                     name='GeoGit log',
-                                                     mime='application/json',
-                                                     link_type='html'
-                                                     )
-                                       )
-
-            Link.objects.get_or_create(resource=instance.resourcebase_ptr,
-                                       url=command_url('statistics'),
-                                       defaults=dict(extension='json',
-                                                     name='GeoGit statistics',
-                                                     mime='application/json',
-                                                     link_type='html'
-                                                     )
-                                       )
-
-    elif instance.storeType == 'coverageStore':
-        # FIXME(Ariel): This works for public layers, does it work for restricted too?
-        # would those end up with no geotiff links, like, forever?
-        permissions = instance.get_all_level_info()
-
-        instance.set_permissions(
-            {'users': {'AnonymousUser': ['view_resourcebase']}})
 
-        try:
-            # Potentially 3 dimensions can be returned by the grid if there is a z
-            # axis.  Since we only want width/height, slice to the second
-            # dimension
-            covWidth, covHeight = get_coverage_grid_extent(instance)[:2]
-        except GeoNodeException as e:
-            msg = _('Could not create a download link for layer.')
-            logger.warn(msg, e)
-        else:
+def _sync_links(instance, gs_resource, catalog):
+    links = LinkSet(keep_hosts=link_hosts())
+    layer_links(links, instance, gs_resource)
+    links.apply()
+
+
+def _sync_thumbnail(instance, gs_resource, catalog):
+    # rendered off the request path, and only if its inputs changed
+    queue_thumbnail(instance)
+
 
-            links = wcs_links(ogc_server_settings.public_url + 'wcs?',
-                              instance.typename.encode('utf-8'),
-                              bbox=gs_resource.native_bbox[:-1],
-                              crs=gs_resource.native_bbox[-1],
-                              height=str(covHeight),
-                              width=str(covWidth))
-
-            for ext, name, mime, wcs_url in links:
-                Link.objects.get_or_create(resource=instance.resourcebase_ptr,
-                                           url=wcs_url,
-                                           defaults=dict(
-                                               extension=ext,
-                                               name=name,
-                                               mime=mime,
-                                               link_type='data',
-                                           )
-                                           )
-
-        instance.set_permissions(permissions)
-
-    kml_reflector_link_download = ogc_server_settings.public_url + "wms/kml?" + \
-        urllib.urlencode({'layers': instance.typename.encode('utf-8'), 'mode': "download"})
-
-    Link.objects.get_or_create(resource=instance.resourcebase_ptr,
-                               url=kml_reflector_link_download,
-                               defaults=dict(
-                                   extension='kml',
-                                   name=_("KML"),
-                                   mime='text/xml',
-                                   link_type='data',
-                               )
-                               )
-
-    kml_reflector_link_view = ogc_server_settings.public_url + "wms/kml?" + \
-        urllib.urlencode({'layers': instance.typename.encode('utf-8'), 'mode': "refresh"})
-
-    Link.objects.get_or_create(resource=instance.resourcebase_ptr,
-                               url=kml_reflector_link_view,
-                               defaults=dict(
-                                   extension='kml',
-                                   name="View in Google Earth",
-                                   mime='text/xml',
-                                   link_type='data',
-                               )
-                               )
-
-    tile_url = ('%sgwc/service/gmaps?' % ogc_server_settings.public_url +
-                'layers=%s' % instance.typename.encode('utf-8') +
-                '&zoom={z}&x={x}&y={y}' +
-                '&format=image/png8'
-                )
-
-    Link.objects.get_or_create(resource=instance.resourcebase_ptr,
-                               url=tile_url,
-                               defaults=dict(
-                                   extension='tiles',
-                                   name=_("Tiles"),
-                                   mime='image/png',
-                                   link_type='image',
-                               )
-                               )
-
-    html_link_url = '%s%s' % (
-        settings.SITEURL[:-1], instance.get_absolute_url())
-
-    Link.objects.get_or_create(resource=instance.resourcebase_ptr,
-                               url=html_link_url,
-                               defaults=dict(
-                                   extension='html',
-                                   name=instance.typename,
-                                   mime='text/html',
-                                   link_type='html',
-                               )
-                               )
-
-    params = {
-        'layers': instance.typename.encode('utf-8'),
-        'format': 'image/png8',
-        'width': 200,
-        'height': 150,
-    }
-
-    # Avoid using urllib.urlencode here because it breaks the url.
-    # commas and slashes in values get encoded and then cause trouble
-    # with the WMS parser.
-    p = "&".join("%s=%s" % item for item in params.items())
-
-    thumbnail_remote_url = ogc_server_settings.PUBLIC_LOCATION + \
-        "wms/reflect?" + p
-    thumbail_create_url = ogc_server_settings.LOCATION + \
-        "wms/reflect?" + p
-
-    # This is a workaround for development mode where cookies are not shared and the layer is not public so
-    # not visible through geoserver
-    if settings.DEBUG:
-        from geonode.security.views import _perms_info_json
-        current_perms = _perms_info_json(instance.get_self_resource())
-        instance.set_default_permissions()
-
-    create_thumbnail(instance, thumbnail_remote_url, thumbail_create_url)
-
-    if settings.DEBUG:
-        instance.set_permissions(json.loads(current_perms))
-
-    legend_url = ogc_server_settings.PUBLIC_LOCATION + 'wms?request=GetLegendGraphic&format=image/png&WIDTH=20&HEIGHT=20&LAYER=' + \
-        instance.typename + '&legend_options=fontAntiAliasing:true;fontSize:12;forceLabels:on'
-
-    Link.objects.get_or_create(resource=instance.resourcebase_ptr,
-                               url=legend_url,
-                               defaults=dict(
-                                   extension='png',
-                                   name=_('Legend'),
-                                   url=legend_url,
-                                   mime='image/png',
-                                   link_type='image',
-                               )
-                               )
-
-    ogc_wms_path = '%s/wms' % instance.workspace
-    ogc_wms_url = urljoin(ogc_server_settings.public_url, ogc_wms_path)
-    ogc_wms_name = 'OGC WMS: %s Service' % instance.workspace
-    Link.objects.get_or_create(resource=instance.resourcebase_ptr,
-                               url=ogc_wms_url,
-                               defaults=dict(
-                                   extension='html',
-                                   name=ogc_wms_name,
-                                   url=ogc_wms_url,
-                                   mime='text/html',
-                                   link_type='OGC:WMS',
-                               )
-                               )
-
-    if instance.storeType == "dataStore":
-        ogc_wfs_path = '%s/wfs' % instance.workspace
-        ogc_wfs_url = urljoin(ogc_server_settings.public_url, ogc_wfs_path)
-        ogc_wfs_name = 'OGC WFS: %s Service' % instance.workspace
-        Link.objects.get_or_create(resource=instance.resourcebase_ptr,
-                                   url=ogc_wfs_url,
-                                   defaults=dict(
-                                       extension='html',
-                                       name=ogc_wfs_name,
-                                       url=ogc_wfs_url,
-                                       mime='text/html',
-                                       link_type='OGC:WFS',
-                                   )
-                                   )
-
-    if instance.storeType == "coverageStore":
-        ogc_wcs_path = '%s/wcs' % instance.workspace
-        ogc_wcs_url = urljoin(ogc_server_settings.public_url, ogc_wcs_path)
-        ogc_wcs_name = 'OGC WCS: %s Service' % instance.workspace
-        Link.objects.get_or_create(resource=instance.resourcebase_ptr,
-                                   url=ogc_wcs_url,
-                                   defaults=dict(
-                                       extension='html',
-                                       name=ogc_wcs_name,
-                                       url=ogc_wcs_url,
-                                       mime='text/html',
-                                       link_type='OGC:WCS',
-                                   )
-                                   )
-
-    # remove links that belong to and old address
-
-    for link in instance.link_set.all():
-        if not urlparse(
-            settings.SITEURL).hostname == urlparse(
-            link.url).hostname and not urlparse(
-            ogc_server_settings.public_url).hostname == urlparse(
-                link.url).hostname:
-            link.delete()
-
-    # Save layer attributes
+def _sync_attributes(instance, gs_resource, catalog):
     set_attributes(instance)
 
-    # Save layer styles
-    set_styles(instance, gs_catalog)
+
+def _sync_styles(instance, gs_resource, catalog):
+    set_styles(instance, catalog)
+    # set_styles does not save the default style of the layer, update it
+    # without sending the save signals again.
+    Layer.objects.filter(id=instance.id).update(default_style=instance.default_style)
+
+
+# stages run by sync_layer, in order
+POST_SAVE_STAGES = (
+    ('keywords', _sync_keywords),
+    ('links', _sync_links),
+    ('attributes', _sync_attributes),
+    ('styles', _sync_styles),
+    # the thumbnail depends on the default style
+    ('thumbnail', _sync_thumbnail),
+)
+
+sync_workers = WorkerPool('layer_sync')
 
 
 def geoserver_pre_save_maplayer(instance, sender, **kwargs):
@@ -472,77 +308,5 @@ def geoserver_pre_save_maplayer(instance, sender, **kwargs):
 
 def geoserver_post_save_map(instance, sender, **kwargs):
     instance.set_missing_info()
-    local_layers = []
-    for layer in instance.layers:
-        if layer.local:
-            local_layers.append(layer.name)
-
-    image = None
-
-    # If the map does not have any local layers, do not create the thumbnail.
-    if len(local_layers) > 0:
-        params = {
-            'layers': ",".join(local_layers).encode('utf-8'),
-            'format': 'image/png8',
-            'width': 200,
-            'height': 150,
-        }
-
-        # Add the bbox param only if the bbox is different to [None, None,
-        # None, None]
-        if None not in instance.bbox:
-            params['bbox'] = instance.bbox_string
-
-        # Avoid using urllib.urlencode here because it breaks the url.
-        # commas and slashes in values get encoded and then cause trouble
-        # with the WMS parser.
-        p = "&".join("%s=%s" % item for item in params.items())
-
-        thumbnail_remote_url = ogc_server_settings.LOCATION + \
-            "wms/reflect?" + p
-
-        Link.objects.get_or_create(resource=instance.resourcebase_ptr,
-                                   url=thumbnail_remote_url,
-                                   defaults=dict(
-                                       extension='png',
-                                       name=_("Remote Thumbnail"),
-                                       mime='image/png',
-                                       link_type='image',
-                                   )
-                                   )
-
-        # Download thumbnail and save it locally.
-        resp, image = http_client.request(thumbnail_remote_url)
-
-        if 'ServiceException' in image or resp.status < 200 or resp.status > 299:
-            msg = 'Unable to obtain thumbnail: %s' % image
-            logger.debug(msg)
-            # Replace error message with None.
-            image = None
-
-    if image is not None:
-        if instance.has_thumbnail():
-            instance.thumbnail_set.get().thumb_file.delete()
-        else:
-            instance.thumbnail_set.add(Thumbnail())
-
-        instance.thumbnail_set.get().thumb_file.save(
-            'map-%s-thumb.png' %
-            instance.id,
-            ContentFile(image))
-        instance.thumbnail_set.get().thumb_spec = thumbnail_remote_url
-        instance.thumbnail_set.get().save()
-
-        thumbnail_url = urljoin(
-            settings.SITEURL,
-            instance.thumbnail_set.get().thumb_file.url)
-
-        Link.objects.get_or_create(resource=instance.resourcebase_ptr,
-                                   url=thumbnail_url,
-                                   defaults=dict(
-                                       name=_('Thumbnail'),
-                                       extension='png',
-                                       mime='image/png',
-                                       link_type='image',
-                                   )
-                                   )
+    # the thumbnail is composed from the layers of the map off the request path
+    queue_map_thumbnail(instance)
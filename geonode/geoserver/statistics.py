@@ -0,0 +1,245 @@
+#########################################################################
+#
+# Copyright (C) 2012 OpenPlans
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+"""Local engine computing the statistics of layer attributes.
+
+The features are streamed, either from the GeoNode datastore or from a
+WFS GetFeature request, and all the fields of a layer are aggregated in a
+single pass with NumPy. Memory use is bounded: the median is computed on
+a uniform sample of the values and the unique values are only kept while
+there are fewer than ``MAX_UNIQUE_VALUES`` of them.
+"""
+
+import csv
+import urllib
+
+import numpy as np
+
+from django.db import connections, transaction
+
+from geonode import GeoNodeException
+from geonode.geoserver.helpers import ogc_server_settings, http_client
+
+# number of features read at once from the data source
+CHUNK_SIZE = 10000
+# size of the sample the median is computed on
+SAMPLE_SIZE = 100000
+# fields with more distinct values than this do not report them
+MAX_UNIQUE_VALUES = 10000
+
+
+class FieldStatistics(object):
+
+    """
+    Streaming statistics of a numeric field.
+
+    The count, sum, minimum, maximum, mean and standard deviation are exact
+    (the partial results of every chunk are merged with Chan's parallel
+    algorithm), the median is exact up to ``sample_size`` values and
+    estimated on a reservoir sample beyond that.
+    """
+
+    def __init__(self, sample_size=SAMPLE_SIZE, max_unique=MAX_UNIQUE_VALUES):
+        self.count = 0
+        self.sum = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.sample = np.empty(sample_size)
+        self.sampled = 0
+        self.max_unique = max_unique
+        self.unique = set()
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        n = len(values)
+        if n == 0:
+            return
+
+        chunk_mean = values.mean()
+        chunk_m2 = ((values - chunk_mean) ** 2).sum()
+        total = self.count + n
+        delta = chunk_mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += chunk_m2 + delta ** 2 * self.count * n / total
+        self.sum += values.sum()
+        self.min = values.min() if self.min is None else min(self.min, values.min())
+        self.max = values.max() if self.max is None else max(self.max, values.max())
+
+        self._sample(values)
+        self.count = total
+
+        if self.unique is not None:
+            self.unique.update(np.unique(values).tolist())
+            if len(self.unique) > self.max_unique:
+                self.unique = None
+
+    def _sample(self, values):
+        # Vitter's algorithm R, vectorised: the value at position i of the
+        # stream replaces a random slot of the reservoir with probability
+        # size / (i + 1).
+        size = len(self.sample)
+        free = min(size - self.sampled, len(values))
+        if free > 0:
+            self.sample[self.sampled:self.sampled + free] = values[:free]
+            self.sampled += free
+        rest = values[free:]
+        if len(rest):
+            positions = np.arange(self.count + free, self.count + free + len(rest))
+            slots = (np.random.random(len(rest)) * (positions + 1)).astype(np.int64)
+            kept = slots < size
+            self.sample[slots[kept]] = rest[kept]
+
+    def result(self):
+        """Return the statistics with the keys used by the WPS engine.
+        """
+        if self.count == 0:
+            return None
+        return {
+            'Count': self.count,
+            'Min': _format_number(self.min),
+            'Max': _format_number(self.max),
+            'Average': _format_number(self.mean),
+            'Median': _format_number(np.median(self.sample[:self.sampled])),
+            'StandardDeviation': _format_number((self.m2 / self.count) ** 0.5),
+            'Sum': _format_number(self.sum),
+            'unique_values': 'NA' if self.unique is None else
+            ','.join(_format_number(v) for v in sorted(self.unique)),
+        }
+
+
+def _format_number(value):
+    value = float(value)
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def _as_array(column):
+    try:
+        return np.array([v if v != '' else np.nan for v in column], dtype=float)
+    except (TypeError, ValueError):
+        values = []
+        for v in column:
+            try:
+                values.append(float(v))
+            except (TypeError, ValueError):
+                values.append(np.nan)
+        return np.array(values, dtype=float)
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def datastore_rows(layer, fields, chunk_size=CHUNK_SIZE):
+    """Stream the values of ``fields`` from the table of a layer stored in
+       the GeoNode datastore, using a server side cursor.
+    """
+    alias = ogc_server_settings.DATASTORE
+    connection = connections[alias]
+    quote = connection.ops.quote_name
+    sql = 'SELECT %s FROM %s' % (', '.join(quote(f) for f in fields), quote(layer.name))
+    with transaction.atomic(using=alias):
+        connection.ensure_connection()
+        cursor = connection.connection.cursor(name='geonode_statistics')
+        cursor.itersize = chunk_size
+        try:
+            cursor.execute(sql)
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+
+
+def wfs_rows(layer, fields):
+    """Stream the values of ``fields`` from a WFS GetFeature request
+       in CSV format.
+    """
+    url = ogc_server_settings.LOCATION + 'wfs?' + urllib.urlencode({
+        'service': 'WFS',
+        'version': '1.0.0',
+        'request': 'GetFeature',
+        'typename': layer.typename.encode('utf-8'),
+        'propertyName': ','.join(f.encode('utf-8') for f in fields),
+        'outputFormat': 'csv',
+    })
+    response, body = http_client.stream(url)
+    try:
+        if response.status != 200:
+            raise GeoNodeException('GeoServer returned %s for the features of %s' % (
+                response.status, layer.typename.encode('utf-8')))
+        reader = csv.reader(_lines(body))
+        header = reader.next()
+        indexes = [header.index(f.encode('utf-8')) for f in fields]
+        for row in reader:
+            yield [row[i] for i in indexes]
+    finally:
+        body.close()
+
+
+def _lines(chunks):
+    """Split the chunks of a streamed body in lines, keeping their ends
+       as ``csv.reader`` expects.
+    """
+    pending = ''
+    for chunk in chunks:
+        pending += chunk
+        start = 0
+        end = pending.find('\n')
+        while end >= 0:
+            yield pending[start:end + 1]
+            start = end + 1
+            end = pending.find('\n', start)
+        pending = pending[start:]
+    if pending:
+        yield pending
+
+
+def layer_rows(layer, fields):
+    datastore = ogc_server_settings.DATASTORE
+    if datastore and layer.store == datastore and \
+            'postgis' in ogc_server_settings.datastore_db.get('ENGINE', ''):
+        return datastore_rows(layer, fields)
+    return wfs_rows(layer, fields)
+
+
+def compute_layer_statistics(layer, fields, rows=None, chunk_size=CHUNK_SIZE):
+    """Compute the statistics of all ``fields`` of a layer in one pass
+       over its features.
+
+       Returns a dictionary with the statistics of every field, or None for
+       the fields without values.
+    """
+    if rows is None:
+        rows = layer_rows(layer, fields)
+    stats = [FieldStatistics() for f in fields]
+    for chunk in _chunks(rows, chunk_size):
+        for field_stats, column in zip(stats, zip(*chunk)):
+            field_stats.update(_as_array(column))
+    return dict((f, s.result()) for f, s in zip(fields, stats))
@@ -1,7 +1,9 @@
 import base64
 import json
+import unittest
 
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
 from django.http import HttpRequest
 from django.core.exceptions import ImproperlyConfigured
 from django.conf import settings
@@ -13,10 +15,24 @@ from django.test.utils import override_settings
 from guardian.shortcuts import assign_perm, get_anonymous_user
 
 from geonode.geoserver.helpers import OGC_Servers_Handler
+from geonode.geoserver.helpers import _parallel_map, resource_fingerprint, set_attributes
+from geonode.geoserver.helpers import delete_compare_index
+from geonode.geoserver.helpers import CachingCatalog, InvalidatingCatalog
 from geonode.base.populate_test_data import create_models
 from geonode.layers.populate_layers_data import create_layer_data
 from geonode.layers.models import Layer
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class FakeObject(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
 
 class LayerTests(TestCase):
 
@@ -177,6 +193,168 @@ class LayerTests(TestCase):
         # TODO Lots more to do here once jj0hns0n understands the ACL system
         # better
 
+    def test_layer_acls_cache(self):
+        """Verify that the layer ACLs are cached until the permissions change
+        and that the layer_acls view can be revalidated with its ETag
+        """
+        auth_headers = {
+            'HTTP_AUTHORIZATION': 'basic ' + base64.b64encode('bobby:bob'),
+        }
+        bob = get_user_model().objects.get(username='bobby')
+        layer = Layer.objects.get(typename='geonode:CA')
+
+        c = Client()
+        response = c.get(reverse('layer_acls'), **auth_headers)
+        self.assertNotIn(u'geonode:CA', json.loads(response.content)['rw'])
+        etag = response['ETag']
+
+        response = c.get(reverse('layer_acls'), HTTP_IF_NONE_MATCH=etag, **auth_headers)
+        self.assertEquals(response.status_code, 304)
+
+        layer.set_permissions({'users': {'bobby': ['view_resourcebase', 'change_resourcebase']}})
+        response = c.get(reverse('layer_acls'), HTTP_IF_NONE_MATCH=etag, **auth_headers)
+        self.assertEquals(response.status_code, 200)
+        self.assertIn(u'geonode:CA', json.loads(response.content)['rw'])
+
+        # the sets of a user include the ones of its groups
+        group = Group.objects.create(name='editors')
+        layer.set_permissions({'groups': {'editors': ['view_resourcebase', 'change_resourcebase']}})
+        response = c.get(reverse('layer_acls'), **auth_headers)
+        self.assertNotIn(u'geonode:CA', json.loads(response.content)['rw'])
+        bob.groups.add(group)
+        response = c.get(reverse('layer_acls'), **auth_headers)
+        self.assertIn(u'geonode:CA', json.loads(response.content)['rw'])
+
+        # a superuser can write every layer, until it is demoted
+        other = Layer.objects.exclude(typename__in=json.loads(response.content)['rw'])[0]
+        bob.is_superuser = True
+        bob.save()
+        response = c.get(reverse('layer_acls'), **auth_headers)
+        self.assertIn(other.typename, json.loads(response.content)['rw'])
+        bob.is_superuser = False
+        bob.save()
+        response = c.get(reverse('layer_acls'), **auth_headers)
+        self.assertNotIn(other.typename, json.loads(response.content)['rw'])
+
+    def test_batch_download(self):
+        """Verify that the archives of the batch downloads are served to the
+        users allowed to view all their layers
+        """
+        from geonode.geoserver.models import BatchDownload
+        from geonode.geoserver.download import archive_key, archive_path
+
+        layer = Layer.objects.get(typename='geonode:CA')
+        key = archive_key([layer])
+        self.assertEquals(key, archive_key(Layer.objects.filter(typename='geonode:CA')))
+        job = BatchDownload.objects.create(key=key, layers=json.dumps([layer.typename]),
+                                           status='finished', progress=100)
+        with open(archive_path(job), 'wb') as f:
+            f.write('archive')
+
+        c = Client()
+        response = c.get(reverse('layer_batch_download'), {'id': job.pk})
+        self.assertEquals(json.loads(response.content)['process']['status'], 'FINISHED')
+
+        c.login(username='admin', password='admin')
+        response = c.get(reverse('batch_download', args=(job.pk,)))
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(''.join(response.streaming_content), 'archive')
+
+        layer.set_permissions({'users': {}})
+        c.login(username='bobby', password='bob')
+        response = c.get(reverse('batch_download', args=(job.pk,)))
+        self.assertEquals(response.status_code, 403)
+        response = c.get(reverse('layer_batch_download'), {'id': job.pk})
+        self.assertEquals(response.status_code, 403)
+        response = c.post(reverse('batch_download_cancel', args=(job.pk,)))
+        self.assertEquals(response.status_code, 403)
+
+    def test_set_attributes(self):
+        """Verify that set_attributes only applies the differences with the
+        attributes in GeoServer and keeps the customisations of the others
+        """
+        layer = Layer.objects.all()[0]
+        layer.attribute_set.all().delete()
+
+        set_attributes(layer, attribute_map=[['name', 'xsd:string'],
+                                             ['code', 'xsd:string'],
+                                             ['the_geom', 'gml:MultiPolygonPropertyType']])
+        self.assertEquals(layer.attribute_set.count(), 3)
+        self.assertFalse(layer.attribute_set.get(attribute='the_geom').visible)
+
+        name = layer.attribute_set.get(attribute='name')
+        name.attribute_label = 'Custom label'
+        name.display_order = 10
+        name.visible = False
+        name.save()
+
+        set_attributes(layer, attribute_map=[['name', 'xsd:string'],
+                                             ['code', 'xsd:int'],
+                                             ['population', 'xsd:string'],
+                                             ['population', 'xsd:string']])
+        self.assertEquals(
+            sorted(layer.attribute_set.values_list('attribute', flat=True)),
+            ['code', 'name', 'population'])
+        name = layer.attribute_set.get(attribute='name')
+        self.assertEquals(name.attribute_label, 'Custom label')
+        self.assertEquals(name.display_order, 10)
+        self.assertFalse(name.visible)
+        self.assertEquals(layer.attribute_set.get(attribute='code').attribute_type, 'xsd:int')
+        self.assertEquals(layer.attribute_set.get(attribute='population').display_order, 11)
+
+    def test_layer_sync_status(self):
+        """Verify that the layer_sync_status view reports the status of the
+        deferred synchronisation of a layer
+        """
+        import datetime
+        from geonode.geoserver.models import LayerSync
+
+        layer = Layer.objects.all()[0]
+        url = reverse('layer_sync_status', args=(layer.typename,))
+
+        c = Client()
+        c.login(username='bobby', password='bob')
+        response = c.get(url)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(json.loads(response.content)['status'], None)
+
+        LayerSync.objects.create(layer=layer, status='failed', stage='styles', attempts=3,
+                                 requested=datetime.datetime.now())
+        response = c.get(url)
+        status = json.loads(response.content)
+        self.assertEquals(status['status'], 'failed')
+        self.assertEquals(status['stage'], 'styles')
+        self.assertEquals(status['attempts'], 3)
+
+    def test_tile_jobs(self):
+        """Verify that the GeoWebCache jobs of a layer are queued and reported
+        by the layer_tiles_status view
+        """
+        from geonode.geoserver import gwc
+
+        layer = Layer.objects.all()[0]
+        layer.bbox_x0, layer.bbox_y0, layer.bbox_x1, layer.bbox_y1 = -10, -20, 10, 20
+        bbox = gwc.gridset_bbox(gwc.layer_bbox(layer), 'EPSG:900913')
+        self.assertAlmostEqual(bbox[0], -1113194.9, 1)
+        self.assertEquals(gwc.gridset_bbox([-180, -90, 180, 90], 'EPSG:4326'), [-180, -90, 180, 90])
+        self.assertIsNone(gwc.gridset_bbox([0, 0, 1, 1], 'EPSG:27700'))
+
+        # the jobs waiting are coalesced
+        gwc.truncate_layer(layer)
+        gwc.truncate_layer(layer)
+        gwc.seed_layer(layer, zoom_stop=5)
+        gwc.seed_layer(layer, zoom_stop=8, priority=10)
+        self.assertEquals(layer.tile_jobs.filter(type='truncate').count(), 1)
+        seed = layer.tile_jobs.get(type='seed')
+        self.assertEquals((seed.gridset, seed.zoom_stop, seed.priority), ('EPSG:900913', 8, 10))
+
+        c = Client()
+        c.login(username='bobby', password='bob')
+        response = c.get(reverse('layer_tiles_status', args=(layer.typename,)))
+        self.assertEquals(response.status_code, 200)
+        jobs = json.loads(response.content)['jobs']
+        self.assertEquals([job['type'] for job in jobs], ['seed', 'truncate'])
+
     def test_resolve_user(self):
         """Verify that the resolve_user view is behaving as expected
         """
@@ -238,6 +416,21 @@ class UtilsTests(TestCase):
                 'WPS_ENABLED': False,
                 'DATASTORE': str(),
                 'GEOGIT_DATASTORE_DIR': str(),
+                'TIMEOUT': 10,
+                'MAX_RETRIES': 2,
+                'POOL_MAXSIZE': 10,
+                'CATALOG_CACHE_TTL': 10,
+                'CAPABILITIES_CACHE_TTL': 300,
+                'ACL_CACHE_TTL': 300,
+                'GWC_TRUNCATE_ENABLED': True,
+                'GWC_SEED_ENABLED': False,
+                'GWC_SEED_GRIDSETS': ('EPSG:900913',),
+                'GWC_SEED_FORMAT': 'image/png',
+                'GWC_SEED_ZOOM_START': 0,
+                'GWC_SEED_ZOOM_STOP': 10,
+                'GWC_SEED_THREADS': 1,
+                'GWC_SEED_PRIORITY': 0,
+                'GWC_SEED_MAX_TASKS': 2,
             }
         }
 
@@ -335,6 +528,189 @@ class UtilsTests(TestCase):
         with self.settings(UPLOADER=uploader_settings, OGC_SERVER=ogc_server_settings, DATABASES=database_settings):
             OGC_Servers_Handler(ogc_server_settings)['default']
 
+    def test_parallel_map(self):
+        """
+        Tests that the results of _parallel_map keep the order of the input
+        with and without worker threads.
+        """
+        items = range(50)
+        expected = [x * 2 for x in items]
+        self.assertEqual(_parallel_map(lambda x: x * 2, items), expected)
+        self.assertEqual(_parallel_map(lambda x: x * 2, items, workers=4), expected)
+        self.assertEqual(_parallel_map(lambda x: x * 2, [], workers=4), [])
+
+    def test_resource_fingerprint(self):
+        """
+        Tests that the resource fingerprint changes with the resource
+        description and the store but not between identical resources.
+        """
+        import xml.etree.ElementTree as ET
+
+        def fake_resource(xml, store='store'):
+            workspace = FakeObject(name='geonode')
+            return FakeObject(dom=ET.fromstring(xml),
+                              store=FakeObject(name=store, workspace=workspace))
+
+        xml = '<featureType><name>roads</name><title>Roads</title></featureType>'
+        changed = '<featureType><name>roads</name><title>Main roads</title></featureType>'
+        fingerprint = resource_fingerprint(fake_resource(xml))
+        self.assertEqual(fingerprint, resource_fingerprint(fake_resource(xml)))
+        self.assertNotEqual(fingerprint, resource_fingerprint(fake_resource(changed)))
+        self.assertNotEqual(fingerprint, resource_fingerprint(fake_resource(xml, store='other')))
+
+    def test_delete_compare_index(self):
+        """
+        Tests that the resources whose description could not be fetched are
+        kept in the index the deleted layers are found with.
+        """
+        workspace = FakeObject(name='geonode')
+        store = FakeObject(name='store', workspace=workspace)
+        enabled = FakeObject(name='roads', workspace=workspace, store=store, enabled='true', advertised='true')
+        disabled = FakeObject(name='rivers', workspace=workspace, store=store, enabled='false', advertised='true')
+        failed = FakeObject(name='lakes', workspace=workspace, store=store, enabled=None, advertised=None)
+        fetch_errors = {id(failed): (Exception, Exception('timeout'), None)}
+
+        index = delete_compare_index([enabled, disabled, failed], fetch_errors)
+        self.assertEqual(index, set([('geonode', 'store', 'roads'), ('geonode', 'store', 'lakes')]))
+
+    def test_sync_layer_stages(self):
+        """
+        Tests that sync_layer runs the given stages with the given resource
+        instead of fetching it from the catalog.
+        """
+        from geonode.geoserver.signals import sync_layer
+
+        calls = []
+        layer = FakeObject(name='roads', storeType='dataStore')
+        resource = FakeObject(name='roads')
+        catalog = object()
+        sync_layer(layer, catalog=catalog, gs_resource=resource,
+                   stages=[('links', lambda *args: calls.append(args))])
+        self.assertEqual(calls, [(layer, resource, catalog)])
+
+    def test_caching_catalog(self):
+        """
+        Tests that the catalog lookups are cached by name until the catalog
+        is written to or the entries expire.
+        """
+        class FakeCatalog(object):
+
+            def __init__(self):
+                self.calls = 0
+                self._cache = {}
+
+            def get_resource(self, name, store=None, workspace=None):
+                self.calls += 1
+                return FakeObject(name=name, dirty=dict())
+
+            def save(self, obj):
+                pass
+
+        catalog = FakeCatalog()
+        cached = CachingCatalog(catalog, ttl=60)
+
+        resource = cached.get_resource('roads', workspace='geonode')
+        resource.dirty['title'] = 'Roads'
+        same = cached.get_resource('roads', workspace='geonode')
+        self.assertEqual(same.name, 'roads')
+        self.assertEqual(same.dirty, {})
+        self.assertEqual(catalog.calls, 1)
+
+        cached.get_resource('roads', workspace='other')
+        self.assertEqual(catalog.calls, 2)
+
+        cached.save(resource)
+        cached.get_resource('roads', workspace='geonode')
+        self.assertEqual(catalog.calls, 3)
+        self.assertEqual(cached.stats()['hits'], 1)
+        self.assertEqual(cached.stats()['misses'], 3)
+
+        cached.ttl = 0
+        cached.get_resource('roads', workspace='geonode')
+        self.assertEqual(catalog.calls, 4)
+
+        # the writes of another catalog empty the cache as well
+        cached.ttl = 60
+        cached.get_resource('roads', workspace='geonode')
+        self.assertEqual(catalog.calls, 4)
+        InvalidatingCatalog(FakeCatalog(), cached).save(resource)
+        cached.get_resource('roads', workspace='geonode')
+        self.assertEqual(catalog.calls, 5)
+
+    def test_coverage_description(self):
+        """
+        Tests that the grid extent and the download links of a coverage are
+        derived from its DescribeCoverage document.
+        """
+        from lxml import etree
+        from geonode.geoserver.helpers import _coverage_grid_extent, WCS_NAMESPACE
+        from geonode.geoserver.ows import wcs_links
+
+        description = """<CoverageDescription xmlns="http://www.opengis.net/wcs"
+            xmlns:gml="http://www.opengis.net/gml" version="1.0.0">
+          <CoverageOffering>
+            <name>geonode:dem</name>
+            <domainSet><spatialDomain><gml:RectifiedGrid dimension="2">
+              <gml:limits><gml:GridEnvelope>
+                <gml:low>0 0</gml:low><gml:high>599 399</gml:high>
+              </gml:GridEnvelope></gml:limits>
+            </gml:RectifiedGrid></spatialDomain></domainSet>
+            <supportedFormats><formats>GeoTIFF</formats><formats>PNG</formats></supportedFormats>
+          </CoverageOffering>
+        </CoverageDescription>"""
+        offering = etree.fromstring(description).find('{%s}CoverageOffering' % WCS_NAMESPACE)
+        self.assertEqual(_coverage_grid_extent(offering), [600, 400])
+
+        links = wcs_links('http://localhost:8080/geoserver/wcs?', 'geonode:dem',
+                          bbox=['0', '0', '10', '10'], crs='EPSG:4326', height='400', width='600',
+                          formats=['GeoTIFF', 'PNG'])
+        self.assertEqual(len(links), 1)
+        self.assertEqual(links[0][:3], ('GeoTIFF', 'GeoTIFF', 'GeoTIFF'))
+        self.assertTrue('request=GetCoverage' in links[0][3])
+        self.assertTrue('width=600' in links[0][3])
+
+    @unittest.skipIf(numpy is None, 'The local statistics engine requires NumPy')
+    def test_field_statistics(self):
+        """
+        Tests that the statistics computed chunk by chunk by the local
+        engine match the ones of the whole set of values.
+        """
+        from geonode.geoserver.statistics import compute_layer_statistics
+
+        rows = [(str(i), '' if i % 2 else str(i % 3)) for i in range(1, 11)]
+        stats = compute_layer_statistics(None, ['value', 'code'], rows=rows, chunk_size=3)
+
+        value = stats['value']
+        self.assertEqual(value['Count'], 10)
+        self.assertEqual(value['Min'], '1')
+        self.assertEqual(value['Max'], '10')
+        self.assertEqual(value['Sum'], '55')
+        self.assertEqual(value['Average'], '5.5')
+        self.assertEqual(value['Median'], '5.5')
+        self.assertAlmostEqual(float(value['StandardDeviation']), 8.25 ** 0.5)
+        self.assertEqual(value['unique_values'], '1,2,3,4,5,6,7,8,9,10')
+
+        code = stats['code']
+        self.assertEqual(code['Count'], 5)
+        self.assertEqual(code['unique_values'], '0,1,2')
+
+        self.assertEqual(compute_layer_statistics(None, ['value'], rows=[('',)])['value'], None)
+
+    @unittest.skipIf(numpy is None, 'The local statistics engine requires NumPy')
+    def test_streamed_csv_lines(self):
+        """
+        Tests that the chunks of a streamed CSV body are split in the lines
+        csv.reader expects, whatever their boundaries.
+        """
+        import csv
+        from geonode.geoserver.statistics import _lines
+
+        body = 'FID,value\r\nroads.1,"a\nb"\r\nroads.2,3\r\n'
+        for size in (1, 2, 5, len(body)):
+            chunks = [body[i:i + size] for i in range(0, len(body), size)]
+            self.assertEqual(list(csv.reader(_lines(chunks))),
+                             [['FID', 'value'], ['roads.1', 'a\nb'], ['roads.2', '3']])
+
 
 class SecurityTest(TestCase):
 
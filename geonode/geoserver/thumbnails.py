@@ -0,0 +1,372 @@
+#########################################################################
+#
+# Copyright (C) 2012 OpenPlans
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+"""Thumbnails of the layers published in GeoServer and of the maps.
+
+The thumbnails are rendered by the WMS reflector in background jobs, with
+the GeoServer credentials so the permissions of the layer do not matter.
+The digest of the rendering inputs (the request, the bounding box, the
+default style and the version of the layer data) is kept with the
+thumbnail, whose image is not requested again while it does not change.
+
+The thumbnails of the maps are composed from their layer stack: the layers
+are rendered by concurrent GetMap requests, a single one for consecutive
+opaque local layers, and blended with their opacity.
+"""
+
+import os
+import json
+import urllib
+import logging
+from cStringIO import StringIO
+
+from PIL import Image
+
+from django.core.files.storage import default_storage
+from django.db import connection
+
+from geonode import GeoNodeException
+from geonode.base.models import Thumbnail
+from geonode.geoserver.helpers import ogc_server_settings, http_client, _parallel_map
+from geonode.geoserver.models import LayerFingerprint
+from geonode.layers.models import Layer
+from geonode.layers.utils import create_thumbnail, thumbnail_spec
+from geonode.maps.models import Map
+from geonode.workers import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = (200, 150)
+# width in pixels of the viewer a map without bounding box is shown in
+VIEWER_WIDTH = 800
+
+
+def layer_thumbnail_urls(instance):
+    """Return the public url of the thumbnail of a layer and the one it is
+       rendered from.
+    """
+    params = {
+        'layers': instance.typename.encode('utf-8'),
+        'format': 'image/png8',
+        'width': 200,
+        'height': 150,
+    }
+
+    # Avoid using urllib.urlencode here because it breaks the url.
+    # commas and slashes in values get encoded and then cause trouble
+    # with the WMS parser.
+    p = "&".join("%s=%s" % item for item in params.items())
+
+    return (ogc_server_settings.PUBLIC_LOCATION + "wms/reflect?" + p,
+            ogc_server_settings.LOCATION + "wms/reflect?" + p)
+
+
+def layer_thumbnail_spec(instance, url):
+    """Return the digest of the inputs the thumbnail of a layer is
+       rendered from.
+
+       The version of the data is given by the upload session of the layer,
+       replaced on every upload, and by the fingerprint of its GeoServer
+       resource.
+    """
+    style = instance.default_style
+    fingerprint = LayerFingerprint.objects.filter(layer=instance).values_list(
+        'fingerprint', flat=True)
+    return thumbnail_spec(
+        url,
+        instance.bbox_x0, instance.bbox_x1, instance.bbox_y0, instance.bbox_y1, instance.srid,
+        style.name if style else '',
+        (style.sld_body or '') if style else '',
+        instance.upload_session_id,
+        fingerprint[0] if fingerprint else '')
+
+
+def render_layer_thumbnail(instance, force=False, expected=None):
+    """Render the thumbnail of a layer unless its inputs did not change.
+       Returns True if a new image was stored.
+
+       With ``expected``, the digest of the inputs seen by the transaction
+       that queued the job, an exception is raised while the inputs differ.
+    """
+    remote_url, create_url = layer_thumbnail_urls(instance)
+    spec = layer_thumbnail_spec(instance, remote_url)
+    if expected is not None and spec != expected:
+        raise GeoNodeException('The changes of layer %s are not committed yet' % instance.pk)
+    return create_thumbnail(instance, remote_url, create_url, spec=spec,
+                            http=http_client, force=force)
+
+
+def regenerate_thumbnail(layer_id, force=False, expected=None):
+    # a layer saved within a transaction may not be visible yet, the
+    # DoesNotExist error makes the pool retry the job.
+    instance = Layer.objects.get(pk=layer_id)
+    render_layer_thumbnail(instance, force=force, expected=expected)
+
+
+def queue_thumbnail(instance, force=False):
+    """Regenerate the thumbnail of a layer in a background job, the
+       requests made while one is waiting are coalesced.
+
+       Within a transaction the job may run before the changes are
+       committed, it is retried until it renders the inputs seen here.
+    """
+    expected = None
+    if connection.in_atomic_block:
+        layer = Layer.objects.get(pk=instance.pk)
+        expected = layer_thumbnail_spec(layer, layer_thumbnail_urls(layer)[0])
+    thumbnail_workers.submit(instance.pk, regenerate_thumbnail, instance.pk, force=force,
+                             expected=expected)
+
+
+def regenerate_thumbnails(layers=None, workers=1, batch_size=100, force=False,
+                          state_file=None, console=None):
+    """
+    Regenerate the thumbnails of ``layers``, rendered by ``workers``
+    threads. The layers whose rendering inputs did not change are skipped
+    unless ``force`` is set.
+
+    The layers are processed by batches in the order of their ids. When
+    ``state_file`` is given the id of the last layer processed is written
+    to it after every batch and the layers up to that id are skipped by the
+    next run, the file is removed once all the layers are done.
+    """
+    if layers is None:
+        layers = Layer.objects.exclude(storeType='remoteStore')
+    layers = layers.order_by('id')
+
+    if state_file and os.path.exists(state_file):
+        with open(state_file) as f:
+            last_id = int(f.read().strip() or 0)
+        layers = layers.filter(id__gt=last_id)
+        if console is not None:
+            print >> console, 'Resuming after layer %d' % last_id
+    layers = list(layers)
+
+    def render(layer):
+        try:
+            return 'rendered' if render_layer_thumbnail(layer, force=force) else 'skipped'
+        except Exception:
+            logger.exception('Could not render the thumbnail of layer %s', layer.typename)
+            return 'failed'
+        finally:
+            if workers > 1:
+                # each thread of the pool owns its database connection
+                connection.close()
+
+    stats = dict(rendered=0, skipped=0, failed=0)
+    for i in range(0, len(layers), batch_size):
+        chunk = layers[i:i + batch_size]
+        for result in _parallel_map(render, chunk, workers):
+            stats[result] += 1
+        if state_file:
+            with open(state_file, 'w') as f:
+                f.write('%d' % chunk[-1].id)
+        if console is not None:
+            print >> console, 'Processed %d of %d layers' % (i + len(chunk), len(layers))
+
+    if state_file and os.path.exists(state_file):
+        os.remove(state_file)
+    return stats
+
+
+def map_thumbnail_extent(instance):
+    """Return the ``(srs, bbox)`` a map thumbnail is rendered for: the
+       bounding box of the map, else the area shown around its center at
+       its zoom level by a viewer ``VIEWER_WIDTH`` pixels wide. None if the
+       map has neither.
+    """
+    if None not in instance.bbox[:4]:
+        return instance.srid, instance.bbox_string
+    if instance.projection in ('EPSG:900913', 'EPSG:3857') and \
+            None not in (instance.center_x, instance.center_y, instance.zoom):
+        # the resolution of the zoom levels of spherical mercator tiles
+        half_width = 156543.03392804062 / 2 ** instance.zoom * VIEWER_WIDTH / 2
+        half_height = half_width * THUMBNAIL_SIZE[1] / THUMBNAIL_SIZE[0]
+        return instance.projection, ','.join(str(c) for c in (
+            instance.center_x - half_width, instance.center_y - half_height,
+            instance.center_x + half_width, instance.center_y + half_height))
+    return None
+
+
+def map_thumbnail_requests(instance, layers=None):
+    """
+    Return the GetMap requests rendering the visible WMS layers of a map,
+    bottom first, as ``[url, params, opacity, local]`` lists.
+
+    Consecutive opaque local layers are rendered by a single request. The
+    map layers are the ones of ``instance`` unless ``layers`` is given.
+    """
+    if layers is None:
+        layers = instance.layer_set.filter(visibility=True).order_by('stack_order')
+    layers = [l for l in layers if l.visibility and l.name and (l.local or l.ows_url)]
+
+    extent = map_thumbnail_extent(instance)
+    if extent is None:
+        # the reflector computes the extent of the local layers, the other
+        # ones could not be aligned with it.
+        names = [l.name for l in layers if l.local]
+        if not names:
+            return []
+        return [[ogc_server_settings.LOCATION + 'wms/reflect', {
+            'layers': ','.join(names),
+            'format': 'image/png',
+            'transparent': 'true',
+            'width': THUMBNAIL_SIZE[0],
+            'height': THUMBNAIL_SIZE[1],
+        }, 1.0, True]]
+
+    srs, bbox = extent
+    requests = []
+    for layer in layers:
+        opacity = 1.0 if layer.opacity is None else max(0.0, min(1.0, layer.opacity))
+        if opacity == 0:
+            continue
+        previous = requests[-1] if requests else None
+        if layer.local and opacity == 1 and previous and previous[3] and previous[2] == 1:
+            previous[1]['layers'] += ',' + layer.name
+            previous[1]['styles'] += ',' + (layer.styles or '')
+            continue
+        if layer.local:
+            url = ogc_server_settings.LOCATION + 'wms'
+        else:
+            url = layer.ows_url
+        requests.append([url, {
+            'service': 'WMS',
+            'version': '1.1.1',
+            'request': 'GetMap',
+            'layers': layer.name,
+            'styles': layer.styles or '',
+            'srs': srs,
+            'bbox': bbox,
+            'format': 'image/png',
+            'transparent': 'true',
+            'width': THUMBNAIL_SIZE[0],
+            'height': THUMBNAIL_SIZE[1],
+        }, opacity, layer.local])
+    return requests
+
+
+def map_thumbnail_spec(requests):
+    """Return the digest of the requests rendering a map thumbnail and of
+       the version of the local layers they render.
+    """
+    names = set()
+    for url, params, opacity, local in requests:
+        if local:
+            names.update(params['layers'].split(','))
+    versions = Layer.objects.filter(typename__in=names).values_list(
+        'typename', 'upload_session', 'default_style__name', 'default_style__sld_body')
+    return thumbnail_spec(json.dumps(requests, sort_keys=True), *sorted(versions))
+
+
+def _getmap_url(url, params):
+    params = dict((k, v.encode('utf-8') if isinstance(v, unicode) else v)
+                  for k, v in params.items())
+    if url.endswith('?') or url.endswith('&'):
+        separator = ''
+    else:
+        separator = '&' if '?' in url else '?'
+    return url + separator + urllib.urlencode(params)
+
+
+def _fetch_image(request):
+    url, params, opacity, local = request
+    try:
+        response, content = http_client.request(_getmap_url(url, params))
+        if response.status != 200 or not response.get('content-type', '').startswith('image/'):
+            logger.debug('Could not render %s from %s: %s', params['layers'], url, content[:200])
+            return None
+        return Image.open(StringIO(content)).convert('RGBA')
+    except Exception:
+        logger.exception('Could not render %s from %s', params['layers'], url)
+        return None
+
+
+def compose_thumbnail(images):
+    """Blend the ``(image, opacity)`` layers, bottom first, and return the
+       PNG image.
+    """
+    canvas = Image.new('RGBA', THUMBNAIL_SIZE, (255, 255, 255, 0))
+    for image, opacity in images:
+        if image.size != THUMBNAIL_SIZE:
+            image = image.resize(THUMBNAIL_SIZE, Image.BILINEAR)
+        if opacity < 1:
+            image.putalpha(image.split()[3].point(lambda a: int(a * opacity)))
+        canvas = Image.alpha_composite(canvas, image)
+    output = StringIO()
+    canvas.save(output, 'PNG', optimize=True)
+    return output.getvalue()
+
+
+def render_map_thumbnail(instance, force=False, workers=4, expected=None):
+    """
+    Compose the thumbnail of a map from its layers unless they did not
+    change. The image of another map rendered from the same requests is
+    reused. Returns True if a new image was stored.
+
+    With ``expected``, see ``render_layer_thumbnail``.
+    """
+    requests = map_thumbnail_requests(instance)
+    spec = map_thumbnail_spec(requests) if requests else None
+    if expected is not None and spec != expected:
+        raise GeoNodeException('The changes of map %s are not committed yet' % instance.pk)
+    if not requests:
+        return False
+    if not force:
+        if instance.thumbnail_set.filter(thumb_spec=spec).exists() and instance.has_thumbnail():
+            return False
+        shared = Thumbnail.objects.filter(thumb_spec=spec).exclude(
+            resourcebase=instance.get_self_resource()).first()
+        if shared is not None and default_storage.exists(shared.thumb_file.name):
+            with default_storage.open(shared.thumb_file.name) as f:
+                instance.save_thumbnail(f.read(), spec)
+            return True
+
+    images = []
+    for (url, params, opacity, local), image in zip(
+            requests, _parallel_map(_fetch_image, requests, workers)):
+        if image is not None:
+            images.append((image, opacity))
+    if not images:
+        return False
+    # a partial image is rendered again on the next save of the map
+    complete = len(images) == len(requests)
+    instance.save_thumbnail(compose_thumbnail(images), spec if complete else None)
+    return True
+
+
+def regenerate_map_thumbnail(map_id, force=False, expected=None):
+    # see regenerate_thumbnail
+    instance = Map.objects.get(pk=map_id)
+    render_map_thumbnail(instance, force=force, expected=expected)
+
+
+def queue_map_thumbnail(instance, force=False):
+    """Compose the thumbnail of a map in a background job, see
+       ``queue_thumbnail``.
+    """
+    expected = None
+    if connection.in_atomic_block:
+        requests = map_thumbnail_requests(Map.objects.get(pk=instance.pk))
+        expected = map_thumbnail_spec(requests) if requests else None
+    thumbnail_workers.submit(('map', instance.pk), regenerate_map_thumbnail, instance.pk,
+                             force=force, expected=expected)
+
+
+thumbnail_workers = WorkerPool('thumbnail', retries=5)
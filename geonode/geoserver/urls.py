@@ -46,6 +46,12 @@ urlpatterns = patterns('geonode.geoserver.views',
                        url(r'^(?P<layername>[^/]*)/style/manage$',
                            'layer_style_manage',
                            name='layer_style_manage'),
+                       url(r'^(?P<layername>[^/]*)/sync$',
+                           'layer_sync_status',
+                           name='layer_sync_status'),
+                       url(r'^(?P<layername>[^/]*)/tiles$',
+                           'layer_tiles_status',
+                           name='layer_tiles_status'),
                        url(r'^(?P<layername>[^/]*)/edit-check?$',
                            'feature_edit_check',
                            name="feature_edit_check"),
@@ -58,4 +64,10 @@ urlpatterns = patterns('geonode.geoserver.views',
                        url(r'^download$',
                            'layer_batch_download',
                            name='layer_batch_download'),
+                       url(r'^download/(?P<download_id>\d+)$',
+                           'batch_download',
+                           name='batch_download'),
+                       url(r'^download/(?P<download_id>\d+)/cancel$',
+                           'batch_download_cancel',
+                           name='batch_download_cancel'),
                        )
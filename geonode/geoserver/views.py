@@ -1,12 +1,14 @@
+import os
 import json
+import hashlib
 import logging
-import httplib2
 
-from django.contrib.auth import authenticate
 from django.utils import simplejson
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, HttpResponseNotModified, Http404
+from django.http import StreamingHttpResponse
 from django.views.decorators.http import require_POST
-from django.shortcuts import render_to_response
+from django.shortcuts import render_to_response, get_object_or_404
+from django.core.servers.basehttp import FileWrapper
 from django.conf import settings
 from django.contrib.auth.decorators import user_passes_test
 from django.contrib.auth import get_user_model
@@ -16,22 +18,33 @@ from django.template import RequestContext
 from django.utils.datastructures import MultiValueDictKeyError
 from django.utils.translation import ugettext as _
 
-from guardian.shortcuts import get_objects_for_user
-
 from geonode.layers.forms import LayerStyleUploadForm
 from geonode.layers.models import Layer
 from geonode.layers.views import _resolve_layer, _PERMISSION_MSG_MODIFY
 from geonode.geoserver.signals import gs_catalog
-from geonode.utils import json_response, _get_basic_auth_info
+from geonode.geoserver.models import BatchDownload, LayerSync
+from geonode.geoserver.download import archive_path, batch_download_status
+from geonode.geoserver.download import cancel_batch_download, start_batch_download
+from geonode.geoserver.gwc import tile_job_status
+from geonode.utils import json_response, _get_basic_auth_info, credentials_cache, streaming_response
 from geoserver.catalog import FailedRequestError, ConflictingDataError
 from lxml import etree
 from .helpers import get_stores, gs_slurp, ogc_server_settings, set_styles, style_update
+from .helpers import get_layer_acls, http_client
 
 logger = logging.getLogger(__name__)
 
 
 def stores(request, store_type=None):
-    stores = get_stores(store_type)
+    try:
+        offset = int(request.GET.get('offset', 0))
+        limit = int(request.GET['limit']) if 'limit' in request.GET else None
+    except ValueError:
+        return HttpResponse('offset and limit must be integers', status=400, mimetype='text/plain')
+    stores = get_stores(store_type,
+                        workspace=request.GET.get('workspace'),
+                        offset=offset,
+                        limit=limit)
     data = simplejson.dumps(stores)
     return HttpResponse(data)
 
@@ -262,6 +275,39 @@ def feature_edit_check(request, layername):
             json.dumps({'authorized': False}), mimetype="application/json")
 
 
+def layer_sync_status(request, layername):
+    """
+    Return the status of the synchronisation of a layer with GeoServer
+    done in the background when GEOSERVER_DEFERRED_POST_SAVE is enabled.
+    """
+    layer = _resolve_layer(request, layername)
+    try:
+        sync = layer.gs_sync
+    except LayerSync.DoesNotExist:
+        return HttpResponse(json.dumps({'status': None}), mimetype="application/json")
+
+    return HttpResponse(json.dumps({
+        'status': sync.status,
+        'stage': sync.stage,
+        'attempts': sync.attempts,
+        'error': sync.error,
+        'requested': sync.requested.isoformat(),
+        'last_updated': sync.last_updated.isoformat(),
+    }), mimetype="application/json")
+
+
+def layer_tiles_status(request, layername):
+    """
+    Return the GeoWebCache seeding and truncation jobs of a layer, the most
+    recent first, as last updated by the background dispatcher.
+    """
+    layer = _resolve_layer(request, layername)
+    jobs = layer.tile_jobs.order_by('-id')[:20]
+    return HttpResponse(json.dumps({
+        'jobs': [tile_job_status(job) for job in jobs],
+    }), mimetype="application/json")
+
+
 def geoserver_rest_proxy(request, proxy_path, downstream_path):
 
     if not request.user.is_authenticated():
@@ -277,17 +323,28 @@ def geoserver_rest_proxy(request, proxy_path, downstream_path):
     path = strip_prefix(request.get_full_path(), proxy_path)
     url = str("".join([ogc_server_settings.LOCATION, downstream_path, path]))
 
-    http = httplib2.Http()
-    http.add_credentials(*(ogc_server_settings.credentials))
     headers = dict()
 
     if request.method in ("POST", "PUT") and "CONTENT_TYPE" in request.META:
         headers["Content-Type"] = request.META["CONTENT_TYPE"]
 
-    response, content = http.request(
-        url, request.method,
-        body=request.body or None,
-        headers=headers)
+    streaming = getattr(settings, 'PROXY_STREAMING', True)
+    if streaming:
+        headers["Accept-Encoding"] = request.META.get("HTTP_ACCEPT_ENCODING", "identity")
+        response, content = http_client.stream(
+            url, request.method,
+            body=request.body or None,
+            headers=headers,
+            redirections=5)
+    else:
+        response, content = http_client.request(
+            url, request.method,
+            body=request.body or None,
+            headers=headers)
+
+    if request.method != 'GET':
+        # the catalog was changed behind the back of gs_catalog
+        gs_catalog.clear_cache()
 
     # we need to sync django here
     # we should remove this geonode dependency calling layers.views straight
@@ -295,8 +352,16 @@ def geoserver_rest_proxy(request, proxy_path, downstream_path):
     if downstream_path == 'rest/styles' and len(request.body) > 0:
         # for some reason sometime gxp sends a put with empty request
         # need to figure out with Bart
-        style_update(request, url)
+        try:
+            style_update(request, url)
+        except Exception:
+            if streaming:
+                # give the upstream connection back to the pool
+                content.close()
+            raise
 
+    if streaming:
+        return streaming_response(response, content)
     return HttpResponse(
         content=content,
         status=response.status,
@@ -310,52 +375,67 @@ def layer_batch_download(request):
     POST - begin download
     GET?id=<download_id> monitor status
     """
-
-    from geonode.utils import http_client
-    # currently this just piggy-backs on the map download backend
-    # by specifying an ad hoc map that contains all layers requested
-    # for download. assumes all layers are hosted locally.
-    # status monitoring is handled slightly differently.
-
     if request.method == 'POST':
-        layers = request.POST.getlist("layer")
-        layers = Layer.objects.filter(typename__in=list(layers))
+        layers = Layer.objects.filter(typename__in=request.POST.getlist("layer"))
+        layers = [layer for layer in layers if request.user.has_perm(
+            'base.view_resourcebase', obj=layer.get_self_resource())]
+        if not layers:
+            return HttpResponse(_("No layer can be downloaded."), status=404, mimetype="text/plain")
+        job = start_batch_download(layers, request.user)
+        return HttpResponse(json.dumps(batch_download_status(job)), mimetype="application/json")
 
-        def layer_son(layer):
-            return {
-                "name": layer.typename,
-                "service": layer.service_type,
-                "metadataURL": "",
-                "serviceURL": ""
-            }
+    if request.method == 'GET':
+        try:
+            job = BatchDownload.objects.get(pk=request.GET.get('id'))
+        except (BatchDownload.DoesNotExist, ValueError):
+            return HttpResponse(status=404)
+        if not _can_view_batch_download(request.user, job):
+            return HttpResponse(_("You are not allowed to view this download."),
+                                status=403, mimetype="text/plain")
+        return HttpResponse(json.dumps(batch_download_status(job)), mimetype="application/json")
 
-        readme = """This data is provided by GeoNode.\n\nContents:"""
+    return HttpResponse(status=405)
 
-        def list_item(lyr):
-            return "%s - %s.*" % (lyr.title, lyr.name)
 
-        readme = "\n".join([readme] + [list_item(l) for l in layers])
+def _can_view_batch_download(user, job):
+    """
+    Whether ``user`` is the owner of a download job, a superuser or allowed
+    to view all its layers. A job is shared by all the users requesting the
+    same layers.
+    """
+    if user.is_superuser or (job.owner is not None and job.owner == user):
+        return True
+    readable = set(sum(get_layer_acls(user), []))
+    return readable.issuperset(json.loads(job.layers))
 
-        fake_map = {
-            "map": {"readme": readme},
-            "layers": [layer_son(lyr) for lyr in layers]
-        }
 
-        url = "%srest/process/batchDownload/launch/" % ogc_server_settings.LOCATION
-        resp, content = http_client.request(
-            url, 'POST', body=json.dumps(fake_map))
-        return HttpResponse(content, status=resp.status)
+def batch_download(request, download_id):
+    """
+    Stream the archive of a finished batch download, to the users allowed
+    to view all its layers.
+    """
+    job = get_object_or_404(BatchDownload, pk=download_id, status='finished')
+    if not _can_view_batch_download(request.user, job):
+        return HttpResponse(_("You are not allowed to download these layers."),
+                            status=403, mimetype="text/plain")
+    try:
+        archive = open(archive_path(job), 'rb')
+    except IOError:
+        raise Http404
+    response = StreamingHttpResponse(FileWrapper(archive, 64 * 1024), content_type='application/zip')
+    response['Content-Length'] = os.fstat(archive.fileno()).st_size
+    response['Content-Disposition'] = 'attachment; filename="geonode-%s.zip"' % job.pk
+    return response
 
-    if request.method == 'GET':
-        # essentially, this just proxies back to geoserver
-        download_id = request.GET.get('id', None)
-        if download_id is None:
-            return HttpResponse(status=404)
 
-        url = "%srest/process/batchDownload/status/%s" % (
-            ogc_server_settings.LOCATION, download_id)
-        resp, content = http_client.request(url, 'GET')
-        return HttpResponse(content, status=resp.status)
+@require_POST
+def batch_download_cancel(request, download_id):
+    job = get_object_or_404(BatchDownload, pk=download_id)
+    if not (request.user.is_superuser or (job.owner is not None and job.owner == request.user)):
+        return HttpResponse(_("You are not allowed to cancel this download."),
+                            status=403, mimetype="text/plain")
+    cancel_batch_download(job)
+    return HttpResponse(json.dumps(batch_download_status(job)), mimetype="application/json")
 
 
 def resolve_user(request):
@@ -365,7 +445,7 @@ def resolve_user(request):
     acl_user = request.user
     if 'HTTP_AUTHORIZATION' in request.META:
         username, password = _get_basic_auth_info(request)
-        acl_user = authenticate(username=username, password=password)
+        acl_user = credentials_cache.authenticate(username, password)
         if acl_user:
             user = acl_user.username
             superuser = acl_user.is_superuser
@@ -407,7 +487,7 @@ def layer_acls(request):
     if 'HTTP_AUTHORIZATION' in request.META:
         try:
             username, password = _get_basic_auth_info(request)
-            acl_user = authenticate(username=username, password=password)
+            acl_user = credentials_cache.authenticate(username, password)
 
             # Nope, is it the special geoserver user?
             if (acl_user is None and
@@ -433,18 +513,7 @@ def layer_acls(request):
                                 mimetype="text/plain")
 
     # Include permissions on the anonymous user
-    all_readable = get_objects_for_user(acl_user, 'base.view_resourcebase')
-
-    all_writable = get_objects_for_user(acl_user, 'base.change_resourcebase')
-
-    read_only = [
-        x.layer.typename for x in all_readable if x not in all_writable and hasattr(
-            x,
-            'layer')]
-    read_write = [
-        x.layer.typename for x in all_writable if x in all_readable and hasattr(
-            x,
-            'layer')]
+    read_only, read_write = get_layer_acls(acl_user)
 
     result = {
         'rw': read_write,
@@ -457,4 +526,12 @@ def layer_acls(request):
         result['fullname'] = acl_user.first_name
         result['email'] = acl_user.email
 
-    return HttpResponse(json.dumps(result), mimetype="application/json")
+    # GeoServer polls this view, let it revalidate its copy of the ACLs
+    content = json.dumps(result, sort_keys=True, separators=(',', ':'))
+    etag = '"%s"' % hashlib.sha1(content).hexdigest()
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, mimetype="application/json")
+    response['ETag'] = etag
+    return response
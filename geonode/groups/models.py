@@ -11,6 +11,8 @@ from django.db.models import signals
 from taggit.managers import TaggableManager
 from guardian.shortcuts import get_objects_for_group
 
+from geonode.security.models import invalidate_acls
+
 
 class GroupProfile(models.Model):
     GROUP_CHOICES = [
@@ -259,3 +261,4 @@ def group_pre_delete(instance, sender, **kwargs):
          not permitted as will break the geonode permissions system')
 
 signals.pre_delete.connect(group_pre_delete, sender=Group)
+signals.post_delete.connect(invalidate_acls, sender=Group)
@@ -3,6 +3,7 @@ from dialogos.models import Comment
 from django.contrib.contenttypes.models import ContentType
 from django.db.models import Avg
 from haystack import indexes
+from geonode.security.models import resource_principals
 from geonode.maps.models import Layer
 
 
@@ -46,6 +47,8 @@ class LayerIndex(indexes.SearchIndex, indexes.Indexable):
     num_ratings = indexes.IntegerField()
     num_comments = indexes.IntegerField()
     thumbnail_url = indexes.CharField(model_attr="thumbnail_url", null=True)
+    # the principals allowed to view the resource
+    visibility = indexes.MultiValueField(null=True)
 
     def get_model(self):
         return Layer
@@ -108,3 +111,6 @@ class LayerIndex(indexes.SearchIndex, indexes.Indexable):
 
     def prepare_title_sortable(self, obj):
         return obj.title.lower()
+
+    def prepare_visibility(self, obj):
+        return resource_principals(obj.pk)
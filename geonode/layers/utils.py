@@ -23,6 +23,7 @@
 
 # Standard Modules
 import logging
+import hashlib
 import re
 import os
 import glob
@@ -35,21 +36,17 @@ from django.contrib.auth import get_user_model
 from django.utils.translation import ugettext_lazy as _
 from django.template.defaultfilters import slugify
 from django.core.files import File
-from django.core.files.base import ContentFile
-from django.conf import settings
 
 # Geonode functionality
 from geonode import GeoNodeException
 from geonode.people.utils import get_valid_user
 from geonode.layers.models import Layer, UploadSession
-from geonode.base.models import (Link, ResourceBase, Thumbnail,
+from geonode.base.models import (Link, ResourceBase,
                                  SpatialRepresentationType, TopicCategory)
 from geonode.layers.models import shp_exts, csv_exts, vec_exts, cov_exts
 from geonode.utils import http_client
 from geonode.layers.metadata import set_metadata
 
-from urlparse import urljoin
-
 from zipfile import ZipFile
 
 logger = logging.getLogger('geonode.layers.utils')
@@ -494,11 +491,39 @@ def upload(incoming, user=None, overwrite=False,
     return output
 
 
-def create_thumbnail(instance, thumbnail_remote_url, thumbail_create_url=None):
+def thumbnail_spec(*inputs):
+    """Return the digest of the inputs a thumbnail is rendered from.
+    """
+    digest = hashlib.sha1()
+    for value in inputs:
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        digest.update('%s\n' % (value,))
+    return digest.hexdigest()
+
+
+def create_thumbnail(instance, thumbnail_remote_url, thumbail_create_url=None,
+                     spec=None, http=None, force=False):
+    """Render the thumbnail of a layer and store it.
+
+       ``spec`` is the digest of the rendering inputs, by default the
+       thumbnail url and the bounding box: the image is not requested again
+       while it matches the one of the stored thumbnail, unless ``force`` is
+       set. Returns True if a new image was stored.
+    """
     BBOX_DIFFERENCE_THRESHOLD = 1e-5
 
     if not thumbail_create_url:
         thumbail_create_url = thumbnail_remote_url
+    if spec is None:
+        spec = thumbnail_spec(thumbnail_remote_url, instance.bbox_x0, instance.bbox_x1,
+                              instance.bbox_y0, instance.bbox_y1)
+    if http is None:
+        http = http_client
+
+    if not force and instance.thumbnail_set.filter(thumb_spec=spec).exists() and \
+            instance.has_thumbnail():
+        return False
 
     # Check if the bbox is invalid
     valid_x = (
@@ -526,7 +551,7 @@ def create_thumbnail(instance, thumbnail_remote_url, thumbail_create_url=None):
         )
 
         # Download thumbnail and save it locally.
-        resp, image = http_client.request(thumbail_create_url)
+        resp, image = http.request(thumbail_create_url)
         if 'ServiceException' in image or resp.status < 200 or resp.status > 299:
             msg = 'Unable to obtain thumbnail: %s' % image
             logger.debug(msg)
@@ -534,32 +559,10 @@ def create_thumbnail(instance, thumbnail_remote_url, thumbail_create_url=None):
             image = None
 
     if image is not None:
-        # first delete thumbnail file on disk to prevent duplicates:
-        if instance.has_thumbnail():
-            instance.thumbnail_set.get().thumb_file.delete()
-        # update database and save new thumbnail file on disk:
-        instance.thumbnail_set.all().delete()
-        thumbnail = Thumbnail(thumb_spec=thumbnail_remote_url)
-        instance.thumbnail_set.add(thumbnail)
-        thumbnail.thumb_file.save(
-            'layer-%s-thumb.png' %
-            instance.id,
-            ContentFile(image))
-        thumbnail.save()
-
-        thumbnail_url = urljoin(
-            settings.SITEURL,
-            instance.thumbnail_set.get().thumb_file.url)
-
-        Link.objects.get_or_create(resource=instance.resourcebase_ptr,
-                                   url=thumbnail_url,
-                                   defaults=dict(
-                                       name=_('Thumbnail'),
-                                       extension='png',
-                                       mime='image/png',
-                                       link_type='image',
-                                   )
-                                   )
+        instance.save_thumbnail(image, spec)
+        return True
+
     ResourceBase.objects.filter(id=instance.id).update(
         thumbnail_url=instance.get_thumbnail_url()
     )
+    return False
@@ -615,3 +615,37 @@ community."
         # Check there are no ratings matching the removed map
         rating = OverallRating.objects.filter(category=1, object_id=map_id)
         self.assertEquals(rating.count(), 0)
+
+    def test_map_thumbnail(self):
+        """Test the thumbnail of a map is composed from its layer stack
+        """
+        from PIL import Image
+        from cStringIO import StringIO
+        from geonode.maps.models import MapLayer
+        from geonode.geoserver.thumbnails import map_thumbnail_requests, compose_thumbnail
+
+        map_obj = Map(projection='EPSG:900913', zoom=2, center_x=0, center_y=0,
+                      bbox_x0=-10, bbox_y0=-10, bbox_x1=10, bbox_y1=10)
+        layers = [
+            MapLayer(name='remote', ows_url='http://example.com/wms', opacity=0.5),
+            MapLayer(name='geonode:a', local=True),
+            MapLayer(name='geonode:b', local=True, styles='b_style'),
+            MapLayer(name='geonode:c', local=True, opacity=0.5),
+            MapLayer(name='geonode:d', local=True, visibility=False),
+            MapLayer(name='mapnik', opacity=1),
+        ]
+        requests = map_thumbnail_requests(map_obj, layers)
+        self.assertEquals([(r[1]['layers'], r[1]['styles'], r[2], r[3]) for r in requests], [
+            ('remote', '', 0.5, False),
+            ('geonode:a,geonode:b', ',b_style', 1.0, True),
+            ('geonode:c', '', 0.5, True),
+        ])
+        self.assertEquals(requests[0][0], 'http://example.com/wms')
+        self.assertEquals(requests[1][1]['bbox'], '-10,-10,10,10')
+
+        red = Image.new('RGBA', (200, 150), (255, 0, 0, 255))
+        blue = Image.new('RGBA', (100, 75), (0, 0, 255, 255))
+        image = Image.open(StringIO(compose_thumbnail([(red, 1.0), (blue, 0.5)])))
+        self.assertEquals(image.size, (200, 150))
+        r, g, b, a = image.convert('RGBA').getpixel((10, 10))
+        self.assertTrue(120 < r < 135 and 120 < b < 135 and a == 255)
@@ -43,7 +43,6 @@ from geonode.utils import DEFAULT_TITLE
 from geonode.utils import DEFAULT_ABSTRACT
 from geonode.utils import default_map_config
 from geonode.utils import resolve_object
-from geonode.utils import http_client
 from geonode.utils import layer_from_viewer_config
 from geonode.maps.forms import MapForm
 from geonode.security.views import _perms_info_json
@@ -55,9 +54,9 @@ from geonode.people.forms import ProfileForm
 from geonode.utils import num_encode, num_decode
 
 if 'geonode.geoserver' in settings.INSTALLED_APPS:
-    # FIXME: The post service providing the map_status object
-    # should be moved to geonode.geoserver.
     from geonode.geoserver.helpers import ogc_server_settings
+    from geonode.geoserver.models import BatchDownload
+    from geonode.geoserver.download import batch_download_status, start_batch_download
 
 
 logger = logging.getLogger("geonode.maps.views")
@@ -564,42 +563,9 @@ def new_map_config(request):
 def map_download(request, mapid, template='maps/map_download.html'):
     """
     Download all the layers of a map as a batch
-    XXX To do, remove layer status once progress id done
-    This should be fix because
     """
     map_obj = _resolve_map(request, mapid, 'base.view_resourcebase', _PERMISSION_MSG_VIEW)
 
-    map_status = dict()
-    if request.method == 'POST':
-        url = "%srest/process/batchDownload/launch/" % ogc_server_settings.LOCATION
-
-        def perm_filter(layer):
-            return request.user.has_perm(
-                'base.view_resourcebase',
-                obj=layer.get_self_resource())
-
-        mapJson = map_obj.json(perm_filter)
-
-        # we need to remove duplicate layers
-        j_map = json.loads(mapJson)
-        j_layers = j_map["layers"]
-        for j_layer in j_layers:
-            if(len([l for l in j_layers if l == j_layer])) > 1:
-                j_layers.remove(j_layer)
-        mapJson = json.dumps(j_map)
-
-        resp, content = http_client.request(url, 'POST', body=mapJson)
-
-        status = int(resp.status)
-
-        if status == 200:
-            map_status = json.loads(content)
-            request.session["map_status"] = map_status
-        else:
-            raise Exception(
-                'Could not start the download of %s. Error was: %s' %
-                (map_obj.title, content))
-
     locked_layers = []
     remote_layers = []
     downloadable_layers = []
@@ -620,6 +586,14 @@ def map_download(request, mapid, template='maps/map_download.html'):
                             [l for l in downloadable_layers if l.name == lyr.name]) == 0:
                         downloadable_layers.append(lyr)
 
+    map_status = dict()
+    if request.method == 'POST' and downloadable_layers:
+        job = start_batch_download(
+            Layer.objects.filter(typename__in=[lyr.name for lyr in downloadable_layers]),
+            request.user)
+        map_status = batch_download_status(job)
+        request.session["map_status"] = map_status
+
     return render_to_response(template, RequestContext(request, {
         "map_status": map_status,
         "map": map_obj,
@@ -634,25 +608,16 @@ def map_download_check(request):
     """
     this is an endpoint for monitoring map downloads
     """
-    try:
-        layer = request.session["map_status"]
-        if isinstance(layer, dict):
-            url = "%srest/process/batchDownload/status/%s" % (
-                ogc_server_settings.LOCATION, layer["id"])
-            resp, content = http_client.request(url, 'GET')
-            status = resp.status
-            if resp.status == 400:
-                return HttpResponse(
-                    content="Something went wrong",
-                    status=status)
-        else:
-            content = "Something Went wrong"
-            status = 400
-    except ValueError:
-        # TODO: Is there any useful context we could include in this log?
+    map_status = request.session.get("map_status")
+    if not isinstance(map_status, dict):
         logger.warn(
             "User tried to check status, but has no download in progress.")
-    return HttpResponse(content=content, status=status)
+        return HttpResponse(content="Something went wrong", status=400)
+    try:
+        job = BatchDownload.objects.get(pk=map_status["id"])
+    except (BatchDownload.DoesNotExist, KeyError):
+        return HttpResponse(content="Something went wrong", status=400)
+    return HttpResponse(content=json.dumps(batch_download_status(job)))
 
 
 def map_wmc(request, mapid, template="maps/wmc.xml"):
@@ -18,16 +18,20 @@
 #
 #########################################################################
 
+from django.conf import settings
+from django.core.cache import cache
 from django.db import models
 from django.utils.translation import ugettext as _
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import AbstractUser
 from django.db.models import signals
 
+from avatar.models import Avatar
 from taggit.managers import TaggableManager
 
 from geonode.base.enumerations import COUNTRIES
 from geonode.groups.models import GroupProfile
+from geonode.security.models import invalidate_acls
 
 from .utils import format_address
 
@@ -126,6 +130,28 @@ class Profile(AbstractUser):
         return format_address(self.delivery, self.zipcode, self.city, self.area, self.country)
 
 
+AVATAR_URL_KEY = 'people:avatar_url:%s'
+
+
+def cached_avatar_url(user, size):
+    """
+    Return the url of the avatar of a user, cached ``AVATAR_URL_CACHE_TTL``
+    seconds. The urls are dropped when the avatar or the email of the user
+    change.
+    """
+    from avatar.templatetags.avatar_tags import avatar_url
+    key = AVATAR_URL_KEY % user.pk
+    urls = cache.get(key) or {}
+    if size not in urls:
+        urls[size] = avatar_url(user, size)
+        cache.set(key, urls, getattr(settings, 'AVATAR_URL_CACHE_TTL', 60 * 60))
+    return urls[size]
+
+
+def invalidate_avatar_url(instance, sender, **kwargs):
+    cache.delete(AVATAR_URL_KEY % (instance.pk if sender is Profile else instance.user_id))
+
+
 def get_anonymous_user_instance(Profile):
     return Profile(username='AnonymousUser')
 
@@ -138,3 +164,7 @@ def profile_post_save(instance, sender, **kwargs):
     instance.groups.add(anon_group)
 
 signals.post_save.connect(profile_post_save, sender=Profile)
+signals.m2m_changed.connect(invalidate_acls, sender=Profile.groups.through)
+signals.post_save.connect(invalidate_avatar_url, sender=Profile)
+signals.post_save.connect(invalidate_avatar_url, sender=Avatar)
+signals.post_delete.connect(invalidate_avatar_url, sender=Avatar)
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#
+# Copyright (C) 2012 OpenPlans
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+"""Cache of the idempotent OGC requests sent through the proxy.
+
+Only the GET requests of the operations in ``PROXY_CACHE_OPERATIONS`` are
+cached, keyed by their normalised URL and by the permissions of the user
+when the session cookie is forwarded upstream. The lifetime of the entries
+comes from the upstream Cache-Control header, expired entries are
+revalidated with the upstream ETag or Last-Modified, and the clients
+sending a matching If-None-Match or If-Modified-Since get a 304.
+"""
+
+import time
+import hashlib
+import threading
+
+from urllib import urlencode
+from urlparse import urlsplit, parse_qsl
+from collections import OrderedDict
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_http_date_safe
+
+from geonode.security.models import acl_version
+from geonode.utils import http_client
+
+DEFAULT_OPERATIONS = (
+    'GetCapabilities',
+    'GetLegendGraphic',
+    'DescribeFeatureType',
+    'DescribeCoverage',
+    'DescribeLayer',
+)
+
+
+# the parameters naming the layers an OGC request is about
+LAYER_PARAMETERS = ('layer', 'layers', 'typename', 'typenames', 'coverage', 'identifiers')
+
+
+def _parameters(url):
+    query = urlsplit(url)[3]
+    # the parameter names of the OGC requests are case insensitive
+    return sorted((k.lower(), v) for k, v in parse_qsl(query, keep_blank_values=True))
+
+
+class CachedEntry(object):
+
+    def __init__(self, result, content, expires, operation=None, layers=()):
+        self.result = result
+        self.content = content
+        self.expires = expires
+        self.operation = operation
+        self.layers = frozenset(layers)
+        # the validators sent upstream, the ETag of the entry is made up
+        # when upstream did not send one
+        self.etag = result.get('etag')
+        self.last_modified = result.get('last-modified')
+        if 'etag' not in result:
+            result['etag'] = '"%s"' % hashlib.sha1(content).hexdigest()
+
+    @property
+    def size(self):
+        return len(self.content)
+
+
+class ProxyCache(object):
+
+    """
+    Memory store of the proxied responses, bounded to ``max_size`` bytes
+    (``PROXY_CACHE_SIZE`` by default). The least recently used entries are
+    dropped first and the responses larger than a tenth of the store are
+    not kept.
+    """
+
+    def __init__(self, max_size=None, ttl=None, operations=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.operations = operations
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.counters = dict.fromkeys(
+            ['hits', 'misses', 'revalidated', 'not_modified', 'evictions'], 0)
+
+    def get_max_size(self):
+        if self.max_size is not None:
+            return self.max_size
+        return getattr(settings, 'PROXY_CACHE_SIZE', 32 * 1024 * 1024)
+
+    def get_ttl(self):
+        if self.ttl is not None:
+            return self.ttl
+        return getattr(settings, 'PROXY_CACHE_TTL', 300)
+
+    def get_operations(self):
+        operations = self.operations
+        if operations is None:
+            operations = getattr(settings, 'PROXY_CACHE_OPERATIONS', DEFAULT_OPERATIONS)
+        return set(op.lower() for op in operations)
+
+    def key(self, request, url, forward_cookie=False):
+        """Return the key of a proxied request, or None if it can not be
+           cached.
+        """
+        if request.method != 'GET':
+            return None
+        scheme, netloc, path, query, fragment = urlsplit(url)
+        params = _parameters(url)
+        operation = dict(params).get('request', '').lower()
+        if operation not in self.get_operations():
+            return None
+
+        if forward_cookie:
+            # GeoServer answers according to the permissions of the user
+            user = request.user.pk if request.user.is_authenticated() else 'anonymous'
+            context = 'user:%s:%s' % (user, acl_version())
+        else:
+            context = 'public'
+        normalised = '%s://%s%s?%s' % (scheme.lower(), netloc.lower(), path or '/', urlencode(params))
+        return hashlib.sha1('%s|%s' % (normalised, context)).hexdigest()
+
+    def request(self, key, url, headers=None):
+        """Return the ``(response, content)`` of a GET request, from the cache
+           while it is fresh.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+        if entry is not None and entry.expires > now:
+            self._count('hits')
+            return entry.result, entry.content
+
+        headers = dict(headers or {})
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        result, content = http_client.request(url, 'GET', headers=headers, redirections=0)
+        if result.status == 304 and entry is not None:
+            self._count('revalidated')
+            entry.expires = now + self._lifetime(result, default=self.get_ttl())
+            return entry.result, entry.content
+
+        self._count('misses')
+        if entry is not None:
+            self._discard(key)
+        if result.status == 200:
+            lifetime = self._lifetime(result, default=self.get_ttl())
+            if lifetime > 0 and len(content) <= self.get_max_size() / 10:
+                params = dict(_parameters(url))
+                layers = set()
+                for name in LAYER_PARAMETERS:
+                    layers.update(l for l in params.get(name, '').split(',') if l)
+                entry = CachedEntry(result, content, now + lifetime,
+                                    params.get('request', '').lower(), layers)
+                self._store(key, entry)
+                return entry.result, entry.content
+        return result, content
+
+    def response(self, request, result, content):
+        """Build the response to the client, a 304 if the validators it sent
+           match the ones of the response.
+        """
+        etag = result.get('etag')
+        last_modified = result.get('last-modified')
+        if result.status == 200 and self._not_modified(request, etag, last_modified):
+            self._count('not_modified')
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(
+                content,
+                status=result.status,
+                content_type=result.get('content-type', 'text/plain'))
+        for name, value in (('ETag', etag),
+                            ('Last-Modified', last_modified),
+                            ('Cache-Control', result.get('cache-control'))):
+            if value:
+                response[name] = value
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def invalidate(self, layers, operations=None):
+        """Drop the entries of the requests about any of ``layers``, only the
+           ones of ``operations`` if given.
+        """
+        layers = set(layers)
+        operations = operations and set(op.lower() for op in operations)
+        with self._lock:
+            for key, entry in self._entries.items():
+                if entry.layers & layers and (not operations or entry.operation in operations):
+                    del self._entries[key]
+                    self._size -= entry.size
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self._entries)
+            stats['size'] = self._size
+        lookups = stats['hits'] + stats['revalidated'] + stats['misses']
+        stats['hit_rate'] = float(stats['hits'] + stats['revalidated']) / lookups if lookups else 0.0
+        return stats
+
+    def _lifetime(self, result, default):
+        directives = {}
+        for directive in result.get('cache-control', '').split(','):
+            name, _, value = directive.strip().partition('=')
+            directives[name.lower()] = value.strip('"')
+        if 'no-store' in directives or 'no-cache' in directives or 'private' in directives:
+            return 0
+        for name in ('s-maxage', 'max-age'):
+            if name in directives:
+                try:
+                    return int(directives[name])
+                except ValueError:
+                    return 0
+        return default
+
+    def _not_modified(self, request, etag, last_modified):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return etag is not None and (etag in tags or '*' in tags)
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        modified = parse_http_date_safe(last_modified or '')
+        return None not in (if_modified_since, modified) and modified <= if_modified_since
+
+    def _store(self, key, entry):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous.size
+            self._entries[key] = entry
+            self._size += entry.size
+            while self._size > self.get_max_size() and self._entries:
+                dropped_key, dropped = self._entries.popitem(last=False)
+                self._size -= dropped.size
+                self.counters['evictions'] += 1
+
+    def _discard(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size -= entry.size
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+
+proxy_cache = ProxyCache()
@@ -64,3 +64,47 @@ class ProxyTest(TestCase):
         c = Client()
         response = c.get('/proxy?url=%s' % self.url, follow=True)
         self.assertEqual(response.status_code, 200)
+
+    def test_cache_key(self):
+        """Only the allowed OGC operations are cached, under the normalised URL
+        and the permissions of the user when the session is forwarded."""
+        from django.contrib.auth.models import AnonymousUser
+        from django.test.client import RequestFactory
+        from geonode.proxy.cache import ProxyCache
+
+        cache = ProxyCache(operations=('GetCapabilities',))
+        request = RequestFactory().get('/proxy/')
+        request.user = AnonymousUser()
+
+        key = cache.key(request, 'http://Example.com/wms?service=WMS&request=GetCapabilities')
+        self.assertEqual(key, cache.key(request, 'http://example.com/wms?REQUEST=GetCapabilities&SERVICE=WMS'))
+        self.assertNotEqual(key, cache.key(request, 'http://example.com/wms?service=WMS&request=GetCapabilities',
+                                           forward_cookie=True))
+        self.assertEqual(cache.key(request, 'http://example.com/wms?service=WMS&request=GetMap'), None)
+
+        request = RequestFactory().post('/proxy/')
+        request.user = AnonymousUser()
+        self.assertEqual(cache.key(request, 'http://example.com/wms?service=WMS&request=GetCapabilities'), None)
+
+    def test_cache_lifetime(self):
+        """The upstream Cache-Control header sets the lifetime of the entries."""
+        from geonode.proxy.cache import ProxyCache
+
+        cache = ProxyCache()
+        self.assertEqual(cache._lifetime({}, default=300), 300)
+        self.assertEqual(cache._lifetime({'cache-control': 'public, max-age=60'}, default=300), 60)
+        self.assertEqual(cache._lifetime({'cache-control': 'max-age=60, s-maxage=30'}, default=300), 30)
+        self.assertEqual(cache._lifetime({'cache-control': 'no-store'}, default=300), 0)
+
+    def test_cache_invalidate(self):
+        """The entries of the requests about a layer can be dropped."""
+        from geonode.proxy.cache import CachedEntry, ProxyCache
+
+        cache = ProxyCache()
+        cache._store('legend', CachedEntry({}, 'png', 0, 'getlegendgraphic', ['geonode:a']))
+        cache._store('capabilities', CachedEntry({}, 'xml', 0, 'getcapabilities', ['geonode:a']))
+        cache._store('other', CachedEntry({}, 'png', 0, 'getlegendgraphic', ['geonode:b']))
+
+        cache.invalidate(['geonode:a'], operations=['GetLegendGraphic'])
+        self.assertEqual(sorted(cache._entries), ['capabilities', 'other'])
+        self.assertEqual(cache.stats()['size'], 6)
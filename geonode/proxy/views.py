@@ -19,12 +19,14 @@
 #########################################################################
 
 from django.http import HttpResponse
-from httplib import HTTPConnection, HTTPSConnection
 from urlparse import urlsplit
 from django.conf import settings
 from django.utils.http import is_safe_url
 from django.http.request import validate_host
 
+from geonode.utils import http_client, streaming_response
+from geonode.proxy.cache import proxy_cache
+
 
 def proxy(request):
     PROXY_ALLOWED_HOSTS = getattr(settings, 'PROXY_ALLOWED_HOSTS', ())
@@ -45,11 +47,6 @@ def proxy(request):
 
     raw_url = request.GET['url']
     url = urlsplit(raw_url)
-    locator = url.path
-    if url.query != "":
-        locator += '?' + url.query
-    if url.fragment != "":
-        locator += '#' + url.fragment
 
     if not settings.DEBUG:
         if not validate_host(url.hostname, PROXY_ALLOWED_HOSTS):
@@ -60,33 +57,45 @@ def proxy(request):
                                 )
     headers = {}
 
-    if settings.SESSION_COOKIE_NAME in request.COOKIES and is_safe_url(url=raw_url, host=host):
+    forward_cookie = settings.SESSION_COOKIE_NAME in request.COOKIES and is_safe_url(url=raw_url, host=host)
+    if forward_cookie:
         headers["Cookie"] = request.META["HTTP_COOKIE"]
 
     if request.method in ("POST", "PUT") and "CONTENT_TYPE" in request.META:
         headers["Content-Type"] = request.META["CONTENT_TYPE"]
 
-    if url.scheme == 'https':
-        conn = HTTPSConnection(url.hostname, url.port)
-    else:
-        conn = HTTPConnection(url.hostname, url.port)
-    conn.request(request.method, locator, request.body, headers)
+    cache_key = None
+    if getattr(settings, 'PROXY_CACHE', False):
+        cache_key = proxy_cache.key(request, raw_url, forward_cookie)
 
-    result = conn.getresponse()
+    streaming = cache_key is None and getattr(settings, 'PROXY_STREAMING', True)
+    if cache_key is not None:
+        result, content = proxy_cache.request(cache_key, raw_url, headers)
+    elif streaming:
+        headers["Accept-Encoding"] = request.META.get("HTTP_ACCEPT_ENCODING", "identity")
+        result, content = http_client.stream(raw_url, request.method, request.body, headers)
+    else:
+        result, content = http_client.request(raw_url, request.method, request.body, headers, redirections=0)
 
     # If we get a redirect, let's add a useful message.
     if result.status in (301, 302, 303, 307):
+        if streaming:
+            content.close()
         response = HttpResponse(('This proxy does not support redirects. The server in "%s" '
-                                 'asked for a redirect to "%s"' % (url, result.getheader('Location'))),
+                                 'asked for a redirect to "%s"' % (url, result.get('location'))),
                                 status=result.status,
-                                content_type=result.getheader("Content-Type", "text/plain")
+                                content_type=result.get("content-type", "text/plain")
                                 )
 
-        response['Location'] = result.getheader('Location')
+        response['Location'] = result.get('location')
+    elif cache_key is not None:
+        response = proxy_cache.response(request, result, content)
+    elif streaming:
+        response = streaming_response(result, content)
     else:
         response = HttpResponse(
-            result.read(),
+            content,
             status=result.status,
-            content_type=result.getheader("Content-Type", "text/plain"))
+            content_type=result.get("content-type", "text/plain"))
 
     return response
@@ -18,11 +18,18 @@
 #
 #########################################################################
 
+import time
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import models
+from django.db.models import signals
 
 from django.contrib.auth import login
 from django.contrib.auth.models import Group
 
+from guardian.models import UserObjectPermission, GroupObjectPermission
 from guardian.shortcuts import assign_perm, remove_perm, \
     get_groups_with_perms, get_users_with_perms
 
@@ -33,6 +40,206 @@ ADMIN_PERMISSIONS = [
     'change_resourcebase_permissions'
 ]
 
+ACL_VERSION_KEY = 'security:acl_version'
+
+
+def acl_version():
+    """
+    Return the version of the permissions, which changes every time the
+    permissions on a resource or the members of a group change.
+
+    The caches of anything derived from the permissions include it in their
+    keys, so bumping it invalidates all of them at once.
+    """
+    version = cache.get(ACL_VERSION_KEY)
+    if version is None:
+        # start from the clock so that a version lost by the cache
+        # does not reuse the keys of stale entries
+        version = int(time.time() * 1000)
+        if not cache.add(ACL_VERSION_KEY, version, 60 * 60 * 24 * 30):
+            version = cache.get(ACL_VERSION_KEY, version)
+    return version
+
+
+def invalidate_acls(*args, **kwargs):
+    """
+    Bump the permissions version. The arguments are ignored so that it can be
+    connected to signals directly.
+    """
+    try:
+        cache.incr(ACL_VERSION_KEY)
+    except ValueError:
+        cache.set(ACL_VERSION_KEY, int(time.time() * 1000), 60 * 60 * 24 * 30)
+
+
+class ResourceVisibility(models.Model):
+
+    """
+    Materialised index of the principals allowed to view a resource: the
+    anonymous principal, groups and users holding the view permission.
+
+    The rows mirror the guardian permissions, they are kept up to date by
+    the signals of the permission models. The principals of a user are
+    resolved from its groups when searching, so that the changes of the
+    group members do not touch the index.
+    """
+
+    resource = models.ForeignKey('base.ResourceBase', related_name='visibility')
+    principal = models.CharField(max_length=40, db_index=True)
+
+    class Meta:
+        unique_together = (('resource', 'principal'),)
+
+
+VIEW_PERMISSION = 'view_resourcebase'
+
+
+def user_principal(user_id):
+    if user_id == settings.ANONYMOUS_USER_ID:
+        return 'anonymous'
+    return 'user-%d' % user_id
+
+
+def group_principal(group):
+    if group.name == 'anonymous':
+        return 'anonymous'
+    return 'group-%d' % group.pk
+
+
+def user_principals(user):
+    """
+    Return the principals whose visibility rows grant ``user`` the view
+    permission, None if it can view every resource.
+    """
+    if user.is_superuser or user.has_perm('base.%s' % VIEW_PERMISSION):
+        return None
+    principals = ['anonymous']
+    if user.is_authenticated():
+        principals.append(user_principal(user.pk))
+        principals.extend('group-%d' % pk for pk in user.groups.exclude(
+            name='anonymous').values_list('pk', flat=True))
+    return principals
+
+
+def visible_resources(user, queryset):
+    """Filter ``queryset`` of resources down to the ones ``user`` can
+       view.
+    """
+    return filter_principals(queryset, user_principals(user))
+
+
+def filter_principals(queryset, principals):
+    """Filter ``queryset`` of resources down to the ones visible by any of
+       ``principals``, as returned by ``user_principals``.
+    """
+    if principals is None:
+        return queryset
+    return queryset.filter(id__in=ResourceVisibility.objects.filter(
+        principal__in=principals).values('resource'))
+
+
+def resource_principals(resource_id):
+    """Return the principals allowed to view a resource, as indexed.
+    """
+    return list(ResourceVisibility.objects.filter(
+        resource=resource_id).values_list('principal', flat=True))
+
+
+def rebuild_visibility(resources=None):
+    """
+    Build the visibility rows of ``resources``, a queryset of
+    ``ResourceBase``, or of the whole catalogue from the guardian
+    permissions. Returns the number of rows.
+    """
+    from geonode.base.models import ResourceBase
+
+    rows = ResourceVisibility.objects.all()
+    user_perms = UserObjectPermission.objects.filter(permission__codename=VIEW_PERMISSION)
+    group_perms = GroupObjectPermission.objects.filter(permission__codename=VIEW_PERMISSION)
+    if resources is None:
+        resources = ResourceBase.objects.all()
+    else:
+        object_pks = [str(pk) for pk in resources.values_list('id', flat=True)]
+        rows = rows.filter(resource__in=resources)
+        user_perms = user_perms.filter(object_pk__in=object_pks)
+        group_perms = group_perms.filter(object_pk__in=object_pks)
+    # the permissions are not removed with the resources
+    existing = set(resources.values_list('id', flat=True))
+
+    index = set()
+    for object_pk, user_id in user_perms.values_list('object_pk', 'user'):
+        index.add((int(object_pk), user_principal(user_id)))
+    for object_pk, group_id, name in group_perms.values_list('object_pk', 'group', 'group__name'):
+        index.add((int(object_pk), 'anonymous' if name == 'anonymous' else 'group-%d' % group_id))
+    index = [(pk, principal) for pk, principal in index if pk in existing]
+
+    rows.delete()
+    ResourceVisibility.objects.bulk_create(
+        [ResourceVisibility(resource_id=pk, principal=principal) for pk, principal in index],
+        batch_size=1000)
+    return len(index)
+
+
+def reindex_resource(resource):
+    """Update the search document of a resource, whose visibility is
+       stored with it.
+    """
+    if not getattr(settings, 'HAYSTACK_SEARCH', False):
+        return
+    from haystack import connections
+    from haystack.exceptions import NotHandled
+    instance = resource.get_real_instance() if hasattr(resource, 'get_real_instance') else resource
+    try:
+        index = connections['default'].get_unified_index().get_index(instance.__class__)
+    except NotHandled:
+        return
+    index.update_object(instance)
+
+
+def _anonymous_view(object_pk):
+    # the anonymous principal stands for the guardian anonymous user and
+    # for the anonymous group
+    return UserObjectPermission.objects.filter(
+        permission__codename=VIEW_PERMISSION, object_pk=object_pk,
+        user=settings.ANONYMOUS_USER_ID).exists() or GroupObjectPermission.objects.filter(
+        permission__codename=VIEW_PERMISSION, object_pk=object_pk,
+        group__name='anonymous').exists()
+
+
+def _index_permission(instance, principal, created):
+    if instance.permission.codename != VIEW_PERMISSION:
+        return
+    rows = ResourceVisibility.objects.filter(resource=instance.object_pk, principal=principal)
+    if not created:
+        if principal != 'anonymous' or not _anonymous_view(instance.object_pk):
+            rows.delete()
+    elif not rows.exists():
+        ResourceVisibility.objects.create(resource_id=instance.object_pk, principal=principal)
+
+
+def user_permission_post_save(instance, sender, **kwargs):
+    if kwargs.get('created') and not kwargs.get('raw'):
+        _index_permission(instance, user_principal(instance.user_id), True)
+
+
+def user_permission_post_delete(instance, sender, **kwargs):
+    _index_permission(instance, user_principal(instance.user_id), False)
+
+
+def group_permission_post_save(instance, sender, **kwargs):
+    if kwargs.get('created') and not kwargs.get('raw'):
+        _index_permission(instance, group_principal(instance.group), True)
+
+
+def group_permission_post_delete(instance, sender, **kwargs):
+    _index_permission(instance, group_principal(instance.group), False)
+
+
+signals.post_save.connect(user_permission_post_save, sender=UserObjectPermission)
+signals.post_delete.connect(user_permission_post_delete, sender=UserObjectPermission)
+signals.post_save.connect(group_permission_post_save, sender=GroupObjectPermission)
+signals.post_delete.connect(group_permission_post_delete, sender=GroupObjectPermission)
+
 
 class PermissionLevelError(Exception):
     pass
@@ -79,6 +286,8 @@ class PermissionLevelMixin(object):
             for perm in perms:
                 remove_perm(perm, group, self.get_self_resource())
 
+        invalidate_acls()
+
     def set_default_permissions(self):
         """
         Remove all the permissions except for the owner and assign the
@@ -92,6 +301,9 @@ class PermissionLevelMixin(object):
         for perm in ADMIN_PERMISSIONS:
             assign_perm(perm, self.owner, self.get_self_resource())
 
+        invalidate_acls()
+        reindex_resource(self)
+
     def set_permissions(self, perm_spec):
         """
         Sets an object's the permission levels based on the perm_spec JSON.
@@ -133,6 +345,9 @@ class PermissionLevelMixin(object):
                 for perm in perms:
                     assign_perm(perm, group, self.get_self_resource())
 
+        invalidate_acls()
+        reindex_resource(self)
+
 
 # Logic to login a user automatically when it has successfully
 # activated an account:
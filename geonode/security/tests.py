@@ -0,0 +1,46 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser, Group
+from django.test import TestCase
+
+from geonode.base.models import ResourceBase
+from geonode.base.populate_test_data import create_models, all_public
+from geonode.layers.models import Layer
+from geonode.security.models import ResourceVisibility, resource_principals, \
+    user_principals, visible_resources, rebuild_visibility
+
+
+class VisibilityTests(TestCase):
+
+    fixtures = ['initial_data.json', 'bobby']
+
+    def setUp(self):
+        create_models(type='layer')
+        all_public()
+        self.bobby = get_user_model().objects.get(username='bobby')
+
+    def test_visibility_index(self):
+        layer = Layer.objects.all()[0]
+        owner = 'user-%d' % layer.owner.pk
+        self.assertEquals(set(resource_principals(layer.pk)), set(['anonymous', owner]))
+
+        layer.set_permissions({'users': {'bobby': ['view_resourcebase']}})
+        self.assertEquals(set(resource_principals(layer.pk)),
+                          set([owner, 'user-%d' % self.bobby.pk]))
+        resources = ResourceBase.objects.all()
+        self.assertFalse(visible_resources(AnonymousUser(), resources).filter(pk=layer.pk).exists())
+        self.assertTrue(visible_resources(self.bobby, resources).filter(pk=layer.pk).exists())
+
+        group = Group.objects.create(name='editors')
+        layer.set_permissions({'groups': {'editors': ['view_resourcebase']}})
+        self.assertFalse(visible_resources(self.bobby, resources).filter(pk=layer.pk).exists())
+        # the members of the groups are resolved when searching
+        self.bobby.groups.add(group)
+        self.assertIn('group-%d' % group.pk, user_principals(self.bobby))
+        self.assertTrue(visible_resources(self.bobby, resources).filter(pk=layer.pk).exists())
+        group.delete()
+        self.assertEquals(resource_principals(layer.pk), [owner])
+
+        rows = set(ResourceVisibility.objects.values_list('resource', 'principal'))
+        ResourceVisibility.objects.all().delete()
+        rebuild_visibility()
+        self.assertEquals(set(ResourceVisibility.objects.values_list('resource', 'principal')), rows)
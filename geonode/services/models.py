@@ -113,8 +113,12 @@ def post_save_service(instance, sender, created, **kwargs):
 
 
 def pre_delete_service(instance, sender, **kwargs):
-    for layer in instance.layer_set.all():
-        layer.delete()
+    if 'geonode.geoserver' in settings.INSTALLED_APPS:
+        from geonode.geoserver.helpers import delete_layers
+        delete_layers(instance.layer_set.all())
+    else:
+        for layer in instance.layer_set.all():
+            layer.delete()
     # if instance.method == 'H':
     #     gn = Layer.objects.gn_catalog
     #     gn.control_harvesting_task('stop', [instance.external_id])
@@ -396,6 +396,54 @@ SITEURL = "http://localhost:8000/"
 
 USE_QUEUE = False
 
+# Number of threads running the background jobs of GeoNode, like the
+# computation of the attribute statistics. Set to 0 to run the jobs
+# synchronously.
+BACKGROUND_WORKERS = 2
+
+# Synchronise the layers with GeoServer (links, thumbnail, attributes and
+# styles) in a background job after they are saved instead of during the
+# request. The status of the job is available at /gs/<layername>/sync.
+GEOSERVER_DEFERRED_POST_SAVE = False
+
+# Engine computing the attribute statistics of the layers: 'wps' uses the
+# GeoServer WPS processes, 'local' reads the features once and aggregates
+# all the attributes with NumPy.
+ATTRIBUTE_STATISTICS_ENGINE = 'wps'
+
+# The credentials sent by GeoServer to the resolve_user and layer_acls views
+# are verified once, then trusted for CREDENTIALS_CACHE_TTL seconds while
+# the user stays active and keeps the same password. Set to 0 to disable.
+CREDENTIALS_CACHE_TTL = 60
+CREDENTIALS_CACHE_SIZE = 1000
+
+# Relay the responses of the proxy views in chunks as they are received
+# instead of reading them whole into memory.
+PROXY_STREAMING = True
+
+# Cache the GET requests of these OGC operations sent through the proxy, in
+# memory and up to PROXY_CACHE_SIZE bytes. The responses are kept for as
+# long as their Cache-Control header allows, PROXY_CACHE_TTL seconds if it
+# does not say.
+PROXY_CACHE = False
+PROXY_CACHE_OPERATIONS = (
+    'GetCapabilities',
+    'GetLegendGraphic',
+    'DescribeFeatureType',
+    'DescribeCoverage',
+    'DescribeLayer',
+)
+PROXY_CACHE_TTL = 300
+PROXY_CACHE_SIZE = 32 * 1024 * 1024
+
+# The batch downloads of layers and maps are built by background jobs
+# fetching BATCH_DOWNLOAD_WORKERS layers at once from GeoServer. The archives
+# are written to BATCH_DOWNLOAD_ROOT (a directory of the system temporary
+# directory by default) and reused for BATCH_DOWNLOAD_CACHE_TTL seconds
+# while the layers do not change.
+BATCH_DOWNLOAD_WORKERS = 4
+BATCH_DOWNLOAD_CACHE_TTL = 24 * 60 * 60
+
 DEFAULT_WORKSPACE = 'geonode'
 CASCADE_WORKSPACE = 'geonode'
 
@@ -431,7 +479,23 @@ OGC_SERVER = {
         'WPS_ENABLED': True,
         # Set to name of database in DATABASES dictionary to enable
         'DATASTORE': '',  # 'datastore',
-        'TIMEOUT': 10  # number of seconds to allow for HTTP requests
+        'TIMEOUT': 10,  # number of seconds to allow for HTTP requests
+        'MAX_RETRIES': 2,  # retries of the requests failing with a connection error
+        'POOL_MAXSIZE': 10,  # maximum number of concurrent connections to GeoServer
+        'CATALOG_CACHE_TTL': 10,  # seconds the catalog objects looked up by name are cached
+        'CAPABILITIES_CACHE_TTL': 300,  # seconds before the cached capabilities are revalidated
+        'ACL_CACHE_TTL': 300,  # seconds the layer ACLs of a user or group are cached
+        # Truncate the GeoWebCache tiles of the layers after their data or style changed
+        'GWC_TRUNCATE_ENABLED': True,
+        # Seed the GeoWebCache tiles of the layers after an upload or a replace
+        'GWC_SEED_ENABLED': False,
+        'GWC_SEED_GRIDSETS': ('EPSG:900913',),  # gridsets seeded
+        'GWC_SEED_FORMAT': 'image/png',
+        'GWC_SEED_ZOOM_START': 0,  # first and last zoom levels seeded
+        'GWC_SEED_ZOOM_STOP': 10,
+        'GWC_SEED_THREADS': 1,  # threads of every GeoWebCache seeding task
+        'GWC_SEED_PRIORITY': 0,  # the jobs with the highest priority are sent first
+        'GWC_SEED_MAX_TASKS': 2,  # seeding tasks run by GeoWebCache at once
     }
 }
 
@@ -610,6 +674,8 @@ HAYSTACK_SEARCH = False
 SKIP_PERMS_FILTER = False
 # Update facet counts from Haystack
 HAYSTACK_FACET_COUNTS = False
+# Seconds the search facets of the anonymous users are cached, 0 disables it
+SEARCH_FACETS_CACHE_TTL = 60
 # HAYSTACK_CONNECTIONS = {
 #    'default': {
 #        'ENGINE': 'haystack.backends.elasticsearch_backend.ElasticsearchSearchEngine',
@@ -647,6 +713,8 @@ TASTYPIE_DEFAULT_FORMATS = ['json']
 
 # gravatar settings
 AUTO_GENERATE_AVATAR_SIZES = (20, 32, 80, 100, 140, 200)
+# Seconds the avatar urls listed by the apis are cached
+AVATAR_URL_CACHE_TTL = 60 * 60
 
 # Number of results per page listed in the GeoNode search pages
 CLIENT_RESULTS_LIMIT = 100
@@ -654,6 +722,10 @@ CLIENT_RESULTS_LIMIT = 100
 # Number of items returned by the apis 0 equals no limit
 API_LIMIT_PER_PAGE = 0
 
+# Seconds the counts of the keywords and categories listed by the apis are
+# cached for the users seeing the same resources
+API_COUNTS_CACHE_TTL = 60
+
 LEAFLET_CONFIG = {
     'TILES': [
         # Find tiles at:
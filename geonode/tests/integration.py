@@ -42,8 +42,9 @@ from geonode.layers.utils import (
 )
 from .utils import check_layer, get_web_page
 
-from geonode.geoserver.helpers import cascading_delete
+from geonode.geoserver.helpers import cascading_delete, delete_layers
 from geonode.geoserver.signals import gs_catalog
+from geonode.geoserver.thumbnails import render_layer_thumbnail, thumbnail_workers
 
 import gisdata
 
@@ -482,6 +483,22 @@ class GeoNodeMapTest(TestCase):
         # Clean up by deleting the layer from GeoNode's DB and GeoNetwork
         shp_layer.delete()
 
+    def test_delete_layers(self):
+        """Verify that helpers.delete_layers() removes a batch of layers from
+        GeoServer and GeoNode
+        """
+        layers = [file_upload(os.path.join(gisdata.VECTOR_DATA, name))
+                  for name in ('san_andres_y_providencia_poi.shp',
+                               'san_andres_y_providencia_highway.shp')]
+        names = [layer.name for layer in layers]
+
+        output = delete_layers(layers)
+        self.assertEquals([info['status'] for info in output], ['delete_succeeded'] * 2)
+
+        for name in names:
+            self.assertEquals(gs_catalog.get_layer(name), None)
+            self.assertFalse(Layer.objects.filter(name=name).exists())
+
     def test_keywords_upload(self):
         """Check that keywords can be passed to file_upload
         """
@@ -621,11 +638,19 @@ class GeoNodeThumbnailTest(TestCase):
             user=norman,
             overwrite=True,
         )
+        # the thumbnail is rendered in the background
+        thumbnail_workers.join()
 
         thumbnail_url = saved_layer.get_thumbnail_url()
 
         assert thumbnail_url != staticfiles.static(settings.MISSING_THUMBNAIL)
 
+        # it is not rendered again while its inputs do not change
+        saved_layer = Layer.objects.get(pk=saved_layer.pk)
+        self.assertFalse(render_layer_thumbnail(saved_layer))
+        self.assertTrue(render_layer_thumbnail(saved_layer, force=True))
+        self.assertEquals(saved_layer.get_thumbnail_url(), thumbnail_url)
+
     def test_map_thumbnail(self):
         """Test the map save method generates a thumbnail link
         """
@@ -647,6 +672,8 @@ class GeoNodeThumbnailTest(TestCase):
         map_obj = Map(owner=norman, zoom=0,
                       center_x=0, center_y=0)
         map_obj.create_from_layer_list(norman, [saved_layer], 'title', '')
+        # the thumbnail is composed in the background
+        thumbnail_workers.join()
 
         thumbnail_url = map_obj.get_thumbnail_url()
 
@@ -257,6 +257,156 @@ class GeoNodeUtilsTests(TestCase):
         self.assertEqual(keywords[1], "beta gamma")
         self.assertEqual(keywords[2], "delta")
 
+    def test_http_transport(self):
+        """Tests that the transport reuses its connections, decompresses the
+        responses and only sends the credentials to the configured hosts.
+        """
+        import gzip
+        import zlib
+        import threading
+        from StringIO import StringIO
+        from SocketServer import ThreadingMixIn
+        from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+        from geonode.utils import HttpTransport
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                buf = StringIO()
+                f = gzip.GzipFile(fileobj=buf, mode='wb')
+                f.write(self.headers.get('Authorization', 'anonymous'))
+                f.close()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(buf.getvalue())))
+                self.end_headers()
+                self.wfile.write(buf.getvalue())
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        server = Server(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            netloc = '127.0.0.1:%d' % server.server_port
+            transport = HttpTransport(credentials=('admin', 'geoserver'), auth_hosts=[netloc])
+            for i in range(3):
+                response, content = transport.request('http://%s/wms' % netloc)
+                self.assertEqual(response.status, 200)
+                self.assertEqual(response['content-type'], 'text/plain')
+                self.assertEqual(content, 'Basic YWRtaW46Z2Vvc2VydmVy')
+
+            stats = transport.stats()
+            self.assertEqual(stats['requests'], 3)
+            self.assertEqual(stats['connections'], 1)
+            self.assertEqual(stats['errors'], 0)
+
+            # the streamed bodies are relayed as sent, on the same connection
+            response, body = transport.stream('http://%s/wms' % netloc, chunk_size=8)
+            self.assertEqual(response['content-encoding'], 'gzip')
+            self.assertEqual(zlib.decompress(''.join(body), 16 + zlib.MAX_WBITS),
+                             'Basic YWRtaW46Z2Vvc2VydmVy')
+            self.assertEqual(transport.stats()['connections'], 1)
+
+            transport.auth_hosts = set()
+            self.assertEqual(transport.request('http://%s/wms' % netloc)[1], 'anonymous')
+        finally:
+            transport.close()
+            server.shutdown()
+            server.server_close()
+
+    def test_http_transport_retries(self):
+        """Tests that only the requests that were not processed or are safe
+        to repeat are sent again.
+        """
+        import errno
+        import socket
+        import httplib
+        from geonode.utils import HttpTransport
+
+        transport = HttpTransport()
+        reset = socket.error(errno.ECONNRESET, 'Connection reset by peer')
+        self.assertTrue(transport.can_retry('POST', reset, True, False))
+        self.assertFalse(transport.can_retry('POST', reset, True, True))
+        self.assertTrue(transport.can_retry('POST', httplib.BadStatusLine("''"), True, True))
+        self.assertFalse(transport.can_retry('POST', httplib.BadStatusLine("''"), False, True))
+        self.assertFalse(transport.can_retry('POST', socket.timeout(), True, True))
+        self.assertFalse(transport.can_retry('PUT', socket.timeout(), True, True))
+        self.assertTrue(transport.can_retry('GET', socket.timeout(), True, True))
+        self.assertTrue(transport.can_retry('DELETE', reset, False, True))
+
+    def test_worker_pool_rerun(self):
+        """Tests that a job submitted while another one with the same key is
+        running is run again once that one finishes, and never at the same
+        time.
+        """
+        import threading
+        from geonode.workers import WorkerPool
+
+        pool = WorkerPool('test', size=2, retries=0)
+        started = threading.Event()
+        release = threading.Event()
+        lock = threading.Lock()
+        state = dict(running=0, concurrent=0, calls=[])
+
+        def job(value):
+            with lock:
+                state['running'] += 1
+                state['concurrent'] = max(state['concurrent'], state['running'])
+                state['calls'].append(value)
+            started.set()
+            release.wait(5)
+            with lock:
+                state['running'] -= 1
+
+        self.assertTrue(pool.submit('layer', job, 1))
+        self.assertTrue(started.wait(5))
+        self.assertTrue(pool.submit('layer', job, 2))
+        self.assertFalse(pool.submit('layer', job, 3))
+        self.assertTrue(pool.is_pending('layer'))
+        release.set()
+        pool.join()
+        # the job queued again runs with the latest arguments
+        self.assertEqual(state['calls'], [1, 3])
+        self.assertEqual(state['concurrent'], 1)
+        self.assertFalse(pool.is_pending('layer'))
+        self.assertEqual(pool.stats()['completed'], 2)
+
+    def test_credentials_cache(self):
+        """Tests that the verified credentials are cached until the password
+        changes or the user is deactivated.
+        """
+        from django.contrib.auth import get_user_model
+        from geonode.utils import CredentialCache
+
+        user = get_user_model().objects.create_user('cached', 'cached@example.com', 'secret')
+        credentials = CredentialCache(ttl=60, size=10)
+
+        self.assertEqual(credentials.authenticate('cached', 'secret'), user)
+        self.assertEqual(credentials.authenticate('cached', 'secret'), user)
+        self.assertEqual(credentials.authenticate('cached', 'wrong'), None)
+        stats = credentials.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['size'], 1)
+
+        user.set_password('changed')
+        user.save()
+        self.assertEqual(credentials.authenticate('cached', 'secret'), None)
+        self.assertEqual(credentials.authenticate('cached', 'changed'), user)
+
+        user.is_active = False
+        user.save()
+        credentials.authenticate('cached', 'changed')
+        self.assertEqual(credentials.stats()['size'], 0)
+
 
 class PermissionViewTests(TestCase):
     pass
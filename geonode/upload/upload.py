@@ -489,7 +489,7 @@ def final_step(upload_session, user):
     # chosen
 
     cat = gs_catalog
-    cat._cache.clear()
+    cat.clear_cache()
 
     # Create the style and assign it to the created resource
     # FIXME: Put this in gsconfig.py
@@ -553,7 +553,7 @@ def final_step(upload_session, user):
 
     # @todo hacking - any cached layers might cause problems (maybe
     # delete hook on layer should fix this?)
-    cat._cache.clear()
+    cat.clear_cache()
 
     defaults = dict(store=target.name,
                     storeType=target.store_type,
@@ -17,18 +17,31 @@
 #
 #########################################################################
 
-import httplib2
+import os
+import hmac
+import errno
 import base64
+import hashlib
 import math
 import copy
 import string
+import socket
+import time
+import zlib
+import Queue
+import httplib
+import threading
+
+from urlparse import urlsplit, urljoin
+from collections import OrderedDict
 
 from django.conf import settings
+from django.contrib.auth import authenticate, get_user_model
 from django.core.exceptions import PermissionDenied
 from django.utils.translation import ugettext_lazy as _
 from django.shortcuts import get_object_or_404
 from django.utils import simplejson as json
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.core.cache import cache
 
 DEFAULT_TITLE = ""
@@ -42,7 +55,316 @@ ALPHABET_REVERSE = dict((c, i) for (i, c) in enumerate(ALPHABET))
 BASE = len(ALPHABET)
 SIGN_CHARACTER = '$'
 
-http_client = httplib2.Http()
+
+class HttpTransportResponse(dict):
+
+    """
+    Headers of a response sent through an ``HttpTransport``, with the
+    attributes of ``httplib2.Response``.
+    """
+
+    def __init__(self, response):
+        super(HttpTransportResponse, self).__init__(
+            (key.lower(), value) for key, value in response.getheaders())
+        self.status = response.status
+        self.reason = response.reason
+        self.version = response.version
+        self['status'] = str(self.status)
+
+
+class _HostPool(object):
+
+    """
+    Keep-alive connections to a host, at most ``size`` are used at once.
+    """
+
+    def __init__(self, scheme, netloc, size, timeout):
+        self.scheme = scheme
+        self.netloc = netloc
+        self.size = size
+        self.timeout = timeout
+        self.idle = Queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.in_use = 0
+
+    def acquire(self):
+        """Return a connection, whether it was used before and whether the
+           caller had to wait for it because the pool was saturated.
+        """
+        waited = False
+        if not self.slots.acquire(False):
+            waited = True
+            self.slots.acquire()
+        with self.lock:
+            self.in_use += 1
+        try:
+            return self.idle.get_nowait(), True, waited
+        except Queue.Empty:
+            if self.scheme == 'https':
+                connection = httplib.HTTPSConnection(self.netloc, timeout=self.timeout)
+            else:
+                connection = httplib.HTTPConnection(self.netloc, timeout=self.timeout)
+            return connection, False, waited
+
+    def release(self, connection, reusable=True):
+        if reusable:
+            self.idle.put(connection)
+        else:
+            connection.close()
+        with self.lock:
+            self.in_use -= 1
+        self.slots.release()
+
+
+class HttpTransportStream(object):
+
+    """
+    Body of a response sent through an ``HttpTransport``, iterated in chunks
+    of ``chunk_size`` bytes. The connection goes back to its pool once the
+    body has been read, and is closed if the iteration is stopped early.
+    """
+
+    def __init__(self, transport, pool, connection, response, chunk_size):
+        self.transport = transport
+        self.pool = pool
+        self.connection = connection
+        self.response = response
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        try:
+            while True:
+                chunk = self.response.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        except (socket.error, httplib.HTTPException):
+            self.transport._count('errors')
+            self._release(reusable=False)
+            raise
+        self._release(reusable=not self.response.will_close)
+
+    def close(self):
+        self._release(reusable=False)
+
+    def _release(self, reusable):
+        pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.release(self.connection, reusable=reusable)
+
+
+class HttpTransport(object):
+
+    """
+    Thread safe HTTP client keeping a pool of keep-alive connections for
+    every host.
+
+    ``request`` has the signature of ``httplib2.Http.request`` and returns
+    a ``(response, content)`` tuple, so the transport can replace the
+    httplib2 clients of gsconfig and of the GeoServer helpers. Responses
+    are requested gzip encoded, requests failing with a connection error
+    are retried when they can be, and ``stats`` reports the number of
+    requests, their latency and how often the pools were saturated.
+
+    The Basic ``credentials`` are sent to the hosts in ``auth_hosts`` only.
+    """
+
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+    REDIRECT_CODES = (301, 302, 303, 307)
+
+    def __init__(self, timeout=None, retries=1, pool_size=10, credentials=None, auth_hosts=()):
+        self.timeout = timeout
+        self.retries = retries
+        self.pool_size = pool_size
+        self.credentials = credentials
+        self.auth_hosts = set(auth_hosts)
+        self._pools = {}
+        self._lock = threading.Lock()
+        self.counters = dict.fromkeys(
+            ['requests', 'errors', 'retries', 'connections', 'waits'], 0)
+        self.latency = 0.0
+
+    def add_credentials(self, name, password, domain=''):
+        self.credentials = (name, password)
+        if domain:
+            self.auth_hosts.add(domain)
+
+    def stats(self):
+        """Return the counters of the transport and the use of the pools.
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats['latency_total'] = self.latency
+            pools = self._pools.items()
+        stats['latency_avg'] = self.latency / stats['requests'] if stats['requests'] else 0
+        stats['hosts'] = dict(
+            ('%s://%s' % key, dict(in_use=pool.in_use, idle=pool.idle.qsize(), size=pool.size))
+            for key, pool in pools)
+        return stats
+
+    def close(self):
+        """Close the idle connections of all the pools.
+        """
+        with self._lock:
+            pools = self._pools.values()
+        for pool in pools:
+            while True:
+                try:
+                    pool.idle.get_nowait().close()
+                except Queue.Empty:
+                    break
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def _pool(self, scheme, netloc):
+        with self._lock:
+            pool = self._pools.get((scheme, netloc))
+            if pool is None:
+                pool = _HostPool(scheme, netloc, self.pool_size, self.timeout)
+                self._pools[(scheme, netloc)] = pool
+            return pool
+
+    def _headers(self, netloc, headers):
+        headers = dict((key.lower(), value) for key, value in (headers or {}).items())
+        headers.setdefault('accept-encoding', 'gzip, deflate')
+        if self.credentials and netloc in self.auth_hosts and 'authorization' not in headers:
+            headers['authorization'] = 'Basic ' + base64.b64encode('%s:%s' % tuple(self.credentials))
+        return headers
+
+    def can_retry(self, method, error, reused, sent):
+        """Tell whether a request that failed with ``error`` can be sent
+           again, ``sent`` if it was sent entirely.
+        """
+        if isinstance(error, socket.timeout):
+            # the server may still be processing the request
+            return method in self.SAFE_METHODS
+        if reused and (isinstance(error, httplib.BadStatusLine) or
+                       not sent and getattr(error, 'errno', None) in (errno.ECONNRESET, errno.EPIPE)):
+            # the keep-alive connection was closed by the server before it
+            # answered, the request was not processed whatever the method.
+            return True
+        return method in self.IDEMPOTENT_METHODS
+
+    def open(self, uri, method='GET', body=None, headers=None):
+        """Send a request and return ``(pool, connection, response)``, the
+           body of the response is not read. The connection must be given
+           back with ``pool.release`` once the response has been read.
+        """
+        scheme, netloc, path, query, fragment = urlsplit(uri)
+        headers = self._headers(netloc, headers)
+        path = (path or '/') + ('?' + query if query else '')
+        pool = self._pool(scheme, netloc)
+        # a file body can not be sent twice
+        retryable = not hasattr(body, 'read')
+
+        attempt = 0
+        while True:
+            connection, reused, waited = pool.acquire()
+            if waited:
+                self._count('waits')
+            if not reused:
+                self._count('connections')
+            sent = False
+            try:
+                connection.request(method, path, body, headers)
+                sent = True
+                response = connection.getresponse()
+            except (socket.error, httplib.HTTPException) as e:
+                pool.release(connection, reusable=False)
+                if retryable and attempt < self.retries and self.can_retry(method, e, reused, sent):
+                    attempt += 1
+                    self._count('retries')
+                    continue
+                self._count('errors')
+                raise
+            return pool, connection, response
+
+    def stream(self, uri, method='GET', body=None, headers=None, chunk_size=64 * 1024, redirections=0):
+        """Send a request and return the ``(response, body)`` tuple, where
+           ``body`` is an ``HttpTransportStream``. The body is relayed as
+           sent, the response is only compressed if the ``headers`` accept
+           it, and the GET and HEAD requests follow up to ``redirections``
+           redirects.
+        """
+        headers = dict((key.lower(), value) for key, value in (headers or {}).items())
+        headers.setdefault('accept-encoding', 'identity')
+        start = time.time()
+        try:
+            pool, connection, response = self.open(uri, method, body, headers)
+        finally:
+            with self._lock:
+                self.counters['requests'] += 1
+                self.latency += time.time() - start
+        info = HttpTransportResponse(response)
+        stream = HttpTransportStream(self, pool, connection, response, chunk_size)
+        if info.status in self.REDIRECT_CODES and 'location' in info and redirections > 0:
+            if method in ('GET', 'HEAD') or info.status == 303:
+                stream.close()
+                location = urljoin(uri, info['location'])
+                return self.stream(location, 'HEAD' if method == 'HEAD' else 'GET',
+                                   headers=headers, chunk_size=chunk_size,
+                                   redirections=redirections - 1)
+        return info, stream
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        """Send a request and return the ``(response, content)`` tuple, the
+           GET and HEAD requests follow up to ``redirections`` redirects.
+        """
+        start = time.time()
+        try:
+            pool, connection, response = self.open(uri, method, body, headers)
+            try:
+                content = response.read()
+            except (socket.error, httplib.HTTPException):
+                pool.release(connection, reusable=False)
+                self._count('errors')
+                raise
+            pool.release(connection, reusable=not response.will_close)
+        finally:
+            with self._lock:
+                self.counters['requests'] += 1
+                self.latency += time.time() - start
+
+        info = HttpTransportResponse(response)
+        encoding = info.get('content-encoding')
+        if encoding in ('gzip', 'deflate'):
+            if encoding == 'gzip':
+                content = zlib.decompress(content, 16 + zlib.MAX_WBITS)
+            else:
+                try:
+                    content = zlib.decompress(content)
+                except zlib.error:
+                    content = zlib.decompress(content, -zlib.MAX_WBITS)
+            info['content-length'] = str(len(content))
+            info['-content-encoding'] = info.pop('content-encoding')
+
+        if info.status in self.REDIRECT_CODES and 'location' in info and redirections > 0:
+            if method in ('GET', 'HEAD') or info.status == 303:
+                location = urljoin(uri, info['location'])
+                return self.request(location, 'HEAD' if method == 'HEAD' else 'GET',
+                                    headers=headers, redirections=redirections - 1)
+        return info, content
+
+
+http_client = HttpTransport()
+
+
+def streaming_response(response, body):
+    """Relay the ``(response, body)`` of ``HttpTransport.stream`` to the
+       client with their status, type, length and encoding.
+    """
+    streaming = StreamingHttpResponse(
+        body,
+        status=response.status,
+        content_type=response.get('content-type', 'text/plain'))
+    for header in ('Content-Length', 'Content-Encoding'):
+        if header.lower() in response:
+            streaming[header] = response[header.lower()]
+    return streaming
 
 
 def _get_basic_auth_info(request):
@@ -56,6 +378,107 @@ def _get_basic_auth_info(request):
     return username, password
 
 
+class CredentialCache(object):
+
+    """
+    Short lived, bounded cache of the credentials verified by
+    ``django.contrib.auth.authenticate``.
+
+    Hashing a password costs tens of milliseconds by design and the GeoServer
+    callbacks send the same Basic credentials with every request. The entries
+    are keyed by a digest of the credentials salted with a secret drawn when
+    the process starts, so the cache never holds the passwords themselves.
+
+    A hit costs a single query: the user is reloaded and the entry is only
+    used while the user is active and its password hash is the one that was
+    verified, so changing the password or deactivating the user takes effect
+    immediately. The least recently used entries are dropped beyond
+    ``size`` entries, and ``stats`` reports the hit rate.
+    """
+
+    def __init__(self, ttl=None, size=None):
+        self.ttl = ttl
+        self.size = size
+        self._salt = os.urandom(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = dict.fromkeys(['hits', 'misses', 'stale', 'evictions'], 0)
+
+    def get_ttl(self):
+        if self.ttl is not None:
+            return self.ttl
+        return getattr(settings, 'CREDENTIALS_CACHE_TTL', 60)
+
+    def get_size(self):
+        if self.size is not None:
+            return self.size
+        return getattr(settings, 'CREDENTIALS_CACHE_SIZE', 1000)
+
+    def _key(self, username, password):
+        return hmac.new(self._salt, '%s:%s' % (username, password), hashlib.sha256).digest()
+
+    def authenticate(self, username, password):
+        """Return the user the credentials belong to, or None.
+        """
+        if self.get_ttl() <= 0:
+            return authenticate(username=username, password=password)
+
+        key = self._key(username, password)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[3] > time.time():
+                self._entries[key] = entry
+            else:
+                entry = None
+
+        if entry is not None:
+            user_id, password_hash, backend, expires = entry
+            try:
+                user = get_user_model().objects.get(pk=user_id)
+            except get_user_model().DoesNotExist:
+                user = None
+            if user is not None and user.is_active and user.password == password_hash:
+                user.backend = backend
+                self._count('hits')
+                return user
+            self._count('stale')
+            self.forget(username, password)
+
+        self._count('misses')
+        user = authenticate(username=username, password=password)
+        if user is not None and user.is_active:
+            entry = (user.pk, user.password, user.backend, time.time() + self.get_ttl())
+            with self._lock:
+                self._entries[key] = entry
+                while len(self._entries) > self.get_size():
+                    self._entries.popitem(last=False)
+                    self.counters['evictions'] += 1
+        return user
+
+    def forget(self, username, password):
+        with self._lock:
+            self._entries.pop(self._key(username, password), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = float(stats['hits']) / lookups if lookups else 0.0
+        return stats
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+
+credentials_cache = CredentialCache()
+
+
 def batch_permissions(request):
     # TODO
     pass
@@ -0,0 +1,191 @@
+#########################################################################
+#
+# Copyright (C) 2012 OpenPlans
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+"""Pools of threads running jobs off the request path.
+"""
+
+import os
+import sys
+import Queue
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool(object):
+
+    """
+    A pool of daemon threads consuming a queue of jobs.
+
+    Every job has a key, a job submitted while another one with the same key
+    is still waiting in the queue is dropped, so repeated requests for the
+    same work are coalesced, the waiting job is run with the arguments of the
+    latest request. A job submitted while one with the same key is running
+    is queued again once that one finishes, two jobs with the same key never
+    run at once. Failed jobs are retried with an increasing delay.
+
+    The threads are only started when the first job is submitted. When the
+    pool size (``BACKGROUND_WORKERS`` by default) is 0 the jobs are run
+    synchronously by the caller.
+    """
+
+    def __init__(self, name, size=None, retries=2, retry_delay=5):
+        self.name = name
+        self.size = size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._pending = set()
+        self._running = set()
+        self._rerun = {}
+        self._latest = {}
+        self.counters = dict.fromkeys(
+            ['submitted', 'coalesced', 'completed', 'failed', 'retried'], 0)
+
+    def get_size(self):
+        if self.size is not None:
+            return self.size
+        return getattr(settings, 'BACKGROUND_WORKERS', 0)
+
+    def submit(self, key, func, *args, **kwargs):
+        """Queue ``func(*args, **kwargs)``.
+
+           Returns False if the job was coalesced with a pending one.
+        """
+        if self.get_size() <= 0:
+            self.counters['submitted'] += 1
+            self._run(key, func, args, kwargs, attempt=self.retries)
+            return True
+
+        with self._lock:
+            if self._pid != os.getpid():
+                # the process was forked, the threads did not survive it.
+                self._reset()
+            self.counters['submitted'] += 1
+            if key is not None and key in self._pending:
+                self.counters['coalesced'] += 1
+                self._latest[key] = (func, args, kwargs)
+                return False
+            if key is not None and key in self._rerun:
+                self.counters['coalesced'] += 1
+                self._rerun[key] = (func, args, kwargs)
+                return False
+            if key is not None and key in self._running:
+                # the running job may have read its input already, run it
+                # again once it finishes.
+                self._rerun[key] = (func, args, kwargs)
+                return True
+            self._pending.add(key)
+            self._start()
+        self._queue.put((key, func, args, kwargs, 0))
+        return True
+
+    def is_pending(self, key):
+        return key in self._pending or key in self._running or key in self._rerun
+
+    def join(self):
+        """Block until all the queued jobs have been processed.
+        """
+        if self._threads:
+            self._queue.join()
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats.update(
+            name=self.name,
+            size=self.get_size(),
+            queued=self._queue.qsize(),
+            running=len(self._running))
+        return stats
+
+    def _start(self):
+        while len(self._threads) < self.get_size():
+            thread = threading.Thread(
+                target=self._work,
+                name='%s-%d' % (self.name, len(self._threads)))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            key, func, args, kwargs, attempt = self._queue.get()
+            try:
+                with self._lock:
+                    self._pending.discard(key)
+                    func, args, kwargs = self._latest.pop(key, (func, args, kwargs))
+                    self._running.add(key)
+                self._run(key, func, args, kwargs, attempt)
+            finally:
+                with self._lock:
+                    self._running.discard(key)
+                    rerun = self._rerun.pop(key, None)
+                    if rerun is not None:
+                        if key in self._pending:
+                            # a retry of the job is pending, it runs with these arguments
+                            self._latest[key] = rerun
+                            rerun = None
+                        else:
+                            self._pending.add(key)
+                if rerun is not None:
+                    func, args, kwargs = rerun
+                    self._queue.put((key, func, args, kwargs, 0))
+                self._queue.task_done()
+
+    def _run(self, key, func, args, kwargs, attempt):
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            if attempt < self.retries:
+                self.counters['retried'] += 1
+                self._retry(key, func, args, kwargs, attempt + 1)
+            else:
+                self.counters['failed'] += 1
+                logger.error('[%s] job %s failed', self.name, key, exc_info=sys.exc_info())
+        else:
+            self.counters['completed'] += 1
+        finally:
+            if self._threads:
+                # each thread owns its database connections
+                for conn in connections.all():
+                    conn.close()
+
+    def _retry(self, key, func, args, kwargs, attempt):
+        delay = self.retry_delay * 2 ** (attempt - 1)
+        logger.debug('[%s] retrying job %s in %s seconds', self.name, key, delay)
+
+        def requeue():
+            self._queue.put((key, func, args, kwargs, attempt))
+
+        with self._lock:
+            self._pending.add(key)
+        timer = threading.Timer(delay, requeue)
+        timer.daemon = True
+        timer.start()
+